@@ -0,0 +1,440 @@
+"""
+Cluster harness of the sink: N sink workers (one process each) share a
+SQLite state store and own the devices by consistent hashing, as in a
+clustered deployment, on a single machine and without broker, DB or
+dashboard.
+
+    python benchmarks/cluster_harness.py [--workers 3] [--gateways 2] [--devices 200] ...
+
+Phases:
+    1. each gateway announces itself to a different worker (store_e2gw_pub_info),
+       the gateway is replicated to the other workers through the store;
+    2. joins: the OTAA and edge joins of every device are delivered to every
+       worker (no shared subscription), only the owner handles them;
+    3. uplinks: every frame is delivered to every worker and the gateway of
+       the device reports it (gw_log, new_data every --window edge frames) to
+       a random worker, which forwards the RPC to the owner.
+
+It checks that every device was joined by its owner only and that every
+frame and RPC was handled exactly once, then reports the forwarded RPCs.
+With --experiment-id, the workers store the experiment documents in a spool
+(STORAGE_BACKEND=spool) and it checks that every worker wrote its own one.
+"""
+
+import os, sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# The fleet is synthetic: no preloaded devices
+os.environ.pop("DEVICE_LIST_FILE", None)
+
+import main  # noqa: E402
+import e2l_module._e2l_module as e2l_module_impl  # noqa: E402
+from e2l_module import (  # noqa: E402
+    E2LoRaModule,
+    DEFAULT_APP_PORT,
+    DEFAULT_E2L_APP_PORT,
+    DEFAULT_E2L_JOIN_PORT,
+)
+from cluster_module import Cluster, HashRing, SqliteStateStore  # noqa: E402
+from db_module import list_spool_segments, read_spool_segment  # noqa: E402
+from harness import (  # noqa: E402
+    ApplicationServerClient,
+    InProcessMQTTClient,
+    InProcessApplicationServer,
+    HandlerTimer,
+    SimulatedGateway,
+    SimulatedDevice,
+    TTSMessageFactory,
+)
+
+# No dashboard in the loop, do not wait for it
+e2l_module_impl.DASHBOARD_TIMEOUT_SEC = 0
+
+# Polling interval of the shared state in the workers
+SYNC_INTERVAL_SEC = 0.1
+# Messages per command sent to a worker
+DELIVER_BATCH_SIZE = 500
+# Seconds to wait for a worker answer
+WORKER_TIMEOUT_SEC = 120
+
+# WORKER COMMANDS
+DELIVER_COMMAND = "deliver"
+SYNC_COMMAND = "sync"
+STATS_COMMAND = "stats"
+STOP_COMMAND = "stop"
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def worker_stats(e2l_module, timer, cluster):
+    return {
+        "devices": {
+            record.dev_eui: record.e2gw
+            for record in e2l_module.e2ed_ids.records()
+            if record.in_directory
+        },
+        "gateways": list(e2l_module.e2gw_ids),
+        "handlers": {
+            name: snapshot["count"] for name, snapshot in timer.snapshot().items()
+        },
+        "counters": e2l_module._stats_from_counters(e2l_module.counters.snapshot()),
+        "cluster": cluster.get_stats(),
+    }
+
+
+"""
+    @brief  Entry point of a worker process: a sink (E2LoRaModule, RPC server
+            and in-process MQTT client) member of the cluster, driven by the
+            commands of the harness.
+    @return None.
+"""
+
+
+def run_worker(node_id, nodes, store_path, experiment_id, commands, results):
+    cluster = Cluster(
+        node_id,
+        nodes,
+        SqliteStateStore(store_path),
+        sync_interval=SYNC_INTERVAL_SEC,
+    )
+    e2l_module = E2LoRaModule(
+        dashboard_rpc_endpoint="127.0.0.1:1",
+        experiment_id=experiment_id,
+        cluster=cluster,
+    )
+    timer = HandlerTimer(e2l_module)
+    cluster.start()
+    port = int(nodes[node_id].rsplit(":", 1)[1])
+    app_server = InProcessApplicationServer(e2l_module, port=port)
+    mqtt_client = InProcessMQTTClient(e2l_module, main.subscribe_callback)
+    e2l_module.set_mqtt_client(mqtt_client)
+    results.put(node_id)
+    while True:
+        command, argument = commands.get()
+        if command == DELIVER_COMMAND:
+            for topic, payload in argument:
+                mqtt_client.deliver(topic, payload)
+            results.put(len(argument))
+        elif command == SYNC_COMMAND:
+            results.put(cluster.sync())
+        elif command == STATS_COMMAND:
+            results.put(worker_stats(e2l_module, timer, cluster))
+        elif command == STOP_COMMAND:
+            break
+    app_server.stop()
+    cluster.stop()
+    e2l_module.key_agreement.close()
+    if e2l_module.storage is not None:
+        e2l_module.storage.close()
+    results.put(None)
+
+
+class WorkerHandle:
+    """
+    Harness side of a worker process: command queue, answer queue and RPC client.
+    """
+
+    def __init__(self, context, node_id, nodes, store_path, experiment_id):
+        self.node_id = node_id
+        self.endpoint = nodes[node_id]
+        self.commands = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(
+            target=run_worker,
+            args=(
+                node_id,
+                nodes,
+                store_path,
+                experiment_id,
+                self.commands,
+                self.results,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        self.client = None
+
+    def wait_ready(self):
+        self.results.get(timeout=WORKER_TIMEOUT_SEC)
+        self.client = ApplicationServerClient(self.endpoint)
+
+    def send(self, command, argument=None):
+        self.commands.put((command, argument))
+
+    def answer(self):
+        return self.results.get(timeout=WORKER_TIMEOUT_SEC)
+
+    def stop(self):
+        if self.client is not None:
+            self.client.close()
+        self.send(STOP_COMMAND)
+        self.answer()
+        self.process.join()
+
+
+def call_all(workers, command, argument=None):
+    for worker in workers:
+        worker.send(command, argument)
+    return [worker.answer() for worker in workers]
+
+
+def broadcast(workers, messages):
+    for offset in range(0, len(messages), DELIVER_BATCH_SIZE):
+        batch = messages[offset : offset + DELIVER_BATCH_SIZE]
+        for worker in workers:
+            worker.send(DELIVER_COMMAND, batch)
+    for worker in workers:
+        for _ in range(0, len(messages), DELIVER_BATCH_SIZE):
+            worker.answer()
+
+
+def run_joins(workers, factory, devices):
+    messages = [factory.otaa_join(device) for device in devices]
+    for device in devices:
+        dev_pub_key = device.private_key.public_key().export_key(
+            format="SEC1", compress=True
+        )
+        messages.append(factory.uplink(device, DEFAULT_E2L_JOIN_PORT, dev_pub_key))
+    start = time.perf_counter()
+    broadcast(workers, messages)
+    elapsed = time.perf_counter() - start
+    return {"messages": len(messages), "seconds": elapsed}
+
+
+def run_uplinks(args, workers, factory, devices, gateway_of):
+    rng = random.Random(args.seed)
+    messages = []
+    rpcs = []
+    edge_fcnts = {}
+    legacy_frames = 0
+    new_data_calls = 0
+    for _ in range(args.uplinks):
+        for device in devices:
+            if rng.random() < args.legacy_ratio:
+                f_port, frame_type = DEFAULT_APP_PORT, e2l_module_impl.LEGACY_FRAME
+                legacy_frames += 1
+            else:
+                f_port, frame_type = DEFAULT_E2L_APP_PORT, e2l_module_impl.EDGE_FRAME
+            fcnt = device.fcnt
+            payload = str(int(time.time() * 1000)).encode("utf-8")
+            messages.append(factory.uplink(device, f_port, payload))
+            gw_id = gateway_of[device.dev_eui]
+            rpcs.append(
+                (
+                    rng.choice(workers).client.gw_log,
+                    (gw_id, device.dev_addr, frame_type, fcnt),
+                )
+            )
+            if frame_type != e2l_module_impl.EDGE_FRAME:
+                continue
+            fcnts = edge_fcnts.setdefault(device.dev_eui, [])
+            fcnts.append(fcnt)
+            if len(fcnts) >= args.window:
+                rpcs.append(
+                    (
+                        rng.choice(workers).client.new_data,
+                        (
+                            gw_id,
+                            device.dev_eui,
+                            device.dev_addr,
+                            sum(fcnts) // len(fcnts),
+                            fcnts,
+                        ),
+                    )
+                )
+                edge_fcnts[device.dev_eui] = []
+                new_data_calls += 1
+    start = time.perf_counter()
+    broadcast(workers, messages)
+    mqtt_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for rpc, rpc_args in rpcs:
+        rpc(*rpc_args)
+    rpc_seconds = time.perf_counter() - start
+    return {
+        "mqtt_frames": len(messages),
+        "legacy_frames": legacy_frames,
+        "gw_log_calls": len(messages),
+        "new_data_calls": new_data_calls,
+        "mqtt_seconds": mqtt_seconds,
+        "rpc_seconds": rpc_seconds,
+        "rpc_calls_per_sec": len(rpcs) / rpc_seconds if rpc_seconds > 0 else 0,
+    }
+
+
+def check_report(args, report, devices, ring):
+    errors = []
+    stats = report["workers"]
+    joined = {}
+    for node_id, worker in stats.items():
+        for dev_eui in worker["devices"]:
+            joined.setdefault(dev_eui, []).append(node_id)
+    for device in devices:
+        owners = joined.get(device.dev_eui, [])
+        expected = ring.owner(device.dev_eui)
+        if owners != [expected]:
+            errors.append(f"{device.dev_eui} joined by {owners}, owner {expected}")
+    for node_id, worker in stats.items():
+        if len(worker["gateways"]) != args.gateways:
+            errors.append(f"{node_id} knows {len(worker['gateways'])} gateways")
+        if worker["cluster"]["forward_errors"] > 0:
+            errors.append(
+                f"{node_id}: {worker['cluster']['forward_errors']} forward errors"
+            )
+    uplinks = report["uplinks"]
+    for handler, expected in (
+        ("handle_legacy_data", uplinks["legacy_frames"]),
+        (
+            "handle_edge_data_from_legacy",
+            uplinks["mqtt_frames"] - uplinks["legacy_frames"],
+        ),
+        ("handle_gw_log", uplinks["gw_log_calls"]),
+        ("handle_edge_data", uplinks["new_data_calls"]),
+    ):
+        handled = sum(worker["handlers"].get(handler, 0) for worker in stats.values())
+        if handled != expected:
+            errors.append(f"{handler}: {handled} calls, expected {expected}")
+    return errors
+
+
+def check_spools(args, nodes, spool_dir):
+    errors = []
+    documents = {}
+    for node_id in nodes:
+        # The workers of an experiment do not share their collections (spool)
+        node_spool = os.path.join(spool_dir, f"{args.experiment_id}.{node_id}")
+        if not os.path.isdir(node_spool):
+            errors.append(f"{node_id}: no spool in {node_spool}")
+            continue
+        documents[node_id] = sum(
+            1
+            for path in list_spool_segments(node_spool)
+            for _doc in read_spool_segment(path)
+        )
+        if documents[node_id] == 0:
+            errors.append(f"{node_id}: empty spool {node_spool}")
+    return documents, errors
+
+
+def print_report(report):
+    setup = report["setup"]
+    print(
+        f"{setup['workers']} workers, {setup['gateways']} gateways, "
+        f"{setup['devices']} devices, {setup['uplinks']} uplinks/device"
+    )
+    joins = report["joins"]
+    print(f"joins: {joins['messages']} messages in {joins['seconds']:.2f} s")
+    uplinks = report["uplinks"]
+    print(
+        f"uplinks: {uplinks['mqtt_frames']} MQTT frames in "
+        f"{uplinks['mqtt_seconds']:.2f} s, "
+        f"{uplinks['gw_log_calls'] + uplinks['new_data_calls']} gateway RPCs in "
+        f"{uplinks['rpc_seconds']:.2f} s ({uplinks['rpc_calls_per_sec']:.0f}/s)"
+    )
+    print(
+        f"{'worker':<12} {'devices':>8} {'gw_log':>8} {'new_data':>9} {'forwarded':>10}"
+    )
+    for node_id, worker in report["workers"].items():
+        forwarded = worker["cluster"]["forwarded"]
+        print(
+            f"{node_id:<12} {len(worker['devices']):>8} "
+            f"{worker['handlers'].get('handle_gw_log', 0):>8} "
+            f"{worker['handlers'].get('handle_edge_data', 0):>9} "
+            f"{sum(forwarded.values()):>10}"
+        )
+    for node_id, documents in report.get("spools", {}).items():
+        print(f"{node_id}: {documents} experiment documents spooled")
+    if len(report["errors"]) == 0:
+        print("OK: every device joined by its owner, every frame handled once")
+    for error in report["errors"]:
+        print(f"ERROR: {error}")
+
+
+def main_harness():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--workers", type=int, default=3, help="sink workers")
+    parser.add_argument("--gateways", type=int, default=2)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--uplinks", type=int, default=10, help="uplinks per device")
+    parser.add_argument("--legacy-ratio", type=float, default=0.5)
+    parser.add_argument("--window", type=int, default=5, help="aggregation window")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--experiment-id", help="run an experiment, spooled by every worker"
+    )
+    parser.add_argument("--json", action="store_true", help="print a JSON report")
+    args = parser.parse_args()
+
+    nodes = {
+        f"sink-{index}": f"127.0.0.1:{free_port()}" for index in range(args.workers)
+    }
+    store_path = os.path.join(
+        tempfile.mkdtemp(prefix="e2l-cluster-"), "cluster_state.db"
+    )
+    spool_dir = None
+    if args.experiment_id is not None:
+        # No DB in the loop: the spawned workers read it from the environment
+        spool_dir = os.path.join(os.path.dirname(store_path), "spool")
+        os.environ["STORAGE_BACKEND"] = e2l_module_impl.SPOOL_STORAGE
+        os.environ["SPOOL_DIR"] = spool_dir
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        WorkerHandle(context, node_id, nodes, store_path, args.experiment_id)
+        for node_id in nodes
+    ]
+    for worker in workers:
+        worker.wait_ready()
+
+    # One loopback address per gateway: the DM identifies a gateway by address
+    gateways = [
+        SimulatedGateway(f"127.0.0.{index + 2}").start()
+        for index in range(args.gateways)
+    ]
+    for index, gateway in enumerate(gateways):
+        workers[index % len(workers)].client.announce(gateway)
+    call_all(workers, SYNC_COMMAND)
+
+    factory = TTSMessageFactory()
+    devices = [SimulatedDevice(index) for index in range(args.devices)]
+    report = {"setup": vars(args)}
+    report["joins"] = run_joins(workers, factory, devices)
+    gateway_of = {}
+    for stats in call_all(workers, STATS_COMMAND):
+        gateway_of.update(stats["devices"])
+    report["uplinks"] = run_uplinks(args, workers, factory, devices, gateway_of)
+    report["workers"] = dict(zip(nodes, call_all(workers, STATS_COMMAND)))
+    report["errors"] = check_report(args, report, devices, HashRing(nodes))
+
+    for worker in workers:
+        worker.stop()
+    for gateway in gateways:
+        gateway.stop()
+    if spool_dir is not None:
+        report["spools"], errors = check_spools(args, nodes, spool_dir)
+        report["errors"].extend(errors)
+
+    if args.json:
+        for worker in report["workers"].values():
+            worker["devices"] = len(worker["devices"])
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+    sys.exit(1 if len(report["errors"]) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main_harness()
@@ -0,0 +1,121 @@
+"""
+Microbenchmark of the MQTT payload decoders on recorded TTS messages.
+
+    python benchmarks/decoder_benchmark.py [-n ITERATIONS]
+
+It compares the legacy decoding (json.loads + nested .get chains) with the
+PayloadDecoder backends available in the environment, with and without the
+f_port pre-filter.
+"""
+
+import os, sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from decoder_module import (  # noqa: E402
+    PayloadDecoder,
+    JSON_BACKEND,
+    ORJSON_BACKEND,
+    MSGSPEC_BACKEND,
+)
+from decoder_module._decoder_module import orjson, msgspec  # noqa: E402
+from e2l_module import (  # noqa: E402
+    DEFAULT_APP_PORT,
+    DEFAULT_E2L_APP_PORT,
+    DEFAULT_E2L_JOIN_PORT,
+)
+
+PAYLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+
+# (topic, recorded payload)
+RECORDED_MESSAGES = [
+    ("v3/edge2lora@ttn/devices/e2l-ed-0001/join", "otaa_join.json"),
+    ("v3/edge2lora@ttn/devices/e2l-ed-0001/up", "legacy_uplink.json"),
+    ("v3/edge2lora@ttn/devices/e2l-ed-0001/up", "edge_join_uplink.json"),
+    ("v3/edge2lora@ttn/devices/e2l-ed-0001/up", "edge_uplink.json"),
+    ("v3/edge2lora@ttn/devices/e2l-ed-0001/up", "other_port_uplink.json"),
+]
+
+E2L_PORTS = (DEFAULT_APP_PORT, DEFAULT_E2L_JOIN_PORT, DEFAULT_E2L_APP_PORT)
+
+
+def load_messages():
+    messages = []
+    for topic, file_name in RECORDED_MESSAGES:
+        with open(os.path.join(PAYLOADS_DIR, file_name), "rb") as f:
+            # Compact, as published by the broker
+            payload = json.dumps(json.loads(f.read()), separators=(",", ":"))
+        messages.append((topic, payload.encode("utf-8")))
+    return messages
+
+
+def legacy_decode(topic, payload):
+    payload = json.loads(payload.decode("utf-8"))
+    end_devices_infos = payload.get("end_device_ids")
+    dev_id = end_devices_infos.get("device_id")
+    dev_eui = end_devices_infos.get("dev_eui")
+    dev_addr = end_devices_infos.get("dev_addr")
+    if "/join" in topic:
+        return dev_id, dev_eui, dev_addr
+    uplink_message = payload.get("uplink_message")
+    rx_metadata = uplink_message.get("rx_metadata")[0]
+    return (
+        dev_id,
+        dev_eui,
+        dev_addr,
+        uplink_message.get("f_port"),
+        uplink_message.get("f_cnt"),
+        rx_metadata.get("timestamp"),
+        uplink_message.get("frm_payload"),
+    )
+
+
+def run(decode, messages, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for topic, payload in messages:
+            decode(topic, payload)
+    elapsed = time.perf_counter() - start
+    return elapsed * 1e6 / (iterations * len(messages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    messages = load_messages()
+    candidates = [("legacy json.loads", legacy_decode)]
+    backends = [JSON_BACKEND]
+    if orjson is not None:
+        backends.append(ORJSON_BACKEND)
+    if msgspec is not None:
+        backends.append(MSGSPEC_BACKEND)
+    for backend in backends:
+        candidates.append(
+            (f"{backend}", PayloadDecoder(backend=backend).decode),
+        )
+        candidates.append(
+            (
+                f"{backend} + port filter",
+                PayloadDecoder(backend=backend, ports=E2L_PORTS).decode,
+            ),
+        )
+
+    print(f"{len(messages)} recorded messages, {args.iterations} iterations")
+    baseline = None
+    for name, decode in candidates:
+        us_per_message = run(decode, messages, args.iterations)
+        if baseline is None:
+            baseline = us_per_message
+        print(
+            f"{name:<28} {us_per_message:8.2f} us/msg"
+            f"  {baseline / us_per_message:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+In-process stand-ins used by the replay benchmark: an MQTT client feeding
+main.subscribe_callback, an in-memory (mongomock-style) collection, simulated
+E2GWs served over loopback gRPC and a per-handler latency recorder.
+Nothing here talks to the network outside of 127.0.0.0/8.
+"""
+
+import os, sys
+import copy
+import json
+import time
+import base64
+import threading
+from concurrent import futures
+
+import grpc
+from Crypto.PublicKey import ECC
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from e2gw_rpc_client import (  # noqa: E402
+    edge2gateway_pb2_grpc,
+    GwInfo,
+    GwResponse,
+    E2LData,
+)
+from mqtt_module import DownlinkScheduler  # noqa: E402
+from rpc_module import (  # noqa: E402
+    edge2applicationserver_pb2_grpc,
+    Edge2LoRaApplicationServer,
+)
+from rpc_module.__private__.edge2applicationserver_pb2 import (  # noqa: E402
+    E2GWPubInfo,
+    EdgeData,
+    EdgeDataBatch,
+    GwLog,
+    GwLogBatch,
+)
+
+PAYLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+
+# E2L MODULE HANDLERS TIMED BY THE HARNESS
+TIMED_HANDLERS = (
+    "handle_gw_pub_info",
+    "handle_otaa_join_request",
+    "handle_edge_join_request",
+    "handle_legacy_data",
+    "handle_edge_data_from_legacy",
+    "handle_edge_data",
+    "handle_gw_log",
+    "handle_sys_log",
+    "handle_gw_frames_stats",
+)
+
+
+class InMemoryCollection:
+    """
+    Minimal mongomock-style collection, it only keeps the inserted documents.
+    """
+
+    def __init__(self):
+        self.documents = []
+        self._lock = threading.Lock()
+
+    def insert_one(self, document):
+        with self._lock:
+            self.documents.append(document)
+
+    def insert_many(self, documents, ordered=True):
+        with self._lock:
+            self.documents.extend(documents)
+
+    def create_index(self, keys, **kwargs):
+        return None
+
+    def count_documents(self, filter):
+        with self._lock:
+            return sum(
+                1
+                for document in self.documents
+                if all(document.get(key) == value for key, value in filter.items())
+            )
+
+
+class InMemoryDatabase:
+    """
+    Minimal mongomock-style database, handing out InMemoryCollection objects.
+    """
+
+    def __init__(self):
+        self.collections = {}
+
+    def list_collection_names(self):
+        return list(self.collections)
+
+    def create_collection(self, name, **kwargs):
+        return self.collections.setdefault(name, InMemoryCollection())
+
+    def __getitem__(self, name):
+        return self.create_collection(name)
+
+
+class InProcessMessage:
+    """
+    Stand-in of paho MQTTMessage (topic and raw payload only).
+    """
+
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class InProcessMQTTClient:
+    """
+    Stand-in of MQTTModule: messages are handed to the subscribe callback on the
+    caller thread, downlinks are scheduled but not published.
+    """
+
+    def __init__(self, e2l_module, callback, dispatcher=None):
+        self.e2l_module = e2l_module
+        self.dispatcher = dispatcher
+        self.callback = callback
+        self.published = 0
+        self.downlinks = DownlinkScheduler(self.publish_to_topic)
+
+    def deliver(self, topic, payload):
+        self.callback(self, None, InProcessMessage(topic, payload))
+
+    def publish_to_topic(self, topic, message):
+        self.published += 1
+
+    def send_downlink(
+        self,
+        base_topic,
+        dev_id,
+        base64_message,
+        f_port=3,
+        priority="HIGHEST",
+        gw_id=None,
+    ):
+        self.downlinks.schedule(
+            base_topic, dev_id, base64_message, f_port, priority, gw_id
+        )
+
+
+class HandlerTimer:
+    """
+    Wraps the handlers of an E2LoRaModule instance to record their latency.
+    Every sample is kept, so the percentiles are exact (sub-millisecond
+    handlers would all fall in the first LatencyHistogram bucket).
+    """
+
+    def __init__(self, e2l_module, handler_names=TIMED_HANDLERS):
+        self.samples = {}
+        for name in handler_names:
+            samples = []
+            self.samples[name] = samples
+            setattr(e2l_module, name, self._wrap(getattr(e2l_module, name), samples))
+
+    @staticmethod
+    def _wrap(handler, samples):
+        def timed_handler(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                # list.append is atomic, no lock needed between the workers
+                samples.append((time.perf_counter() - start) * 1000)
+
+        return timed_handler
+
+    def snapshot(self):
+        result = {}
+        for name, samples in self.samples.items():
+            if len(samples) == 0:
+                continue
+            ordered = sorted(samples)
+            result[name] = {
+                "count": len(ordered),
+                "mean_ms": sum(ordered) / len(ordered),
+                "p50_ms": percentile(ordered, 0.5),
+                "p99_ms": percentile(ordered, 0.99),
+                "max_ms": ordered[-1],
+            }
+        return result
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class SimulatedGateway(edge2gateway_pb2_grpc.Edge2GatewayServicer):
+    """
+    E2GW answering the DM RPCs. It owns an ECC key, the g_gw_ed points are
+    computed as a real E2GW would.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.port = None
+        self.private_key = ECC.generate(curve="P-256")
+        self.server = None
+        self.devices = 0
+
+    def start(self, workers=4):
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+        edge2gateway_pb2_grpc.add_Edge2GatewayServicer_to_server(self, self.server)
+        self.port = self.server.add_insecure_port(f"{self.address}:0")
+        self.server.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop(grace=None)
+
+    def pub_key_sec1(self):
+        return self.private_key.public_key().export_key(format="SEC1")
+
+    def handle_ed_pub_info(self, request, context):
+        dev_pub_key = ECC.import_key(request.dev_public_key, curve_name="P-256")
+        g_gw_ed = dev_pub_key.pointQ * self.private_key.d
+        return GwInfo(
+            status_code=0,
+            g_gw_ed=ECC.construct(
+                curve="P-256", point_x=g_gw_ed.x, point_y=g_gw_ed.y
+            ).export_key(format="SEC1"),
+        )
+
+    def update_aggregation_params(self, request, context):
+        return GwResponse(status_code=0)
+
+    def remove_e2device(self, request, context):
+        return E2LData(status_code=0, aggregated_data=0, aggregated_data_num=0)
+
+    def add_devices(self, request, context):
+        self.devices += len(request.device_list)
+        return GwResponse(status_code=0)
+
+    def set_active(self, request, context):
+        return GwResponse(status_code=0)
+
+
+class ApplicationServerClient:
+    """
+    Client stub of an Edge2ApplicationServer, issuing the RPCs of the simulated
+    gateways.
+    """
+
+    def __init__(self, endpoint):
+        self.channel = grpc.insecure_channel(endpoint)
+        self.stub = edge2applicationserver_pb2_grpc.Edge2ApplicationServerStub(
+            self.channel
+        )
+
+    def announce(self, gateway):
+        return self.stub.store_e2gw_pub_info(
+            E2GWPubInfo(
+                gw_ip_addr=gateway.address,
+                gw_port=str(gateway.port),
+                e2gw_pub_key=gateway.pub_key_sec1(),
+            )
+        )
+
+    def gw_log(self, gw_id, dev_addr, frame_type, fcnt):
+        return self.stub.gw_log(
+            GwLog(
+                gw_id=gw_id,
+                dev_addr=dev_addr,
+                log=f"Frame {fcnt} from {dev_addr}",
+                frame_type=frame_type,
+                fcnt=fcnt,
+                timetag=int(time.time() * 1000),
+            )
+        )
+
+    def new_data(self, gw_id, dev_eui, dev_addr, aggregated_data, fcnts):
+        return self.stub.new_data(
+            EdgeData(
+                gw_id=gw_id,
+                dev_eui=dev_eui,
+                dev_addr=dev_addr,
+                aggregated_data=aggregated_data,
+                fcnts=fcnts,
+                timetag=int(time.time() * 1000),
+            )
+        )
+
+    def new_data_batch(self, items):
+        return self.stub.new_data_batch(EdgeDataBatch(items=items))
+
+    def new_data_stream(self, batches):
+        return self.stub.new_data_stream(
+            EdgeDataBatch(items=items) for items in batches
+        )
+
+    def gw_log_batch(self, items):
+        return self.stub.gw_log_batch(GwLogBatch(items=items))
+
+    def gw_log_stream(self, batches):
+        return self.stub.gw_log_stream(GwLogBatch(items=items) for items in batches)
+
+    def close(self):
+        self.channel.close()
+
+
+class InProcessApplicationServer(ApplicationServerClient):
+    """
+    Edge2LoRaApplicationServer served on loopback, with a client stub for the
+    simulated gateways.
+    """
+
+    def __init__(self, e2l_module, workers=10, port=0):
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+        edge2applicationserver_pb2_grpc.add_Edge2ApplicationServerServicer_to_server(
+            Edge2LoRaApplicationServer(e2l_module), self.server
+        )
+        self.port = self.server.add_insecure_port(f"127.0.0.1:{port}")
+        self.server.start()
+        super().__init__(f"127.0.0.1:{self.port}")
+
+    def stop(self):
+        self.close()
+        self.server.stop(grace=None)
+
+
+class SimulatedDevice:
+    """
+    ED of the synthetic fleet, it renders its TTS messages from the recorded
+    payload templates.
+    """
+
+    __slots__ = ("dev_id", "dev_eui", "dev_addr", "fcnt", "private_key")
+
+    def __init__(self, index):
+        self.dev_id = f"e2l-ed-{index:06d}"
+        self.dev_eui = f"70B3D57E{index:08X}"
+        self.dev_addr = f"26{index:06X}"
+        self.fcnt = 0
+        self.private_key = ECC.generate(curve="P-256")
+
+
+class TTSMessageFactory:
+    """
+    Renders TTS join/uplink messages for a device, based on the recorded
+    payloads of benchmarks/payloads.
+    """
+
+    def __init__(self, application="edge2lora@ttn"):
+        self.application = application
+        with open(os.path.join(PAYLOADS_DIR, "otaa_join.json"), "r") as f:
+            self.join_template = json.load(f)
+        with open(os.path.join(PAYLOADS_DIR, "legacy_uplink.json"), "r") as f:
+            self.uplink_template = json.load(f)
+
+    def _topic(self, device, suffix):
+        return f"v3/{self.application}/devices/{device.dev_id}/{suffix}"
+
+    def _with_ids(self, template, device):
+        message = copy.deepcopy(template)
+        end_device_ids = message["end_device_ids"]
+        end_device_ids["device_id"] = device.dev_id
+        end_device_ids["dev_eui"] = device.dev_eui
+        end_device_ids["dev_addr"] = device.dev_addr
+        return message
+
+    def otaa_join(self, device):
+        message = self._with_ids(self.join_template, device)
+        return self._topic(device, "join"), json.dumps(message).encode("utf-8")
+
+    def uplink(self, device, f_port, frm_payload):
+        message = self._with_ids(self.uplink_template, device)
+        uplink_message = message["uplink_message"]
+        uplink_message["f_port"] = f_port
+        uplink_message["f_cnt"] = device.fcnt
+        uplink_message["frm_payload"] = base64.b64encode(frm_payload).decode("utf-8")
+        device.fcnt += 1
+        return self._topic(device, "up"), json.dumps(message).encode("utf-8")
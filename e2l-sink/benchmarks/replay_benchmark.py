@@ -0,0 +1,358 @@
+"""
+Replay benchmark of the sink: a synthetic fleet is driven through the real
+main.subscribe_callback, FrameDispatcher, Edge2LoRaApplicationServer and
+E2LoRaModule, without broker, DB or dashboard.
+
+    python benchmarks/replay_benchmark.py [--gateways 2] [--devices 200] ...
+
+Phases:
+    1. the gateways announce themselves (store_e2gw_pub_info);
+    2. join storm: every device sends the OTAA join and the edge join at once;
+    3. uplinks: each device sends --uplinks frames (legacy or edge, see
+       --legacy-ratio) at --rate frames/s (0: as fast as possible); the
+       gateway of the device reports each frame with gw_log and every
+       --window edge frames with new_data.
+
+It reports the throughput, the handler latency percentiles, the dispatcher
+queue wait and the memory per device.
+"""
+
+import os, sys
+import gc
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from dataclasses import replace
+from queue import Queue
+from threading import Thread
+
+import psutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# The fleet is synthetic: no preloaded devices
+os.environ.pop("DEVICE_LIST_FILE", None)
+
+import main  # noqa: E402
+import e2l_module._e2l_module as e2l_module_impl  # noqa: E402
+from e2l_module import (  # noqa: E402
+    E2LoRaModule,
+    DEFAULT_APP_PORT,
+    DEFAULT_E2L_APP_PORT,
+    DEFAULT_E2L_JOIN_PORT,
+)
+from dispatcher_module import FrameDispatcher  # noqa: E402
+from db_module import LAYOUTS, LAYOUT_SINGLE  # noqa: E402
+from harness import (  # noqa: E402
+    InMemoryDatabase,
+    InProcessMQTTClient,
+    InProcessApplicationServer,
+    HandlerTimer,
+    SimulatedGateway,
+    SimulatedDevice,
+    TTSMessageFactory,
+)
+
+# No dashboard in the loop, do not wait for it
+e2l_module_impl.DASHBOARD_TIMEOUT_SEC = 0
+
+# Seconds between two dispatcher drain checks
+DRAIN_POLL_SEC = 0.01
+
+
+class GatewayReporter:
+    """
+    Issues the gw_log/new_data RPCs of a simulated gateway from its own thread,
+    as an E2GW would while forwarding the fleet frames.
+    """
+
+    def __init__(self, app_server, gateway, window):
+        self.app_server = app_server
+        self.gateway = gateway
+        self.window = window
+        self.calls = 0
+        self._queue = Queue()
+        self._edge_fcnts = {}
+        self._thread = Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def report(self, device, frame_type, fcnt):
+        self._queue.put((device, frame_type, fcnt))
+
+    def join(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            device, frame_type, fcnt = entry
+            self.app_server.gw_log(
+                self.gateway.address, device.dev_addr, frame_type, fcnt
+            )
+            self.calls += 1
+            if frame_type != e2l_module_impl.EDGE_FRAME:
+                continue
+            fcnts = self._edge_fcnts.setdefault(device.dev_eui, [])
+            fcnts.append(fcnt)
+            if len(fcnts) >= self.window:
+                self.app_server.new_data(
+                    self.gateway.address,
+                    device.dev_eui,
+                    device.dev_addr,
+                    sum(fcnts) // len(fcnts),
+                    fcnts,
+                )
+                self.calls += 1
+                self._edge_fcnts[device.dev_eui] = []
+
+
+def wait_drained(dispatcher):
+    if dispatcher is None:
+        return
+    while dispatcher.processed + dispatcher.failed < dispatcher.submitted:
+        time.sleep(DRAIN_POLL_SEC)
+
+
+def rss_bytes():
+    return psutil.Process().memory_info().rss
+
+
+def build_sink(args):
+    e2l_module = E2LoRaModule(dashboard_rpc_endpoint="127.0.0.1:1", experiment_id=None)
+    if args.db:
+        e2l_module.experiment_id = "replay-benchmark"
+        e2l_module.config = replace(
+            e2l_module.config,
+            db_layout=args.db_layout,
+            storage_backend=args.storage,
+            spool_dir=tempfile.mkdtemp(prefix="e2l-spool-"),
+        )
+        if args.storage == e2l_module_impl.SPOOL_STORAGE:
+            e2l_module.storage = e2l_module._init_storage()
+        else:
+            e2l_module.db_layout = e2l_module._init_db_layout(InMemoryDatabase())
+            e2l_module.collection = e2l_module.db_layout.collection_for(
+                e2l_module_impl.STATS_DOC_TYPE
+            )
+            e2l_module.storage = e2l_module._init_db_writer(e2l_module.collection)
+    timer = HandlerTimer(e2l_module)
+    dispatcher = None
+    if args.workers > 0:
+        dispatcher = FrameDispatcher(
+            handler=lambda message: main.process_message(e2l_module, message)[0],
+            workers=args.workers,
+            queue_size=args.queue_size,
+        )
+        dispatcher.start()
+    mqtt_client = InProcessMQTTClient(
+        e2l_module, main.subscribe_callback, dispatcher=dispatcher
+    )
+    e2l_module.set_mqtt_client(mqtt_client)
+    return e2l_module, timer, dispatcher, mqtt_client
+
+
+def run_join_storm(args, e2l_module, dispatcher, mqtt_client, factory, devices):
+    messages = []
+    for device in devices:
+        messages.append(factory.otaa_join(device))
+    for device in devices:
+        dev_pub_key = device.private_key.public_key().export_key(
+            format="SEC1", compress=True
+        )
+        messages.append(factory.uplink(device, DEFAULT_E2L_JOIN_PORT, dev_pub_key))
+    gc.collect()
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    for topic, payload in messages:
+        mqtt_client.deliver(topic, payload)
+    wait_drained(dispatcher)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    result = {
+        "messages": len(messages),
+        "seconds": elapsed,
+        "joins_per_sec": len(devices) / elapsed,
+        "rss_bytes_per_device": (rss_bytes() - rss_before) / len(devices),
+        "joined_devices": sum(
+            1 for record in e2l_module.e2ed_ids.records() if record.in_directory
+        ),
+    }
+    if args.tracemalloc:
+        traced, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["traced_bytes_per_device"] = traced / len(devices)
+    return result
+
+
+def run_uplinks(args, e2l_module, dispatcher, mqtt_client, factory, devices, reporters):
+    rng = random.Random(args.seed)
+    rounds = []
+    for _ in range(args.uplinks):
+        frames = []
+        for device in devices:
+            if rng.random() < args.legacy_ratio:
+                f_port, frame_type = DEFAULT_APP_PORT, e2l_module_impl.LEGACY_FRAME
+            else:
+                f_port, frame_type = DEFAULT_E2L_APP_PORT, e2l_module_impl.EDGE_FRAME
+            fcnt = device.fcnt
+            payload = str(int(time.time() * 1000)).encode("utf-8")
+            topic, message = factory.uplink(device, f_port, payload)
+            frames.append((device, frame_type, fcnt, topic, message))
+        rounds.append(frames)
+    gateway_of = {}
+    for device in devices:
+        record = e2l_module.e2ed_ids.get(device.dev_eui)
+        gateway_of[device.dev_eui] = reporters.get(getattr(record, "e2gw", None))
+
+    start = time.perf_counter()
+    for round_index, frames in enumerate(rounds):
+        if args.rate > 0:
+            delay = start + round_index / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        for device, frame_type, fcnt, topic, message in frames:
+            mqtt_client.deliver(topic, message)
+            reporter = gateway_of[device.dev_eui]
+            if reporter is not None:
+                reporter.report(device, frame_type, fcnt)
+    wait_drained(dispatcher)
+    for reporter in reporters.values():
+        reporter.join()
+    elapsed = time.perf_counter() - start
+    mqtt_frames = args.uplinks * len(devices)
+    rpc_calls = sum(reporter.calls for reporter in reporters.values())
+    return {
+        "mqtt_frames": mqtt_frames,
+        "rpc_calls": rpc_calls,
+        "seconds": elapsed,
+        "mqtt_frames_per_sec": mqtt_frames / elapsed,
+        "rpc_calls_per_sec": rpc_calls / elapsed,
+        "frames_per_sec": (mqtt_frames + rpc_calls) / elapsed,
+    }
+
+
+def print_report(report):
+    setup = report["setup"]
+    print(
+        f"{setup['gateways']} gateways, {setup['devices']} devices, "
+        f"{setup['uplinks']} uplinks/device, dispatcher workers: {setup['workers']}, "
+        f"db: {setup['db']}"
+    )
+    join = report["join_storm"]
+    print(
+        f"join storm: {join['joined_devices']}/{setup['devices']} joined in "
+        f"{join['seconds']:.2f} s ({join['joins_per_sec']:.1f} joins/s), "
+        f"RSS {join['rss_bytes_per_device'] / 1024:.1f} KiB/device"
+        + (
+            f", traced {join['traced_bytes_per_device'] / 1024:.1f} KiB/device"
+            if "traced_bytes_per_device" in join
+            else ""
+        )
+    )
+    uplinks = report["uplinks"]
+    print(
+        f"uplinks: {uplinks['mqtt_frames']} MQTT frames + {uplinks['rpc_calls']} "
+        f"gateway RPCs in {uplinks['seconds']:.2f} s -> "
+        f"{uplinks['frames_per_sec']:.0f} frames/s "
+        f"(MQTT {uplinks['mqtt_frames_per_sec']:.0f}/s, "
+        f"RPC {uplinks['rpc_calls_per_sec']:.0f}/s)"
+    )
+    print(f"{'handler':<30} {'count':>8} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, snapshot in report["handlers"].items():
+        print(
+            f"{name:<30} {snapshot['count']:>8} {snapshot['p50_ms']:>9.3f} "
+            f"{snapshot['p99_ms']:>9.3f} {snapshot['max_ms']:>9.3f}"
+        )
+    for frame_type, snapshot in report.get("queue_wait", {}).items():
+        print(
+            f"queue wait {str(frame_type):<19} {snapshot['count']:>8} "
+            f"{snapshot['p50_ms']:>9.3f} {snapshot['p99_ms']:>9.3f} "
+            f"{snapshot['max_ms']:>9.3f}"
+        )
+    if "db" in report:
+        print(f"storage: {report['db']}")
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--gateways", type=int, default=2)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--uplinks", type=int, default=20, help="uplinks per device")
+    parser.add_argument(
+        "--rate", type=float, default=0, help="uplinks/s per device, 0: unthrottled"
+    )
+    parser.add_argument("--legacy-ratio", type=float, default=0.5)
+    parser.add_argument("--window", type=int, default=10, help="aggregation window")
+    parser.add_argument("--workers", type=int, default=4, help="dispatcher workers")
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--no-db", dest="db", action="store_false")
+    parser.add_argument("--db-layout", choices=LAYOUTS, default=LAYOUT_SINGLE)
+    parser.add_argument(
+        "--storage",
+        choices=(e2l_module_impl.MONGO_STORAGE, e2l_module_impl.SPOOL_STORAGE),
+        default=e2l_module_impl.MONGO_STORAGE,
+        help="in-memory Mongo collections or local spool (temporary directory)",
+    )
+    parser.add_argument("--tracemalloc", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print a JSON report")
+    args = parser.parse_args()
+
+    e2l_module, timer, dispatcher, mqtt_client = build_sink(args)
+    app_server = InProcessApplicationServer(e2l_module)
+    # One loopback address per gateway: the DM identifies a gateway by address
+    gateways = [
+        SimulatedGateway(f"127.0.0.{index + 2}").start()
+        for index in range(args.gateways)
+    ]
+    for gateway in gateways:
+        app_server.announce(gateway)
+    factory = TTSMessageFactory()
+    devices = [SimulatedDevice(index) for index in range(args.devices)]
+
+    report = {"setup": vars(args)}
+    report["join_storm"] = run_join_storm(
+        args, e2l_module, dispatcher, mqtt_client, factory, devices
+    )
+    reporters = {
+        gateway.address: GatewayReporter(app_server, gateway, args.window)
+        for gateway in gateways
+    }
+    report["uplinks"] = run_uplinks(
+        args, e2l_module, dispatcher, mqtt_client, factory, devices, reporters
+    )
+    report["handlers"] = timer.snapshot()
+    if dispatcher is not None:
+        report["queue_wait"] = dispatcher.get_stats()["queue_wait"]
+        dispatcher.stop()
+    if e2l_module.storage is not None:
+        e2l_module.storage.flush()
+        report["db"] = {
+            key: value
+            for key, value in e2l_module.storage.get_stats().items()
+            if not isinstance(value, dict)
+        }
+
+    app_server.stop()
+    for gateway in gateways:
+        gateway.stop()
+    e2l_module.key_agreement.close()
+
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main_benchmark()
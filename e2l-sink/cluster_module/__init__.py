@@ -0,0 +1,13 @@
+from ._hash_ring import HashRing, device_key
+from ._state_store import StateStore, MemoryStateStore, SqliteStateStore
+from ._cluster import (
+    Cluster,
+    parse_cluster_nodes,
+    open_state_store,
+    PRIVATE_KEY_STATE,
+    GATEWAY_STATE_PREFIX,
+    AGGREGATION_STATE,
+    DEVICE_ADDR_STATE_PREFIX,
+    FORWARDED_METADATA_KEY,
+    MEMORY_STORE,
+)
@@ -0,0 +1,358 @@
+import os
+import logging
+import grpc
+from threading import Thread, Lock, Event
+from Crypto.PublicKey import ECC
+from rpc_module import edge2applicationserver_pb2_grpc
+from ._hash_ring import HashRing, device_key, DEFAULT_VNODES
+from ._state_store import MemoryStateStore, SqliteStateStore
+
+log = logging.getLogger(__name__)
+
+# SHARED STATE KEYS
+# Private key of the application server (PEM), the same on every worker
+PRIVATE_KEY_STATE = "as_private_key"
+# gateway/<gw_id> -> {"port", "pub_key"}, in announce order
+GATEWAY_STATE_PREFIX = "gateway/"
+# [aggregation_function, window_size]
+AGGREGATION_STATE = "aggregation_params"
+# dev_addr/<dev_addr> -> dev_eui (owner lookup of the gw_log RPCs)
+DEVICE_ADDR_STATE_PREFIX = "dev_addr/"
+
+# Metadata of the RPCs forwarded to the owner (never forwarded again)
+FORWARDED_METADATA_KEY = "e2l-forwarded-by"
+
+# In-process state store (CLUSTER_STORE)
+MEMORY_STORE = ":memory:"
+
+# DEFAULTS
+DEFAULT_SYNC_INTERVAL_SEC = 0.5
+DEFAULT_FORWARD_TIMEOUT_SEC = 5
+
+
+"""
+    @brief  This function parses the cluster workers.
+    @param nodes: "<node_id>=<host>:<port>,..." (RPC endpoints of the workers).
+    @return dict node_id -> RPC endpoint.
+"""
+
+
+def parse_cluster_nodes(nodes):
+    result = {}
+    for node in nodes.split(","):
+        node = node.strip()
+        if len(node) == 0:
+            continue
+        node_id, separator, endpoint = node.partition("=")
+        if separator == "" or len(node_id) == 0 or len(endpoint) == 0:
+            raise Exception(f"Invalid cluster node: {node}")
+        result[node_id.strip()] = endpoint.strip()
+    return result
+
+
+"""
+    @brief  This function opens the shared state store.
+    @param path: The SQLite file, MEMORY_STORE for an in-process store.
+    @return StateStore
+"""
+
+
+def open_state_store(path):
+    if path == MEMORY_STORE:
+        return MemoryStateStore()
+    directory = os.path.dirname(path)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    return SqliteStateStore(path)
+
+
+class Cluster:
+    """
+    Membership of a sink worker in the cluster: the devices are owned by the
+    workers by consistent hashing of their Dev EUI, the gateway RPCs about a
+    device are forwarded to its owner and the state shared by the workers
+    (private key, gateways, aggregation params) goes through the StateStore.
+    The changes of the store are applied by the listeners, in version order,
+    on sync (periodic and on demand).
+    """
+
+    def __init__(self, node_id, nodes, store, **kwargs) -> None:
+        if node_id not in nodes:
+            raise Exception(f"Cluster node {node_id} not in {sorted(nodes)}")
+        self.node_id = node_id
+        self.nodes = dict(nodes)
+        self.store = store
+        self.ring = HashRing(self.nodes, vnodes=kwargs.get("vnodes", DEFAULT_VNODES))
+        self.sync_interval = kwargs.get("sync_interval", DEFAULT_SYNC_INTERVAL_SEC)
+        self.forward_timeout = kwargs.get(
+            "forward_timeout", DEFAULT_FORWARD_TIMEOUT_SEC
+        )
+        self._forward_metadata = ((FORWARDED_METADATA_KEY, node_id),)
+        self._listeners = []
+        self._version = 0
+        self._sync_lock = Lock()
+        self._channels = {}
+        self._stubs = {}
+        self._async_stubs = {}
+        # grpc.aio channels, closed by stop_async from the event loop
+        self._async_channels = {}
+        self._stubs_lock = Lock()
+        self._dev_addrs = {}
+        self._stop_event = Event()
+        self._sync_thread = None
+
+        # Counters
+        self.forwarded = {}
+        self.forward_errors = 0
+        self._counters_lock = Lock()
+
+    """
+        @brief  This function returns the worker owning a device.
+        @param dev_eui: The Dev EUI.
+        @return The node id.
+    """
+
+    def owner(self, dev_eui):
+        return self.ring.owner(device_key(dev_eui))
+
+    def owns(self, dev_eui):
+        return self.owner(dev_eui) == self.node_id
+
+    """
+        @brief  This function returns the private key shared by the workers,
+                generated by the first one.
+        @return ECC key.
+    """
+
+    def shared_private_key(self):
+        pem = self.store.put_if_absent(
+            PRIVATE_KEY_STATE, ECC.generate(curve="P-256").export_key(format="PEM")
+        )
+        return ECC.import_key(pem)
+
+    """
+        @brief  This function registers a function applying the changes of the shared state.
+        @param prefix: The prefix of the keys.
+        @param listener: function(key, value).
+        @return None.
+    """
+
+    def add_listener(self, prefix, listener):
+        self._listeners.append((prefix, listener))
+
+    def publish(self, key, value):
+        return self.store.put(key, value)
+
+    """
+        @brief  This function applies the changes of the shared state since the last sync.
+        @return The number of changes applied.
+    """
+
+    def sync(self):
+        with self._sync_lock:
+            changes = self.store.changes(self._version)
+            for version, key, value in changes:
+                for prefix, listener in self._listeners:
+                    if not key.startswith(prefix):
+                        continue
+                    try:
+                        listener(key, value)
+                    except Exception:
+                        log.exception(f"Unable to apply shared state {key}")
+                self._version = version
+        return len(changes)
+
+    def _sync_loop(self):
+        while not self._stop_event.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception:
+                log.exception("Unable to sync the shared state")
+
+    """
+        @brief  This function applies the shared state and starts the periodic sync.
+        @return None.
+    """
+
+    def start(self):
+        self.sync()
+        self._sync_thread = Thread(
+            target=self._sync_loop, name="cluster-sync", daemon=True
+        )
+        self._sync_thread.start()
+        log.info(
+            f"Cluster node {self.node_id} started ({len(self.nodes)} nodes, version {self._version})"
+        )
+
+    """
+        @brief  This function stops the sync and closes the channels to the workers.
+        @return None.
+        @note The grpc.aio channels (forward_async) are closed by stop_async.
+    """
+
+    def stop(self):
+        self._stop_event.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join()
+        with self._stubs_lock:
+            for channel in self._channels.values():
+                channel.close()
+            self._channels = {}
+            self._stubs = {}
+            self._async_stubs = {}
+        self.store.close()
+
+    """
+        @brief  Coroutine version of stop, closing the grpc.aio channels too.
+                It shall be awaited from the event loop of the channels.
+        @return None.
+    """
+
+    async def stop_async(self):
+        with self._stubs_lock:
+            channels = list(self._async_channels.values())
+            self._async_channels = {}
+            self._async_stubs = {}
+        for channel in channels:
+            await channel.close()
+        self.stop()
+
+    """
+        @brief  This function records the address of a device, for the owner lookup.
+        @param dev_eui: The Dev EUI.
+        @param dev_addr: The Dev Addr.
+        @return None.
+    """
+
+    def publish_device(self, dev_eui, dev_addr):
+        if dev_addr is None or self._dev_addrs.get(dev_addr) == dev_eui:
+            return
+        self.store.put(DEVICE_ADDR_STATE_PREFIX + dev_addr, dev_eui)
+        self._dev_addrs[dev_addr] = dev_eui
+
+    """
+        @brief  This function returns the Dev EUI of a Dev Addr known by any worker.
+        @param dev_addr: The Dev Addr.
+        @return The Dev EUI, None if unknown.
+    """
+
+    def lookup_dev_eui(self, dev_addr):
+        dev_eui = self._dev_addrs.get(dev_addr)
+        if dev_eui is None:
+            dev_eui = self.store.get(DEVICE_ADDR_STATE_PREFIX + dev_addr)
+            if dev_eui is not None:
+                self._dev_addrs[dev_addr] = dev_eui
+        return dev_eui
+
+    """
+        @brief  This function returns the worker a RPC about a device shall be forwarded to.
+        @param dev_eui: The Dev EUI, None if unknown.
+        @param context: The RPC context.
+        @return The node id, None if the RPC shall be handled locally.
+    """
+
+    def forward_target(self, dev_eui, context):
+        if dev_eui is None:
+            return None
+        owner = self.owner(dev_eui)
+        if owner == self.node_id:
+            return None
+        for key, _value in context.invocation_metadata():
+            if key == FORWARDED_METADATA_KEY:
+                # Forwarded by a worker with another view of the ring
+                return None
+        return owner
+
+    def _get_stub(self, node_id, stubs, channel_factory):
+        stub = stubs.get(node_id)
+        if stub is None:
+            with self._stubs_lock:
+                stub = stubs.get(node_id)
+                if stub is None:
+                    channel = channel_factory(self.nodes[node_id])
+                    stub = edge2applicationserver_pb2_grpc.Edge2ApplicationServerStub(
+                        channel
+                    )
+                    if stubs is self._stubs:
+                        self._channels[node_id] = channel
+                    else:
+                        self._async_channels[node_id] = channel
+                    stubs[node_id] = stub
+        return stub
+
+    def _count_forward(self, method):
+        with self._counters_lock:
+            self.forwarded[method] = self.forwarded.get(method, 0) + 1
+
+    def _count_forward_error(self):
+        with self._counters_lock:
+            self.forward_errors += 1
+
+    """
+        @brief  This function forwards a RPC to the owner of the device.
+        @param node_id: The owner.
+        @param method: The RPC name (e.g. new_data).
+        @param request: The RPC request.
+        @return The owner response.
+        @note It raises grpc.RpcError if the owner is not reachable.
+    """
+
+    def forward(self, node_id, method, request):
+        stub = self._get_stub(node_id, self._stubs, grpc.insecure_channel)
+        try:
+            response = getattr(stub, method)(
+                request, metadata=self._forward_metadata, timeout=self.forward_timeout
+            )
+        except grpc.RpcError:
+            self._count_forward_error()
+            raise
+        self._count_forward(method)
+        return response
+
+    """
+        @brief  Coroutine version of forward (grpc.aio channels, asyncio runtime).
+    """
+
+    async def forward_async(self, node_id, method, request):
+        stub = self._get_stub(node_id, self._async_stubs, grpc.aio.insecure_channel)
+        try:
+            response = await getattr(stub, method)(
+                request, metadata=self._forward_metadata, timeout=self.forward_timeout
+            )
+        except grpc.RpcError:
+            self._count_forward_error()
+            raise
+        self._count_forward(method)
+        return response
+
+    def get_stats(self):
+        with self._counters_lock:
+            forwarded = dict(self.forwarded)
+            forward_errors = self.forward_errors
+        return {
+            "node_id": self.node_id,
+            "nodes": len(self.nodes),
+            "state_version": self._version,
+            "forwarded": forwarded,
+            "forward_errors": forward_errors,
+        }
+
+    def collect_metrics(self, writer):
+        stats = self.get_stats()
+        for method, count in stats["forwarded"].items():
+            writer.counter(
+                "e2l_cluster_forwarded_rpcs_total",
+                "Gateway RPCs forwarded to the device owner.",
+                count,
+                {"method": method},
+            )
+        writer.counter(
+            "e2l_cluster_forward_errors_total",
+            "Gateway RPCs not forwarded (owner unreachable).",
+            stats["forward_errors"],
+        )
+        writer.gauge(
+            "e2l_cluster_state_version",
+            "Last shared state version applied.",
+            stats["state_version"],
+        )
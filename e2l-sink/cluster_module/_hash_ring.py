@@ -0,0 +1,55 @@
+import bisect
+import hashlib
+
+# Virtual nodes per worker: the more, the more even the device spread
+DEFAULT_VNODES = 64
+
+
+def _hash(key):
+    return int.from_bytes(
+        hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+"""
+    @brief  This function normalizes a Dev EUI (the gateways and TTS may differ in case).
+    @param dev_eui: The Dev EUI.
+    @return The hashed key.
+"""
+
+
+def device_key(dev_eui):
+    return dev_eui.upper()
+
+
+class HashRing:
+    """
+    Consistent hash ring of the cluster workers: each worker owns the keys
+    hashed between its virtual nodes and the previous ones, so adding or
+    removing a worker only moves the keys of its neighbours.
+    """
+
+    def __init__(self, nodes, **kwargs) -> None:
+        self.vnodes = kwargs.get("vnodes", DEFAULT_VNODES)
+        self.nodes = tuple(sorted(nodes))
+        if len(self.nodes) == 0:
+            raise Exception("Empty hash ring")
+        points = []
+        for node in self.nodes:
+            for vnode in range(self.vnodes):
+                points.append((_hash(f"{node}#{vnode}"), node))
+        points.sort()
+        self._points = [point for point, _node in points]
+        self._owners = [node for _point, node in points]
+
+    """
+        @brief  This function returns the worker owning a key.
+        @param key: The key (e.g. a Dev EUI).
+        @return The node id.
+    """
+
+    def owner(self, key):
+        position = bisect.bisect(self._points, _hash(key))
+        if position == len(self._points):
+            position = 0
+        return self._owners[position]
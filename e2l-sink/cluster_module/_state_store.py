@@ -0,0 +1,171 @@
+import json
+import sqlite3
+import logging
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+# Seconds a writer waits for the SQLite lock held by another worker
+SQLITE_BUSY_TIMEOUT_SEC = 10
+
+
+class StateStore:
+    """
+    Key-value store shared by the cluster workers. Every write gets a version,
+    increasing across the workers, so that a worker can apply the changes of
+    the others in order (changes).
+    The values are JSON-serializable.
+    """
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    """
+        @brief  This function stores a value.
+        @param key: The key.
+        @param value: The value.
+        @return The version of the write.
+    """
+
+    def put(self, key, value):
+        raise NotImplementedError
+
+    """
+        @brief  This function stores a value if the key is not set yet.
+        @param key: The key.
+        @param value: The value.
+        @return The value stored, the existing one if any.
+    """
+
+    def put_if_absent(self, key, value):
+        raise NotImplementedError
+
+    """
+        @brief  This function returns the keys written after a version.
+        @param version: The last version applied, 0 for all the keys.
+        @return list of (version, key, value), in version order.
+    """
+
+    def changes(self, version):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """
+    In-process store: the workers of one process (tests, harness) share it.
+    """
+
+    def __init__(self) -> None:
+        self._values = {}
+        self._version = 0
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._values.get(key)
+        return default if entry is None else entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._version += 1
+            self._values[key] = (self._version, value)
+            return self._version
+
+    def put_if_absent(self, key, value):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None:
+                return entry[1]
+            self._version += 1
+            self._values[key] = (self._version, value)
+            return value
+
+    def changes(self, version):
+        with self._lock:
+            entries = [
+                (entry_version, key, value)
+                for key, (entry_version, value) in self._values.items()
+                if entry_version > version
+            ]
+        entries.sort(key=lambda entry: entry[0])
+        return entries
+
+
+class SqliteStateStore(StateStore):
+    """
+    Store in a SQLite file, shared by the workers of one machine.
+    The writes are serialized by the SQLite write lock (BEGIN IMMEDIATE).
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._lock = Lock()
+        self._connection = sqlite3.connect(
+            path,
+            timeout=SQLITE_BUSY_TIMEOUT_SEC,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, version INTEGER NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS state_version ON state (version)"
+        )
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM state WHERE key = ?", (key,)
+            ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def _write(self, key, value, replace):
+        with self._lock:
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if not replace:
+                    row = connection.execute(
+                        "SELECT value FROM state WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        connection.execute("COMMIT")
+                        return None, json.loads(row[0])
+                (version,) = connection.execute(
+                    "SELECT COALESCE(MAX(version), 0) + 1 FROM state"
+                ).fetchone()
+                connection.execute(
+                    "INSERT OR REPLACE INTO state (key, value, version) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), version),
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return version, value
+
+    def put(self, key, value):
+        version, _value = self._write(key, value, replace=True)
+        return version
+
+    def put_if_absent(self, key, value):
+        _version, value = self._write(key, value, replace=False)
+        return value
+
+    def changes(self, version):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT version, key, value FROM state WHERE version > ? ORDER BY version",
+                (version,),
+            ).fetchall()
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
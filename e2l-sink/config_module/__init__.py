@@ -0,0 +1,8 @@
+from ._config_module import RuntimeConfig
+
+from ._config_module import (
+    get_config,
+    reload_config,
+    add_reload_listener,
+    install_sighup_handler,
+)
@@ -0,0 +1,445 @@
+import os
+import signal
+import logging
+from dataclasses import dataclass, fields
+from threading import RLock
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+# Env file re-read on reload (the environment of a running process is fixed)
+CONFIG_ENV_FILE_VAR = "CONFIG_ENV_FILE"
+
+
+def _get_str(environ, name, default=None):
+    return environ.get(name, default)
+
+
+def _get_int(environ, name, default):
+    value = environ.get(name)
+    if value is None or not value.isnumeric():
+        return default
+    return int(value)
+
+
+def _get_ms(environ, name, default_sec):
+    value = environ.get(name)
+    if value is None or not value.isnumeric():
+        return default_sec
+    return int(value) / 1000
+
+
+def _get_flag(environ, name):
+    return environ.get(name, "0") == "1"
+
+
+@dataclass(frozen=True)
+class RuntimeConfig:
+    """
+    Sink settings, parsed once from the environment.
+    Hot-reloadable fields are read at use time by the modules, the others
+    (see RESTART_REQUIRED_FIELDS) are only applied at startup.
+    """
+
+    # MQTT
+    mqtt_username: Optional[str] = None
+    mqtt_password: Optional[str] = None
+    mqtt_host: Optional[str] = None
+    mqtt_port: Optional[int] = None
+    mqtt_base_topic: Optional[str] = None
+    mqtt_uplink_topic: Optional[str] = None
+    mqtt_otaa_topic: Optional[str] = None
+    mqtt_protocol: str = "3.1.1"
+    mqtt_client_id: Optional[str] = None
+    mqtt_clean_session: bool = True
+    mqtt_share_group: Optional[str] = None
+    mqtt_clients: int = 1
+    mqtt_uplink_qos: int = 0
+    mqtt_otaa_qos: int = 0
+    # DOWNLINKS
+    downlink_coalesce_window: float = 0
+    downlink_gw_rate: int = 0
+    downlink_gw_burst: int = 10
+    # RPC
+    rpc_server_port: Optional[int] = None
+    dashboard_rpc_host: Optional[str] = None
+    dashboard_rpc_port: Optional[int] = None
+    dashboard_debounce: float = 0.5
+    dashboard_heartbeat: float = 5
+    dashboard_reconnect_max: float = 30
+    # MONGO
+    mongo_host: str = "localhost"
+    mongo_port: int = 27017
+    mongo_db_name: str = "experiments_db"
+    db_layout: str = "single"
+    # STORAGE BACKEND (experiment documents)
+    storage_backend: str = "mongo"
+    spool_dir: str = "spool"
+    spool_codec: str = "auto"
+    spool_segment_mb: int = 64
+    # DEVICES
+    device_list_file: Optional[str] = None
+    device_list_parser: str = "auto"
+    # AGGREGATION
+    default_aggr_window_size: int = 10
+    # GW SHUT (handover test)
+    gw_shut: bool = False
+    device_number: int = 0
+    packet_number: int = 0
+    packet_divisor: int = 4
+    # RUNTIME
+    e2l_runtime: str = "threaded"
+    payload_decoder: str = "auto"
+    dispatcher_workers: int = 4
+    dispatcher_queue_size: int = 10000
+    # DB WRITER
+    db_writer_batch_size: int = 500
+    db_writer_flush_interval: float = 0.2
+    db_writer_queue_size: int = 20000
+    db_writer_backpressure: str = "block"
+    db_writer_spill_file: Optional[str] = None
+    # KEY AGREEMENT
+    key_cache_size: int = 4096
+    key_agreement_workers: int = 0
+    key_agreement_batch_size: int = 32
+    # E2GW RPC
+    gw_rpc_timeout: float = 5
+    gw_rpc_retries: int = 2
+    gw_rpc_keepalive_ms: int = 30000
+    gw_fan_out_workers: int = 16
+    aggr_params_deadline: Optional[float] = None
+    # METRICS ENDPOINT (disabled if no port)
+    metrics_host: str = "0.0.0.0"
+    metrics_port: Optional[int] = None
+    # Cluster (several sink workers sharing the devices)
+    cluster_node_id: Optional[str] = None
+    cluster_nodes: Optional[str] = None
+    cluster_store: str = "cluster_state.db"
+    cluster_vnodes: int = 64
+    cluster_sync_interval: float = 0.5
+    # Persistent active directory and AS private key
+    state_dir: Optional[str] = None
+    state_snapshot_records: int = 10000
+    state_fsync: bool = False
+    keystore_file: Optional[str] = None
+    keystore_passphrase: Optional[str] = None
+    # Replay window of the fcnts per device (0 disables the deduplication)
+    fcnt_window: int = 1024
+    # Legacy payloads kept per device to check the edge aggregates, in
+    # aggregation windows (0 disables the reference aggregation)
+    reference_windows: int = 4
+
+    """
+        @brief  This function parses the settings from the environment.
+        @param environ: The environment (mapping), os.environ by default.
+        @return RuntimeConfig
+    """
+
+    @classmethod
+    def from_env(cls, environ=None):
+        if environ is None:
+            environ = os.environ
+        default = cls()
+        return cls(
+            mqtt_username=_get_str(environ, "MQTT_USERNAME"),
+            mqtt_password=_get_str(environ, "MQTT_PASSWORD"),
+            mqtt_host=_get_str(environ, "MQTT_HOST"),
+            mqtt_port=_get_int(environ, "MQTT_PORT", None),
+            mqtt_base_topic=_get_str(environ, "MQTT_BASE_TOPIC"),
+            mqtt_uplink_topic=_get_str(environ, "MQTT_UPLINK_TOPIC"),
+            mqtt_otaa_topic=_get_str(environ, "MQTT_OTAA_TOPIC"),
+            mqtt_protocol=_get_str(environ, "MQTT_PROTOCOL", default.mqtt_protocol),
+            mqtt_client_id=_get_str(environ, "MQTT_CLIENT_ID") or None,
+            mqtt_clean_session=_get_str(environ, "MQTT_CLEAN_SESSION", "1") == "1",
+            mqtt_share_group=_get_str(environ, "MQTT_SHARE_GROUP") or None,
+            mqtt_clients=max(
+                1, _get_int(environ, "MQTT_CLIENTS", default.mqtt_clients)
+            ),
+            mqtt_uplink_qos=_get_int(
+                environ, "MQTT_UPLINK_QOS", default.mqtt_uplink_qos
+            ),
+            mqtt_otaa_qos=_get_int(environ, "MQTT_OTAA_QOS", default.mqtt_otaa_qos),
+            downlink_coalesce_window=_get_ms(
+                environ,
+                "DOWNLINK_COALESCE_WINDOW_MS",
+                default.downlink_coalesce_window,
+            ),
+            downlink_gw_rate=_get_int(
+                environ, "DOWNLINK_GW_RATE", default.downlink_gw_rate
+            ),
+            downlink_gw_burst=_get_int(
+                environ, "DOWNLINK_GW_BURST", default.downlink_gw_burst
+            ),
+            rpc_server_port=_get_int(environ, "RPC_SERVER_PORT", None),
+            dashboard_rpc_host=_get_str(environ, "DASHBOARD_RPC_HOST"),
+            dashboard_rpc_port=_get_int(environ, "DASHBOARD_RPC_PORT", None),
+            dashboard_debounce=_get_ms(
+                environ, "DASHBOARD_DEBOUNCE_MS", default.dashboard_debounce
+            ),
+            dashboard_heartbeat=_get_ms(
+                environ, "DASHBOARD_HEARTBEAT_MS", default.dashboard_heartbeat
+            ),
+            dashboard_reconnect_max=_get_ms(
+                environ, "DASHBOARD_RECONNECT_MAX_MS", default.dashboard_reconnect_max
+            ),
+            mongo_host=_get_str(environ, "MONGO_HOST", default.mongo_host),
+            mongo_port=_get_int(environ, "MONGO_PORT", default.mongo_port),
+            mongo_db_name=_get_str(environ, "MONGO_DB_NAME", default.mongo_db_name),
+            db_layout=_get_str(environ, "DB_LAYOUT", default.db_layout),
+            storage_backend=_get_str(
+                environ, "STORAGE_BACKEND", default.storage_backend
+            ),
+            spool_dir=_get_str(environ, "SPOOL_DIR", default.spool_dir),
+            spool_codec=_get_str(environ, "SPOOL_CODEC", default.spool_codec),
+            spool_segment_mb=_get_int(
+                environ, "SPOOL_SEGMENT_MB", default.spool_segment_mb
+            ),
+            device_list_file=_get_str(environ, "DEVICE_LIST_FILE"),
+            device_list_parser=_get_str(
+                environ, "DEVICE_LIST_PARSER", default.device_list_parser
+            ),
+            default_aggr_window_size=_get_int(
+                environ, "DEFAULT_AGGR_WINDOWS_SIZE", default.default_aggr_window_size
+            ),
+            gw_shut=_get_flag(environ, "GW_SHUT"),
+            device_number=_get_int(environ, "DEVICE_NUMBER", default.device_number),
+            packet_number=_get_int(environ, "PACKET_NUMBER", default.packet_number),
+            packet_divisor=_get_int(environ, "PACKET_DIVISOR", default.packet_divisor),
+            e2l_runtime=_get_str(environ, "E2L_RUNTIME", default.e2l_runtime),
+            payload_decoder=_get_str(
+                environ, "PAYLOAD_DECODER", default.payload_decoder
+            ),
+            dispatcher_workers=_get_int(
+                environ, "DISPATCHER_WORKERS", default.dispatcher_workers
+            ),
+            dispatcher_queue_size=_get_int(
+                environ, "DISPATCHER_QUEUE_SIZE", default.dispatcher_queue_size
+            ),
+            db_writer_batch_size=_get_int(
+                environ, "DB_WRITER_BATCH_SIZE", default.db_writer_batch_size
+            ),
+            db_writer_flush_interval=_get_ms(
+                environ, "DB_WRITER_FLUSH_INTERVAL_MS", default.db_writer_flush_interval
+            ),
+            db_writer_queue_size=_get_int(
+                environ, "DB_WRITER_QUEUE_SIZE", default.db_writer_queue_size
+            ),
+            db_writer_backpressure=_get_str(
+                environ, "DB_WRITER_BACKPRESSURE", default.db_writer_backpressure
+            ),
+            db_writer_spill_file=_get_str(environ, "DB_WRITER_SPILL_FILE"),
+            key_cache_size=_get_int(
+                environ, "E2L_KEY_CACHE_SIZE", default.key_cache_size
+            ),
+            key_agreement_workers=_get_int(
+                environ, "KEY_AGREEMENT_WORKERS", default.key_agreement_workers
+            ),
+            key_agreement_batch_size=_get_int(
+                environ, "KEY_AGREEMENT_BATCH_SIZE", default.key_agreement_batch_size
+            ),
+            gw_rpc_timeout=_get_ms(
+                environ, "GW_RPC_TIMEOUT_MS", default.gw_rpc_timeout
+            ),
+            gw_rpc_retries=_get_int(environ, "GW_RPC_RETRIES", default.gw_rpc_retries),
+            gw_rpc_keepalive_ms=_get_int(
+                environ, "GW_RPC_KEEPALIVE_MS", default.gw_rpc_keepalive_ms
+            ),
+            gw_fan_out_workers=max(
+                1,
+                _get_int(environ, "GW_FAN_OUT_WORKERS", default.gw_fan_out_workers),
+            ),
+            aggr_params_deadline=_get_ms(environ, "AGGR_PARAMS_DEADLINE_MS", None),
+            metrics_host=_get_str(environ, "METRICS_HOST", default.metrics_host),
+            metrics_port=_get_int(environ, "METRICS_PORT", None),
+            cluster_node_id=_get_str(environ, "CLUSTER_NODE_ID") or None,
+            cluster_nodes=_get_str(environ, "CLUSTER_NODES") or None,
+            cluster_store=_get_str(environ, "CLUSTER_STORE", default.cluster_store),
+            cluster_vnodes=_get_int(environ, "CLUSTER_VNODES", default.cluster_vnodes),
+            cluster_sync_interval=_get_ms(
+                environ, "CLUSTER_SYNC_INTERVAL_MS", default.cluster_sync_interval
+            ),
+            state_dir=_get_str(environ, "STATE_DIR") or None,
+            state_snapshot_records=_get_int(
+                environ, "STATE_SNAPSHOT_RECORDS", default.state_snapshot_records
+            ),
+            state_fsync=_get_flag(environ, "STATE_FSYNC"),
+            keystore_file=_get_str(environ, "KEYSTORE_FILE") or None,
+            keystore_passphrase=_get_str(environ, "KEYSTORE_PASSPHRASE") or None,
+            fcnt_window=_get_int(environ, "FCNT_WINDOW", default.fcnt_window),
+            reference_windows=_get_int(
+                environ, "REFERENCE_WINDOWS", default.reference_windows
+            ),
+        )
+
+    """
+        @brief  This function returns the packet limit that triggers the GW shut.
+        @return The packet limit, None if the GW shut is disabled or misconfigured.
+    """
+
+    def gw_shut_packet_limit(self):
+        if (
+            not self.gw_shut
+            or self.packet_number <= 0
+            or self.device_number <= 0
+            or self.packet_divisor <= 0
+        ):
+            return None
+        return int((self.packet_number * self.device_number) / self.packet_divisor)
+
+
+# Only applied at startup (sockets, pools, DB connection)
+RESTART_REQUIRED_FIELDS = frozenset(
+    (
+        "mqtt_username",
+        "mqtt_password",
+        "mqtt_host",
+        "mqtt_port",
+        "mqtt_uplink_topic",
+        "mqtt_otaa_topic",
+        "mqtt_protocol",
+        "mqtt_client_id",
+        "mqtt_clean_session",
+        "mqtt_share_group",
+        "mqtt_clients",
+        "mqtt_uplink_qos",
+        "mqtt_otaa_qos",
+        "downlink_coalesce_window",
+        "downlink_gw_rate",
+        "downlink_gw_burst",
+        "rpc_server_port",
+        "dashboard_rpc_host",
+        "dashboard_rpc_port",
+        "dashboard_debounce",
+        "dashboard_heartbeat",
+        "dashboard_reconnect_max",
+        "mongo_host",
+        "mongo_port",
+        "mongo_db_name",
+        "db_layout",
+        "storage_backend",
+        "spool_dir",
+        "spool_codec",
+        "spool_segment_mb",
+        "device_list_file",
+        "device_list_parser",
+        "e2l_runtime",
+        "payload_decoder",
+        "dispatcher_workers",
+        "dispatcher_queue_size",
+        "db_writer_batch_size",
+        "db_writer_flush_interval",
+        "db_writer_queue_size",
+        "db_writer_backpressure",
+        "db_writer_spill_file",
+        "key_cache_size",
+        "key_agreement_workers",
+        "key_agreement_batch_size",
+        "gw_rpc_keepalive_ms",
+        "gw_fan_out_workers",
+        "metrics_host",
+        "metrics_port",
+        "cluster_node_id",
+        "cluster_nodes",
+        "cluster_store",
+        "cluster_vnodes",
+        "cluster_sync_interval",
+        "state_dir",
+        "state_snapshot_records",
+        "state_fsync",
+        "keystore_file",
+        "keystore_passphrase",
+        "fcnt_window",
+        "reference_windows",
+    )
+)
+
+_config = None
+_config_lock = RLock()
+_reload_listeners = []
+
+
+def _read_environ():
+    environ = dict(os.environ)
+    env_file = environ.get(CONFIG_ENV_FILE_VAR)
+    if env_file is not None and os.path.isfile(env_file):
+        from dotenv import dotenv_values
+
+        environ.update(
+            {
+                name: value
+                for name, value in dotenv_values(env_file).items()
+                if value is not None
+            }
+        )
+    return environ
+
+
+"""
+    @brief  This function returns the current configuration, loading it on the first call.
+    @return RuntimeConfig
+"""
+
+
+def get_config():
+    global _config
+    config = _config
+    if config is not None:
+        return config
+    with _config_lock:
+        if _config is None:
+            _config = RuntimeConfig.from_env(_read_environ())
+        return _config
+
+
+"""
+    @brief  This function reloads the configuration and notifies the listeners.
+    @return The new RuntimeConfig.
+"""
+
+
+def reload_config():
+    global _config
+    with _config_lock:
+        old_config = _config
+        new_config = RuntimeConfig.from_env(_read_environ())
+        _config = new_config
+        listeners = list(_reload_listeners)
+    if old_config is not None:
+        for field in fields(RuntimeConfig):
+            old_value = getattr(old_config, field.name)
+            new_value = getattr(new_config, field.name)
+            if old_value == new_value:
+                continue
+            if field.name in RESTART_REQUIRED_FIELDS:
+                log.warning(f"{field.name} changed, it is applied at the next restart")
+            else:
+                log.info(f"{field.name} changed")
+    for listener in listeners:
+        try:
+            listener(new_config)
+        except Exception:
+            log.exception("Error applying the new configuration")
+    return new_config
+
+
+"""
+    @brief  This function registers a function called with the new RuntimeConfig on reload.
+    @param listener: The function.
+    @return None.
+"""
+
+
+def add_reload_listener(listener):
+    with _config_lock:
+        _reload_listeners.append(listener)
+
+
+"""
+    @brief  This function installs the SIGHUP handler reloading the configuration.
+            It shall be called from the main thread.
+    @return None.
+"""
+
+
+def install_sighup_handler():
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_config())
@@ -0,0 +1,28 @@
+from ._storage import StorageBackend
+from ._db_module import BufferedMongoWriter
+
+from ._db_module import (
+    BACKPRESSURE_BLOCK,
+    BACKPRESSURE_DROP_OLDEST,
+    BACKPRESSURE_SPILL,
+    BACKPRESSURE_POLICIES,
+)
+
+from ._layout import ExperimentLayout, MonotonicIdGenerator
+
+from ._layout import (
+    LAYOUT_SINGLE,
+    LAYOUT_PER_TYPE,
+    LAYOUT_TIMESERIES,
+    LAYOUTS,
+)
+
+from ._spool import (
+    SpoolStorageBackend,
+    load_spool,
+    read_spool_manifest,
+    list_spool_segments,
+    read_spool_segment,
+)
+
+from ._spool import CODEC_AUTO, CODEC_MSGPACK, CODEC_JSON, CODECS
@@ -0,0 +1,240 @@
+import json
+import time
+import atexit
+import logging
+from collections import deque
+from threading import Thread, Condition, Lock
+from pymongo.errors import BulkWriteError, PyMongoError
+from metrics_module import LatencyHistogram
+from ._storage import StorageBackend
+
+log = logging.getLogger(__name__)
+
+# BACKPRESSURE POLICIES
+BACKPRESSURE_BLOCK = "block"
+BACKPRESSURE_DROP_OLDEST = "drop_oldest"
+BACKPRESSURE_SPILL = "spill"
+BACKPRESSURE_POLICIES = (
+    BACKPRESSURE_BLOCK,
+    BACKPRESSURE_DROP_OLDEST,
+    BACKPRESSURE_SPILL,
+)
+
+# DEFAULTS
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL_SEC = 0.2
+DEFAULT_MAX_QUEUE_SIZE = 20000
+
+
+class BufferedMongoWriter(StorageBackend):
+    """
+    This class buffers the documents to be stored in a MongoDB collection and
+    writes them from a background thread with insert_many.
+    With a router (document -> collection), each batch is split per collection.
+    """
+
+    def __init__(self, collection, **kwargs) -> None:
+        self.router = kwargs.get("router", None)
+        if collection is None and self.router is None:
+            raise Exception("Missing collection")
+        self.collection = collection
+        self.batch_size = max(1, kwargs.get("batch_size", DEFAULT_BATCH_SIZE))
+        self.flush_interval = kwargs.get("flush_interval", DEFAULT_FLUSH_INTERVAL_SEC)
+        self.max_queue_size = max(
+            self.batch_size, kwargs.get("max_queue_size", DEFAULT_MAX_QUEUE_SIZE)
+        )
+        self.backpressure = kwargs.get("backpressure", BACKPRESSURE_BLOCK)
+        if self.backpressure not in BACKPRESSURE_POLICIES:
+            raise Exception(f"Unknown backpressure policy: {self.backpressure}")
+        self.spill_path = kwargs.get("spill_path", None)
+        if self.backpressure == BACKPRESSURE_SPILL and self.spill_path is None:
+            raise Exception("Spill backpressure requires a spill file")
+        self._spill_file = None
+        # Spill file, dropped and spilled counters (producers and flush thread)
+        self._spill_lock = Lock()
+
+        self._queue = deque()
+        self._cond = Condition()
+        self._stopped = False
+        self._in_flight = 0
+
+        # Counters
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.write_errors = 0
+        self.flush_latency = LatencyHistogram()
+
+        self._flush_thread = Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.close)
+
+    """
+        @brief  This function enqueues a document to be written.
+        @param doc: The document.
+        @return True if the document was enqueued, False if it was spilled.
+    """
+
+    def insert(self, doc):
+        with self._cond:
+            while len(self._queue) >= self.max_queue_size and not self._stopped:
+                if not self._flush_thread.is_alive():
+                    break
+                if self.backpressure == BACKPRESSURE_BLOCK:
+                    self._cond.wait(self.flush_interval)
+                elif self.backpressure == BACKPRESSURE_DROP_OLDEST:
+                    self._queue.popleft()
+                    with self._spill_lock:
+                        self.dropped += 1
+                else:
+                    break
+            if self._stopped:
+                raise Exception("Writer is closed")
+            if not self._flush_thread.is_alive():
+                # Nobody will drain the queue
+                log.error("DB writer thread is not running, spilling the document")
+            elif len(self._queue) < self.max_queue_size:
+                self._queue.append(doc)
+                self.enqueued += 1
+                if len(self._queue) >= self.batch_size:
+                    self._cond.notify_all()
+                return True
+        self._spill_batch([doc])
+        return False
+
+    """
+        @brief  This function blocks until every enqueued document is written.
+        @return None.
+    """
+
+    def flush(self):
+        with self._cond:
+            self._cond.notify_all()
+            while (len(self._queue) > 0 or self._in_flight > 0) and (
+                self._flush_thread.is_alive()
+            ):
+                self._cond.wait(self.flush_interval)
+
+    """
+        @brief  This function flushes the pending documents and stops the writer.
+        @return None.
+    """
+
+    def close(self):
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify_all()
+        self._flush_thread.join()
+        with self._spill_lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+    """
+        @brief  This function returns the writer counters.
+        @return dict with queue depth, flush latency and dropped documents.
+    """
+
+    def get_stats(self):
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue_size": self.max_queue_size,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "write_errors": self.write_errors,
+            "flush_latency": self.flush_latency.snapshot(),
+        }
+
+    def _next_batch(self):
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch_len = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(batch_len)]
+            self._in_flight = batch_len
+            if batch_len > 0:
+                self._cond.notify_all()
+            return batch
+
+    def _flush_loop(self):
+        while True:
+            batch = self._next_batch()
+            if len(batch) > 0:
+                try:
+                    self._write(batch)
+                except Exception:
+                    # A bad batch must not stop the writer
+                    log.exception(f"Unable to write {len(batch)} documents")
+                    self.write_errors += len(batch)
+                    self._spill_batch(batch)
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+                if self._stopped and len(self._queue) == 0:
+                    return
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        if self.router is None:
+            self._write_to(self.collection, batch)
+        else:
+            groups = {}
+            for doc in batch:
+                groups.setdefault(self.router(doc), []).append(doc)
+            for collection, docs in groups.items():
+                self._write_to(collection, docs)
+        self.flush_latency.observe((time.perf_counter() - start) * 1000)
+
+    def _write_to(self, collection, batch):
+        try:
+            collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            errors = len(e.details.get("writeErrors", []))
+            self.write_errors += errors
+            self.written += e.details.get("nInserted", len(batch) - errors)
+            log.warning(f"{errors} documents rejected by DB")
+        except PyMongoError as e:
+            log.error(f"Unable to write {len(batch)} documents: {e}")
+            self.write_errors += len(batch)
+            self._spill_batch(batch)
+        except Exception:
+            # e.g. bson InvalidDocument, not a PyMongoError
+            log.exception(f"Unable to write {len(batch)} documents")
+            self.write_errors += len(batch)
+            self._spill_batch(batch)
+
+    def _spill_batch(self, docs):
+        with self._spill_lock:
+            if self.spill_path is None:
+                log.error(f"No spill file, {len(docs)} documents lost")
+                self.dropped += len(docs)
+                return
+            if self._spill(docs):
+                self.spilled += len(docs)
+            else:
+                self.dropped += len(docs)
+
+    def _spill(self, docs):
+        # Called with _spill_lock held. A spill error is reported here only: the
+        # caller must not count or spill the documents again
+        try:
+            if self._spill_file is None:
+                self._spill_file = open(self.spill_path, "a")
+            for doc in docs:
+                self._spill_file.write(json.dumps(doc, default=str))
+                self._spill_file.write("\n")
+            self._spill_file.flush()
+        except OSError as e:
+            log.error(f"Unable to spill {len(docs)} documents, lost: {e}")
+            return False
+        return True
@@ -0,0 +1,161 @@
+import time
+import logging
+from threading import Lock
+from datetime import datetime, timedelta
+
+log = logging.getLogger(__name__)
+
+# COLLECTION LAYOUTS
+# One collection per experiment, ISO string ids (legacy)
+LAYOUT_SINGLE = "single"
+# One collection per experiment and doc type (<experiment_id>.<doc_type>)
+LAYOUT_PER_TYPE = "per_type"
+# As LAYOUT_PER_TYPE, with MongoDB time-series collections
+LAYOUT_TIMESERIES = "timeseries"
+LAYOUTS = (LAYOUT_SINGLE, LAYOUT_PER_TYPE, LAYOUT_TIMESERIES)
+
+# DOCUMENT FIELDS
+TYPE_FIELD = "type"
+# DM time of the document (BSON date), time field of the time-series collections
+TIME_FIELD = "ts"
+# Bucketing field of the time-series collections
+META_FIELD = "gw_id"
+TIMESERIES_GRANULARITY = "seconds"
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class MonotonicIdGenerator:
+    """
+    Strictly increasing document ids: microseconds since the epoch, bumped by one
+    when two documents are stamped in the same microsecond (bursts) or the clock
+    goes back.
+    """
+
+    def __init__(self):
+        self._last = 0
+        self._lock = Lock()
+
+    def next_id(self):
+        now = time.time_ns() // 1000
+        with self._lock:
+            if now <= self._last:
+                now = self._last + 1
+            self._last = now
+        return now
+
+
+class ExperimentLayout:
+    """
+    This class maps the experiment documents to their MongoDB collections,
+    creates the collections with their secondary indexes and stamps the documents
+    (unique id and DM time) before they are written.
+    """
+
+    def __init__(self, db, experiment_id, **kwargs) -> None:
+        self.db = db
+        self.experiment_id = experiment_id
+        self.layout = kwargs.get("layout", LAYOUT_SINGLE)
+        if self.layout not in LAYOUTS:
+            raise Exception(f"Unknown DB layout: {self.layout}")
+        self.doc_types = tuple(kwargs.get("doc_types", ()))
+        # doc type -> list of index keys, e.g. [("dev_addr", 1), ("fcnt", 1)]
+        self.indexes = kwargs.get("indexes", {})
+        self._ids = MonotonicIdGenerator()
+        self._collections = {}
+
+    def _collection_name(self, doc_type):
+        if self.layout == LAYOUT_SINGLE:
+            return self.experiment_id
+        return f"{self.experiment_id}.{doc_type}"
+
+    """
+        @brief  This function creates the experiment collections and indexes.
+        @param exist_ok: Reuse the collections of an existing experiment.
+        @return None.
+        @note It raises an exception if the experiment already exists and not exist_ok.
+    """
+
+    def create(self, exist_ok=False):
+        existing = self.db.list_collection_names()
+        prefix = f"{self.experiment_id}."
+        if any(
+            name == self.experiment_id or name.startswith(prefix) for name in existing
+        ):
+            if exist_ok:
+                return
+            raise Exception(
+                "Experiment ID already exists, please change the experiment ID."
+            )
+        if self.layout == LAYOUT_SINGLE:
+            self.db.create_collection(self.experiment_id)
+            collection = self.db[self.experiment_id]
+            created = set()
+            # The doc type is the first key: the documents share the collection
+            for doc_type in self.doc_types:
+                for keys in self.indexes.get(doc_type, ()):
+                    keys = [(TYPE_FIELD, 1)] + [tuple(key) for key in keys]
+                    if tuple(keys) in created:
+                        continue
+                    created.add(tuple(keys))
+                    collection.create_index(keys)
+            for doc_type in self.doc_types:
+                self._collections[doc_type] = collection
+            return
+        for doc_type in self.doc_types:
+            name = self._collection_name(doc_type)
+            if self.layout == LAYOUT_TIMESERIES:
+                self.db.create_collection(
+                    name,
+                    timeseries={
+                        "timeField": TIME_FIELD,
+                        "metaField": META_FIELD,
+                        "granularity": TIMESERIES_GRANULARITY,
+                    },
+                )
+            else:
+                self.db.create_collection(name)
+            collection = self.db[name]
+            for keys in self.indexes.get(doc_type, ()):
+                collection.create_index([tuple(key) for key in keys])
+            self._collections[doc_type] = collection
+        log.info(f"Created {len(self._collections)} {self.layout} collections")
+
+    """
+        @brief  This function returns the collection of a doc type.
+        @param doc_type: The doc type.
+        @return The collection.
+    """
+
+    def collection_for(self, doc_type):
+        collection = self._collections.get(doc_type)
+        if collection is None:
+            collection = self.db[self._collection_name(doc_type)]
+            self._collections[doc_type] = collection
+        return collection
+
+    """
+        @brief  This function returns the collection of a document (writer router).
+        @param doc: The document.
+        @return The collection.
+    """
+
+    def route(self, doc):
+        return self.collection_for(doc.get(TYPE_FIELD))
+
+    """
+        @brief  This function stamps a document with a unique id and the DM time.
+        @param doc: The document (modified in place).
+        @return The document.
+        @note The single layout keeps the ISO string ids, unique to the microsecond.
+    """
+
+    def stamp(self, doc):
+        doc_id = self._ids.next_id()
+        now = _EPOCH + timedelta(microseconds=doc_id)
+        if self.layout == LAYOUT_SINGLE:
+            doc["_id"] = f'{now.strftime("%Y-%m-%dT%H:%M:%S.%f")}Z'
+        else:
+            doc["_id"] = doc_id
+        doc[TIME_FIELD] = now
+        return doc
@@ -0,0 +1,380 @@
+import os
+import json
+import time
+import struct
+import atexit
+import logging
+from threading import Thread, Lock, Event
+from datetime import datetime, timezone
+from pymongo.errors import BulkWriteError
+from metrics_module import LatencyHistogram
+from ._storage import StorageBackend
+from ._layout import ExperimentLayout, LAYOUT_TIMESERIES, TIME_FIELD
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+log = logging.getLogger(__name__)
+
+# SPOOL CODECS
+CODEC_AUTO = "auto"
+CODEC_MSGPACK = "msgpack"
+CODEC_JSON = "json"
+CODECS = (CODEC_AUTO, CODEC_MSGPACK, CODEC_JSON)
+_CODEC_IDS = {CODEC_MSGPACK: 1, CODEC_JSON: 2}
+
+# SEGMENT FORMAT: magic, codec id, then <u32 big endian length><payload> records
+SEGMENT_MAGIC = b"E2LSPOOL"
+SEGMENT_SUFFIX = ".seg"
+# Segment being written, renamed to SEGMENT_SUFFIX once sealed
+OPEN_SEGMENT_SUFFIX = ".seg.open"
+MANIFEST_FILE = "manifest.json"
+_LENGTH = struct.Struct(">I")
+
+# DEFAULTS
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_FLUSH_INTERVAL_SEC = 0.2
+DEFAULT_LOAD_BATCH_SIZE = 5000
+# Write buffer of the open segment
+SEGMENT_BUFFER_BYTES = 1024 * 1024
+
+# MongoDB duplicate key error (segment imported twice)
+DUPLICATE_KEY_ERROR = 11000
+
+# Extended JSON tag of the datetimes (json codec)
+JSON_DATE_KEY = "$date"
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {JSON_DATE_KEY: value.isoformat()}
+    return str(value)
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and JSON_DATE_KEY in obj:
+        return datetime.fromisoformat(obj[JSON_DATE_KEY])
+    return obj
+
+
+def _msgpack_default(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(value)
+    return str(value)
+
+
+def _get_encoder(codec):
+    if codec == CODEC_MSGPACK:
+        packer = msgpack.Packer(default=_msgpack_default, use_bin_type=True)
+        return packer.pack
+    return lambda doc: json.dumps(
+        doc, default=_json_default, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _get_decoder(codec):
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise Exception("msgpack is required to read this spool")
+        return lambda payload: msgpack.unpackb(payload, raw=False, timestamp=3)
+    return lambda payload: json.loads(payload, object_hook=_json_object_hook)
+
+
+def _segment_index(file_name):
+    return int(file_name.split(".", 1)[0])
+
+
+class SpoolStorageBackend(StorageBackend):
+    """
+    Local append-only storage: the documents are appended, length-prefixed
+    (msgpack if installed, JSON otherwise), to segment files rotated by size.
+    The spool is imported into MongoDB after the run by load_spool.
+    """
+
+    def __init__(self, spool_dir, **kwargs) -> None:
+        if spool_dir is None:
+            raise Exception("Missing spool directory")
+        self.spool_dir = spool_dir
+        codec = kwargs.get("codec", CODEC_AUTO)
+        if codec not in CODECS:
+            raise Exception(f"Unknown spool codec: {codec}")
+        if codec == CODEC_AUTO:
+            codec = CODEC_MSGPACK if msgpack is not None else CODEC_JSON
+        if codec == CODEC_MSGPACK and msgpack is None:
+            raise Exception(
+                "msgpack spool codec requested but msgpack is not installed"
+            )
+        self.codec = codec
+        self.segment_bytes = kwargs.get("segment_bytes", DEFAULT_SEGMENT_BYTES)
+        self.flush_interval = kwargs.get("flush_interval", DEFAULT_FLUSH_INTERVAL_SEC)
+        self._encode = _get_encoder(codec)
+
+        os.makedirs(spool_dir, exist_ok=True)
+        # Describes the spool to the loader (experiment, layout, indexes)
+        manifest = dict(kwargs.get("metadata", {}))
+        manifest["codec"] = codec
+        with open(os.path.join(spool_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        # Never overwrite a segment left in the directory (the sink refuses to
+        # start an experiment whose spool has segments)
+        indexes = [
+            _segment_index(file_name)
+            for file_name in os.listdir(spool_dir)
+            if file_name.endswith(SEGMENT_SUFFIX)
+            or file_name.endswith(OPEN_SEGMENT_SUFFIX)
+        ]
+        self._next_segment = max(indexes, default=-1) + 1
+
+        self._lock = Lock()
+        self._stopped = False
+        self._file = None
+        self._segment_path = None
+        self._segment_size = 0
+
+        # Counters
+        self.enqueued = 0
+        self.written = 0
+        self.write_errors = 0
+        self.bytes_written = 0
+        self.segments = 0
+        self.flush_latency = LatencyHistogram()
+
+        self._open_segment()
+        self._stop_event = Event()
+        self._flush_thread = Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.close)
+
+    """
+        @brief  This function appends a document to the open segment.
+        @param doc: The document.
+        @return True if the document was appended.
+    """
+
+    def insert(self, doc):
+        payload = self._encode(doc)
+        record = _LENGTH.pack(len(payload)) + payload
+        with self._lock:
+            if self._stopped:
+                raise Exception("Spool is closed")
+            self.enqueued += 1
+            try:
+                self._file.write(record)
+            except OSError as e:
+                self.write_errors += 1
+                log.error(f"Unable to write to spool: {e}")
+                return False
+            self.written += 1
+            self.bytes_written += len(record)
+            self._segment_size += len(record)
+            if self._segment_size >= self.segment_bytes:
+                self._seal_segment()
+                self._open_segment()
+        return True
+
+    """
+        @brief  This function hands the buffered records over to the OS.
+        @return None.
+    """
+
+    def flush(self):
+        start = time.perf_counter()
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+        self.flush_latency.observe((time.perf_counter() - start) * 1000)
+
+    """
+        @brief  This function seals the open segment and stops the spool.
+        @return None.
+    """
+
+    def close(self):
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._seal_segment()
+        self._stop_event.set()
+        self._flush_thread.join()
+
+    def get_stats(self):
+        return {
+            "codec": self.codec,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "write_errors": self.write_errors,
+            "bytes_written": self.bytes_written,
+            "segments": self.segments,
+            "flush_latency": self.flush_latency.snapshot(),
+        }
+
+    def _open_segment(self):
+        file_name = f"{self._next_segment:08d}{OPEN_SEGMENT_SUFFIX}"
+        self._next_segment += 1
+        self._segment_path = os.path.join(self.spool_dir, file_name)
+        self._file = open(self._segment_path, "wb", buffering=SEGMENT_BUFFER_BYTES)
+        self._file.write(SEGMENT_MAGIC + bytes((_CODEC_IDS[self.codec],)))
+        self._segment_size = 0
+        self.segments += 1
+
+    def _seal_segment(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        sealed_path = self._segment_path[: -len(OPEN_SEGMENT_SUFFIX)] + SEGMENT_SUFFIX
+        os.replace(self._segment_path, sealed_path)
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+
+"""
+    @brief  This function reads the manifest of a spool.
+    @param spool_dir: The spool directory.
+    @return dict (experiment_id, db_layout, doc_types, indexes, codec).
+"""
+
+
+def read_spool_manifest(spool_dir):
+    with open(os.path.join(spool_dir, MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+
+"""
+    @brief  This function lists the segments of a spool, in write order.
+    @param spool_dir: The spool directory.
+    @param include_open: Also list the segments not sealed (sink still running or crashed).
+    @return list of segment paths.
+"""
+
+
+def list_spool_segments(spool_dir, include_open=False):
+    suffixes = (
+        (SEGMENT_SUFFIX, OPEN_SEGMENT_SUFFIX) if include_open else (SEGMENT_SUFFIX,)
+    )
+    file_names = [
+        file_name
+        for file_name in os.listdir(spool_dir)
+        if any(file_name.endswith(suffix) for suffix in suffixes)
+    ]
+    return [
+        os.path.join(spool_dir, file_name)
+        for file_name in sorted(file_names, key=_segment_index)
+    ]
+
+
+"""
+    @brief  This function reads the documents of a segment.
+    @param path: The segment path.
+    @return Generator of documents.
+    @note A truncated last record (crash while writing) ends the segment.
+"""
+
+
+def read_spool_segment(path):
+    with open(path, "rb") as f:
+        header = f.read(len(SEGMENT_MAGIC) + 1)
+        if len(header) < len(SEGMENT_MAGIC) + 1 or header[:-1] != SEGMENT_MAGIC:
+            raise Exception(f"Not a spool segment: {path}")
+        codecs = {codec_id: codec for codec, codec_id in _CODEC_IDS.items()}
+        codec = codecs.get(header[-1])
+        if codec is None:
+            raise Exception(f"Unknown codec in segment: {path}")
+        decode = _get_decoder(codec)
+        while True:
+            prefix = f.read(_LENGTH.size)
+            if len(prefix) < _LENGTH.size:
+                return
+            (length,) = _LENGTH.unpack(prefix)
+            payload = f.read(length)
+            if len(payload) < length:
+                log.warning(f"Truncated record at the end of {path}")
+                return
+            yield decode(payload)
+
+
+def _stored_ids(collection, docs):
+    # The time range lets MongoDB only scan the buckets of the batch
+    times = [doc[TIME_FIELD] for doc in docs]
+    cursor = collection.find(
+        {
+            TIME_FIELD: {"$gte": min(times), "$lte": max(times)},
+            "_id": {"$in": [doc["_id"] for doc in docs]},
+        },
+        {"_id": 1},
+    )
+    return {doc["_id"] for doc in cursor}
+
+
+"""
+    @brief  This function bulk-imports a spool into MongoDB. Importing a spool
+            twice is harmless: the documents already stored are skipped (duplicate
+            key errors, looked up by _id in the time-series collections which
+            have no unique _id index).
+    @param spool_dir: The spool directory.
+    @param db: The MongoDB database.
+    @param batch_size: Documents per insert_many.
+    @param include_open: Also import the segments not sealed.
+    @return dict with the segments, documents, inserted and duplicates counts.
+"""
+
+
+def load_spool(spool_dir, db, batch_size=DEFAULT_LOAD_BATCH_SIZE, include_open=False):
+    manifest = read_spool_manifest(spool_dir)
+    layout = ExperimentLayout(
+        db,
+        manifest["experiment_id"],
+        layout=manifest["db_layout"],
+        doc_types=manifest.get("doc_types", ()),
+        indexes=manifest.get("indexes", {}),
+    )
+    layout.create(exist_ok=True)
+    report = {"segments": 0, "documents": 0, "inserted": 0, "duplicates": 0}
+
+    def write(batch):
+        groups = {}
+        for doc in batch:
+            groups.setdefault(layout.route(doc), []).append(doc)
+        for collection, docs in groups.items():
+            if layout.layout == LAYOUT_TIMESERIES:
+                stored = _stored_ids(collection, docs)
+                if len(stored) > 0:
+                    report["duplicates"] += len(stored)
+                    docs = [doc for doc in docs if doc["_id"] not in stored]
+                if len(docs) == 0:
+                    continue
+            try:
+                collection.insert_many(docs, ordered=False)
+                report["inserted"] += len(docs)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                duplicates = sum(
+                    1 for error in errors if error.get("code") == DUPLICATE_KEY_ERROR
+                )
+                if duplicates < len(errors):
+                    raise
+                report["duplicates"] += duplicates
+                report["inserted"] += e.details.get("nInserted", 0)
+
+    for path in list_spool_segments(spool_dir, include_open=include_open):
+        batch = []
+        for doc in read_spool_segment(path):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                write(batch)
+                batch = []
+        if len(batch) > 0:
+            write(batch)
+        report["segments"] += 1
+        log.info(f"Imported {path}")
+    report["documents"] = report["inserted"] + report["duplicates"]
+    return report
@@ -0,0 +1,39 @@
+class StorageBackend:
+    """
+    Sink of the experiment documents (stats, logs, sys and gw_stats).
+    insert() is called from the handlers: a backend shall buffer the documents
+    and do its I/O in the background.
+    """
+
+    """
+        @brief  This function enqueues a document to be stored.
+        @param doc: The document.
+        @return True if the document was accepted.
+    """
+
+    def insert(self, doc):
+        raise NotImplementedError
+
+    """
+        @brief  This function blocks until every enqueued document is stored.
+        @return None.
+    """
+
+    def flush(self):
+        pass
+
+    """
+        @brief  This function flushes the pending documents and releases the backend.
+        @return None.
+    """
+
+    def close(self):
+        pass
+
+    """
+        @brief  This function returns the backend counters.
+        @return dict.
+    """
+
+    def get_stats(self):
+        return {}
@@ -0,0 +1,8 @@
+from ._decoder_module import PayloadDecoder, JoinMessage, UplinkMessage
+
+from ._decoder_module import (
+    AUTO_BACKEND,
+    JSON_BACKEND,
+    ORJSON_BACKEND,
+    MSGSPEC_BACKEND,
+)
@@ -0,0 +1,196 @@
+import re
+import json
+import logging
+from typing import NamedTuple, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+log = logging.getLogger(__name__)
+
+# DECODER BACKENDS
+AUTO_BACKEND = "auto"
+JSON_BACKEND = "json"
+ORJSON_BACKEND = "orjson"
+MSGSPEC_BACKEND = "msgspec"
+
+# TOPIC SUFFIXES (v3/<app>/devices/<dev_id>/<suffix>)
+JOIN_TOPIC_SUFFIX = "/join"
+
+# Cheap port lookup, run before parsing the whole uplink
+F_PORT_RE = re.compile(rb'"f_port"\s*:\s*(\d+)')
+
+
+class JoinMessage(NamedTuple):
+    """
+    Fields of a TTS join accept message used by the DM.
+    """
+
+    dev_id: Optional[str]
+    dev_eui: Optional[str]
+    dev_addr: Optional[str]
+
+
+class UplinkMessage(NamedTuple):
+    """
+    Fields of a TTS uplink message used by the DM.
+    """
+
+    dev_id: Optional[str]
+    dev_eui: Optional[str]
+    dev_addr: Optional[str]
+    f_port: Optional[int]
+    f_cnt: Optional[int]
+    rx_timestamp: Optional[int]
+    frm_payload: Optional[str]
+
+
+if msgspec is not None:
+    # TTS schema, only the fields above are declared (the others are skipped)
+
+    class _EndDeviceIds(msgspec.Struct):
+        device_id: Optional[str] = None
+        dev_eui: Optional[str] = None
+        dev_addr: Optional[str] = None
+
+    class _RxMetadata(msgspec.Struct):
+        timestamp: Optional[int] = None
+
+    class _Uplink(msgspec.Struct):
+        f_port: Optional[int] = None
+        f_cnt: Optional[int] = None
+        frm_payload: Optional[str] = None
+        rx_metadata: list[_RxMetadata] = []
+
+    class _JoinEnvelope(msgspec.Struct):
+        end_device_ids: _EndDeviceIds
+
+    class _UplinkEnvelope(msgspec.Struct):
+        end_device_ids: _EndDeviceIds
+        uplink_message: _Uplink
+
+
+"""
+    @brief  This function returns the backend actually used for a requested one.
+    @param backend: The requested backend (auto, json, orjson, msgspec).
+    @return The backend name.
+"""
+
+
+def resolve_backend(backend):
+    if backend == AUTO_BACKEND:
+        if msgspec is not None:
+            return MSGSPEC_BACKEND
+        if orjson is not None:
+            return ORJSON_BACKEND
+        return JSON_BACKEND
+    if backend == MSGSPEC_BACKEND and msgspec is None:
+        log.warning("msgspec not installed, using json")
+        return JSON_BACKEND
+    if backend == ORJSON_BACKEND and orjson is None:
+        log.warning("orjson not installed, using json")
+        return JSON_BACKEND
+    if backend not in (JSON_BACKEND, ORJSON_BACKEND, MSGSPEC_BACKEND):
+        raise Exception(f"Unknown payload decoder: {backend}")
+    return backend
+
+
+def _join_from_dict(payload):
+    end_device_ids = payload.get("end_device_ids")
+    return JoinMessage(
+        end_device_ids.get("device_id"),
+        end_device_ids.get("dev_eui"),
+        end_device_ids.get("dev_addr"),
+    )
+
+
+def _uplink_from_dict(payload):
+    end_device_ids = payload.get("end_device_ids")
+    uplink_message = payload.get("uplink_message")
+    rx_metadata = uplink_message.get("rx_metadata")
+    return UplinkMessage(
+        end_device_ids.get("device_id"),
+        end_device_ids.get("dev_eui"),
+        end_device_ids.get("dev_addr"),
+        uplink_message.get("f_port"),
+        uplink_message.get("f_cnt"),
+        rx_metadata[0].get("timestamp") if rx_metadata else None,
+        uplink_message.get("frm_payload"),
+    )
+
+
+class PayloadDecoder:
+    """
+    This class decodes the TTS messages received from the MQTT broker into
+    JoinMessage/UplinkMessage. Uplinks on ports not in the ports set are
+    dropped by looking up f_port in the raw payload, before any parsing.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        self.backend = resolve_backend(kwargs.get("backend", AUTO_BACKEND))
+        ports = kwargs.get("ports", None)
+        self.ports = frozenset(ports) if ports is not None else None
+        if self.backend == MSGSPEC_BACKEND:
+            join_decoder = msgspec.json.Decoder(_JoinEnvelope)
+            uplink_decoder = msgspec.json.Decoder(_UplinkEnvelope)
+            self._decode_join = lambda raw: self._join_from_struct(
+                join_decoder.decode(raw)
+            )
+            self._decode_uplink = lambda raw: self._uplink_from_struct(
+                uplink_decoder.decode(raw)
+            )
+        elif self.backend == ORJSON_BACKEND:
+            self._decode_join = lambda raw: _join_from_dict(orjson.loads(raw))
+            self._decode_uplink = lambda raw: _uplink_from_dict(orjson.loads(raw))
+        else:
+            self._decode_join = lambda raw: _join_from_dict(json.loads(raw))
+            self._decode_uplink = lambda raw: _uplink_from_dict(json.loads(raw))
+        # Statistics
+        self.filtered = 0
+
+    """
+        @brief  This function decodes a message received from the MQTT broker.
+        @param topic: The message topic.
+        @param payload: The raw message payload (bytes).
+        @return JoinMessage for join topics, UplinkMessage otherwise,
+                None if the uplink port is filtered out.
+    """
+
+    def decode(self, topic, payload):
+        if JOIN_TOPIC_SUFFIX in topic:
+            return self._decode_join(payload)
+        if self.ports is not None:
+            match = F_PORT_RE.search(payload)
+            if match is not None and int(match.group(1)) not in self.ports:
+                self.filtered += 1
+                return None
+        return self._decode_uplink(payload)
+
+    @staticmethod
+    def _join_from_struct(envelope):
+        end_device_ids = envelope.end_device_ids
+        return JoinMessage(
+            end_device_ids.device_id, end_device_ids.dev_eui, end_device_ids.dev_addr
+        )
+
+    @staticmethod
+    def _uplink_from_struct(envelope):
+        end_device_ids = envelope.end_device_ids
+        uplink_message = envelope.uplink_message
+        rx_metadata = uplink_message.rx_metadata
+        return UplinkMessage(
+            end_device_ids.device_id,
+            end_device_ids.dev_eui,
+            end_device_ids.dev_addr,
+            uplink_message.f_port,
+            uplink_message.f_cnt,
+            rx_metadata[0].timestamp if rx_metadata else None,
+            uplink_message.frm_payload,
+        )
@@ -0,0 +1,3 @@
+from ._dispatcher_module import FrameDispatcher, AsyncFrameDispatcher
+
+from ._dispatcher_module import DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE, FAILED_FRAME_TYPE
@@ -0,0 +1,262 @@
+import time
+import asyncio
+import logging
+from queue import Queue
+from threading import Thread, Lock
+from metrics_module import LatencyHistogram
+
+log = logging.getLogger(__name__)
+
+# DEFAULTS
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 10000
+
+# Sentinel used to stop the workers
+_STOP = object()
+# Queue wait label of the frames whose handler raised
+FAILED_FRAME_TYPE = "failed"
+
+
+class _BaseDispatcher:
+    """
+    Sharding and stats shared by the threaded and the asyncio dispatchers.
+    """
+
+    def __init__(self, handler, queue_factory, **kwargs) -> None:
+        workers = kwargs.get("workers", DEFAULT_WORKERS)
+        queue_size = kwargs.get("queue_size", DEFAULT_QUEUE_SIZE)
+        if handler is None or workers < 1 or queue_size < 1:
+            raise Exception("Invalid dispatcher parameters")
+        # The handler receives the item and returns the frame type label
+        self.handler = handler
+        self._queues = [queue_factory(maxsize=queue_size) for _ in range(workers)]
+        self._wait_histograms = {}
+        self._wait_histograms_lock = Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+
+    def _get_queue(self, key):
+        return self._queues[hash(key) % len(self._queues)]
+
+    """
+        @brief  This function returns the dispatcher stats.
+        @return dict with the queue depths and the queue wait time per frame type.
+    """
+
+    def get_stats(self):
+        with self._wait_histograms_lock:
+            wait_histograms = dict(self._wait_histograms)
+        return {
+            "queue_depths": [frame_queue.qsize() for frame_queue in self._queues],
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "queue_wait": {
+                frame_type: histogram.snapshot()
+                for frame_type, histogram in wait_histograms.items()
+            },
+        }
+
+    """
+        @brief  This function writes the dispatcher metrics (metrics endpoint collector).
+        @param writer: The MetricsWriter.
+        @return None.
+    """
+
+    def collect_metrics(self, writer):
+        for worker, frame_queue in enumerate(self._queues):
+            writer.gauge(
+                "e2l_dispatcher_queue_depth",
+                "Frames waiting in a dispatcher queue.",
+                frame_queue.qsize(),
+                {"worker": worker},
+            )
+        for outcome, value in (
+            ("submitted", self.submitted),
+            ("processed", self.processed),
+            ("failed", self.failed),
+        ):
+            writer.counter(
+                "e2l_dispatcher_frames_total",
+                "Frames handled by the dispatcher.",
+                value,
+                {"outcome": outcome},
+            )
+        with self._wait_histograms_lock:
+            wait_histograms = sorted(
+                self._wait_histograms.items(), key=lambda item: str(item[0])
+            )
+        for frame_type, histogram in wait_histograms:
+            writer.histogram(
+                "e2l_dispatcher_queue_wait_seconds",
+                "Time spent by the frames in the dispatcher queues.",
+                histogram,
+                {"frame_type": frame_type},
+            )
+
+    def _get_wait_histogram(self, frame_type):
+        histogram = self._wait_histograms.get(frame_type)
+        if histogram is None:
+            with self._wait_histograms_lock:
+                histogram = self._wait_histograms.setdefault(
+                    frame_type, LatencyHistogram()
+                )
+        return histogram
+
+
+class FrameDispatcher(_BaseDispatcher):
+    """
+    This class decouples the frame ingestion from the frame processing.
+    Frames are sharded by key (e.g. the device id) over a pool of workers, each
+    with its own bounded FIFO queue, so frames sharing a key keep their order.
+    """
+
+    def __init__(self, handler, **kwargs) -> None:
+        super().__init__(handler, Queue, **kwargs)
+        # Frames are submitted by several MQTT network threads and processed
+        # by the workers: += is not atomic
+        self._counters_lock = Lock()
+        self._workers = []
+        for index in range(len(self._queues)):
+            worker = Thread(
+                target=self._worker_loop,
+                args=(self._queues[index],),
+                name=f"dispatcher-{index}",
+                daemon=True,
+            )
+            self._workers.append(worker)
+
+    """
+        @brief  This function starts the workers.
+        @return None.
+    """
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    """
+        @brief  This function stops the workers once the queued frames are processed.
+        @return None.
+    """
+
+    def stop(self):
+        for frame_queue in self._queues:
+            frame_queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+
+    """
+        @brief  This function enqueues a frame. It blocks if the worker queue is full.
+        @param key: The sharding key, frames with the same key are processed in order.
+        @param item: The frame.
+        @return None.
+    """
+
+    def submit(self, key, item):
+        self._get_queue(key).put((time.perf_counter(), item))
+        with self._counters_lock:
+            self.submitted += 1
+
+    def _worker_loop(self, frame_queue):
+        while True:
+            entry = frame_queue.get()
+            if entry is _STOP:
+                return
+            enqueued_at, item = entry
+            wait_ms = (time.perf_counter() - enqueued_at) * 1000
+            try:
+                frame_type = self.handler(item)
+                with self._counters_lock:
+                    self.processed += 1
+            except Exception:
+                log.exception("Error handling frame")
+                frame_type = FAILED_FRAME_TYPE
+                with self._counters_lock:
+                    self.failed += 1
+            self._get_wait_histogram(frame_type).observe(wait_ms)
+
+
+class AsyncFrameDispatcher(_BaseDispatcher):
+    """
+    asyncio version of the FrameDispatcher: each shard is consumed by a task
+    awaiting the handler coroutine. submit() never blocks the event loop, the
+    producer shall stop reading (see saturated()) while a shard is full.
+    """
+
+    def __init__(self, handler, **kwargs) -> None:
+        super().__init__(handler, asyncio.Queue, **kwargs)
+        self._tasks = []
+        self._capacity_event = asyncio.Event()
+        self._capacity_event.set()
+
+    """
+        @brief  This function starts the worker tasks. It shall be called from the event loop.
+        @return None.
+    """
+
+    def start(self):
+        for frame_queue in self._queues:
+            self._tasks.append(asyncio.create_task(self._worker_loop(frame_queue)))
+
+    """
+        @brief  This function stops the worker tasks once the queued frames are processed.
+        @return None.
+    """
+
+    async def stop(self):
+        for frame_queue in self._queues:
+            await frame_queue.put(_STOP)
+        await asyncio.gather(*self._tasks)
+
+    """
+        @brief  This function enqueues a frame.
+        @param key: The sharding key, frames with the same key are processed in order.
+        @param item: The frame.
+        @return None.
+        @note   Raises asyncio.QueueFull if the shard is full.
+    """
+
+    def submit(self, key, item):
+        self._get_queue(key).put_nowait((time.perf_counter(), item))
+        self.submitted += 1
+        if self.saturated():
+            self._capacity_event.clear()
+
+    """
+        @brief  This function checks if any shard is full.
+        @return True if a new frame could not be enqueued.
+    """
+
+    def saturated(self):
+        for frame_queue in self._queues:
+            if frame_queue.full():
+                return True
+        return False
+
+    """
+        @brief  This function waits until every shard can accept a new frame.
+        @return None.
+    """
+
+    async def wait_for_capacity(self):
+        await self._capacity_event.wait()
+
+    async def _worker_loop(self, frame_queue):
+        while True:
+            entry = await frame_queue.get()
+            if entry is _STOP:
+                return
+            if not self._capacity_event.is_set() and not self.saturated():
+                self._capacity_event.set()
+            enqueued_at, item = entry
+            wait_ms = (time.perf_counter() - enqueued_at) * 1000
+            try:
+                frame_type = await self.handler(item)
+                self.processed += 1
+            except Exception:
+                log.exception("Error handling frame")
+                frame_type = FAILED_FRAME_TYPE
+                self.failed += 1
+            self._get_wait_histogram(frame_type).observe(wait_ms)
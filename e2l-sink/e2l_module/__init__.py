@@ -1,3 +1,14 @@
 from ._e2l_module import E2LoRaModule
+from ._async_e2l_module import AsyncE2LoRaModule
 
-from ._e2l_module import (DEFAULT_APP_PORT, DEFAULT_E2L_APP_PORT, DEFAULT_E2L_JOIN_PORT)
\ No newline at end of file
+from ._e2l_module import DEFAULT_APP_PORT, DEFAULT_E2L_APP_PORT, DEFAULT_E2L_JOIN_PORT
+
+from ._gateway_channels import GatewayChannelManager, GatewayClient
+
+from ._directory_store import DirectoryStore, load_or_create_private_key
+
+from ._fcnt_window import FcntDeduplicator, DEFAULT_FCNT_WINDOW
+
+from ._reference_aggregator import ReferenceAggregator, reduce_values
+
+from ._dashboard_stream import DashboardStream
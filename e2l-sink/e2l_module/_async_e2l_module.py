@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from db_module import BACKPRESSURE_BLOCK
+
+log = logging.getLogger(__name__)
+
+# Threads used to run the blocking work (crypto, gateway and dashboard RPCs)
+DEFAULT_EXECUTOR_WORKERS = 4
+
+
+class AsyncE2LoRaModule:
+    """
+    This class exposes the E2LoRaModule handlers as coroutines for the asyncio runtime.
+    Cheap handlers run on the event loop, the blocking ones (ECDH, gateway and
+    dashboard RPCs, DB inserts that may wait for the writer) are pushed to an
+    executor.
+    """
+
+    def __init__(self, e2l_module, executor=None):
+        self.e2l_module = e2l_module
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=DEFAULT_EXECUTOR_WORKERS, thread_name_prefix="e2l-blocking"
+            )
+        self.executor = executor
+        # The Mongo writer with the block backpressure makes the inserts wait
+        # while its queue is full (the spool and the other policies never wait)
+        self.storage_blocks = (
+            getattr(e2l_module.storage, "backpressure", None) == BACKPRESSURE_BLOCK
+        )
+        # Without a DB, logs are sent to the dashboard with blocking RPCs
+        self.logs_block = e2l_module.storage is None or self.storage_blocks
+        # Cluster membership (None: single sink)
+        self.cluster = e2l_module.cluster
+        self._tasks = []
+
+    """
+        @brief  This function runs a blocking function on the executor.
+        @param function: The function.
+        @param kwargs: The function arguments.
+        @return The function return value.
+    """
+
+    async def _run_blocking(self, function, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(function, **kwargs)
+        )
+
+    async def _run(self, function, blocking, **kwargs):
+        if blocking:
+            return await self._run_blocking(function, **kwargs)
+        return function(**kwargs)
+
+    def observe_handler_latency(self, handler, start):
+        self.e2l_module.observe_handler_latency(handler, start)
+
+    def owns_device(self, dev_eui):
+        return self.e2l_module.owns_device(dev_eui)
+
+    def get_dev_eui(self, dev_addr):
+        return self.e2l_module.get_dev_eui(dev_addr)
+
+    async def handle_gw_pub_info(self, **kwargs):
+        return await self._run_blocking(self.e2l_module.handle_gw_pub_info, **kwargs)
+
+    async def handle_otaa_join_request(self, **kwargs):
+        return await self._run(
+            self.e2l_module.handle_otaa_join_request, self.logs_block, **kwargs
+        )
+
+    async def handle_edge_join_request(self, **kwargs):
+        return await self._run_blocking(
+            self.e2l_module.handle_edge_join_request, **kwargs
+        )
+
+    async def handle_edge_data_from_legacy(self, **kwargs):
+        return await self._run(
+            self.e2l_module.handle_edge_data_from_legacy, self.storage_blocks, **kwargs
+        )
+
+    async def handle_legacy_data(self, **kwargs):
+        return await self._run(
+            self.e2l_module.handle_legacy_data, self.storage_blocks, **kwargs
+        )
+
+    async def handle_edge_data(self, **kwargs):
+        return await self._run(
+            self.e2l_module.handle_edge_data, self.logs_block, **kwargs
+        )
+
+    async def handle_gw_log(self, **kwargs):
+        return await self._run(self.e2l_module.handle_gw_log, self.logs_block, **kwargs)
+
+    async def handle_edge_data_batch(self, items):
+        # One executor hop for the whole batch
+        return await self._run(
+            self.e2l_module.handle_edge_data_batch, self.logs_block, items=items
+        )
+
+    async def handle_gw_log_batch(self, items):
+        return await self._run(
+            self.e2l_module.handle_gw_log_batch, self.logs_block, items=items
+        )
+
+    async def handle_sys_log(self, **kwargs):
+        # It may push the aggregation params to the gateways
+        return await self._run_blocking(self.e2l_module.handle_sys_log, **kwargs)
+
+    async def handle_gw_frames_stats(self, **kwargs):
+        return await self._run(
+            self.e2l_module.handle_gw_frames_stats, self.storage_blocks, **kwargs
+        )
+
+    """
+        @brief  This function start the periodic tasks (DB/dashboard update and resource monitor).
+                It shall be called from the event loop.
+        @return None.
+    """
+
+    def start_background_tasks(self):
+        if self.e2l_module.storage is not None:
+            self._tasks.append(asyncio.create_task(self._update_db()))
+            self._tasks.append(asyncio.create_task(self._monitor_resource()))
+        elif self.e2l_module.dashboard_rpc_stub is not None:
+            # Long-lived statistics stream, on its own thread
+            self.e2l_module.start_dashboard_update_loop()
+
+    async def _update_db(self):
+        while True:
+            await asyncio.sleep(self.e2l_module.default_sleep_seconds)
+            await self._run(self.e2l_module._push_db_stats, self.storage_blocks)
+
+    async def _monitor_resource(self):
+        while True:
+            await self._run(self.e2l_module._push_resource_stats, self.storage_blocks)
+            await asyncio.sleep(1)
@@ -0,0 +1,89 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from Crypto.PublicKey import ECC
+
+# CURVE
+CURVE_NAME = "P-256"
+
+# DEFAULT KEY CACHE SIZE (entries)
+DEFAULT_KEY_CACHE_SIZE = 4096
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache.
+    """
+
+    def __init__(self, max_size=DEFAULT_KEY_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    """
+        @brief  This function returns the cached value, computing it on a miss.
+        @param key: The cache key.
+        @param compute: Function called with no arguments on a miss.
+        @return The value.
+        @note   compute runs outside the lock, concurrent misses may compute twice.
+    """
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = compute()
+        if self.max_size <= 0:
+            return value
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_stats(self):
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+
+"""
+    @brief  This function computes the ECDH shared point between a public key and a private scalar.
+    @param pub_key_sec1: The public key (SEC1, compressed or not).
+    @param private_d: The private scalar.
+    @return The shared point exported in SEC1 (uncompressed).
+"""
+
+
+def derive_shared_point_sec1(pub_key_sec1, private_d):
+    pub_key = ECC.import_key(pub_key_sec1, curve_name=CURVE_NAME)
+    shared_point = pub_key.pointQ * private_d
+    return ECC.construct(
+        curve=CURVE_NAME, point_x=shared_point.x, point_y=shared_point.y
+    ).export_key(format="SEC1")
+
+
+"""
+    @brief  This function derives the edge session keys from g_gw_ed.
+    @param g_gw_ed_sec1: The g_gw_ed point received from the E2GW (SEC1).
+    @param private_d: The private scalar of the DM.
+    @return (edgeSIntKey, edgeSEncKey)
+"""
+
+
+def derive_edge_session_keys(g_gw_ed_sec1, private_d):
+    g_gw_ed = ECC.import_key(g_gw_ed_sec1, curve_name=CURVE_NAME)
+    edgeSKey_int = private_d * g_gw_ed.pointQ
+    edgeSKey = edgeSKey_int.x.to_bytes()
+    # Hash edgeSKey
+    edgeSIntKey = hashlib.sha256(b"\x00" + edgeSKey).digest()[:16]
+    edgeSEncKey = hashlib.sha256(b"\x01" + edgeSKey).digest()[:16]
+    return edgeSIntKey, edgeSEncKey
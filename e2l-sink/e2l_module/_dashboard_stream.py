@@ -0,0 +1,167 @@
+import time
+import random
+import logging
+from threading import Event, Lock
+import grpc
+
+log = logging.getLogger(__name__)
+
+# DEFAULTS
+# Minimum interval between two statistics pushes
+DEFAULT_DEBOUNCE_SEC = 0.5
+# Statistics pushed even if unchanged, so the dashboard can reply with commands
+DEFAULT_HEARTBEAT_SEC = 5
+# Jittered exponential backoff between two connection attempts
+DEFAULT_RECONNECT_BASE_SEC = 0.5
+DEFAULT_RECONNECT_MAX_SEC = 30
+
+
+class DashboardStream:
+    """
+    Long-lived BidirectionalStreamingMethodStatistics call to the dashboard.
+    The statistics are pushed when they change, at most once per debounce
+    interval and at least once per heartbeat interval. The commands are applied
+    as soon as they are received. A broken call is reopened with a jittered
+    exponential backoff. A dashboard without the bidirectional method is polled
+    with the poll function every heartbeat interval.
+    """
+
+    def __init__(self, stub, get_message, apply_command, **kwargs) -> None:
+        self.stub = stub
+        self.get_message = get_message
+        self.apply_command = apply_command
+        self.poll = kwargs.get("poll")
+        self.debounce = kwargs.get("debounce", DEFAULT_DEBOUNCE_SEC)
+        self.heartbeat = kwargs.get("heartbeat", DEFAULT_HEARTBEAT_SEC)
+        self.reconnect_base = kwargs.get("reconnect_base", DEFAULT_RECONNECT_BASE_SEC)
+        self.reconnect_max = kwargs.get("reconnect_max", DEFAULT_RECONNECT_MAX_SEC)
+        self._stop_event = Event()
+        self._call = None
+        self._call_lock = Lock()
+
+        # Counters
+        self.connects = 0
+        self.pushed = 0
+        self.commands = 0
+        self.errors = 0
+
+    """
+        @brief  This function yields the statistics of an open call, when they change.
+        @param closed: Event set when the call is over.
+        @return Generator of SendStatistics.
+    """
+
+    def _requests(self, closed):
+        last = None
+        last_push = 0
+        while not closed.is_set():
+            stats = self.get_message()
+            now = time.monotonic()
+            if stats != last or now - last_push >= self.heartbeat:
+                last = stats
+                last_push = now
+                self.pushed += 1
+                yield stats
+            closed.wait(self.debounce)
+
+    def _apply(self, reply):
+        self.commands += 1
+        try:
+            self.apply_command(reply)
+        except Exception:
+            self.errors += 1
+            log.exception("Unable to apply the dashboard command")
+
+    """
+        @brief  This function keeps the call open until stop is called.
+        @return None.
+    """
+
+    def run(self):
+        attempt = 0
+        while not self._stop_event.is_set():
+            closed = Event()
+            try:
+                with self._call_lock:
+                    if self._stop_event.is_set():
+                        return
+                    self._call = self.stub.BidirectionalStreamingMethodStatistics(
+                        self._requests(closed)
+                    )
+                self.connects += 1
+                for reply in self._call:
+                    attempt = 0
+                    self._apply(reply)
+                log.warning("Dashboard statistics stream closed by the dashboard")
+            except grpc.RpcError as e:
+                if self._stop_event.is_set():
+                    return
+                if e.code() == grpc.StatusCode.UNIMPLEMENTED and self.poll is not None:
+                    log.warning("Dashboard without statistics stream, polling it")
+                    self._poll_loop()
+                    return
+                self.errors += 1
+                log.warning(f"Dashboard statistics stream failed ({e.code()})")
+            finally:
+                closed.set()
+                with self._call_lock:
+                    if self._call is not None:
+                        self._call.cancel()
+                        self._call = None
+            delay = random.uniform(
+                0, min(self.reconnect_max, self.reconnect_base * 2**attempt)
+            )
+            attempt += 1
+            log.info(f"Reconnecting to the dashboard in {delay:.2f} s")
+            self._stop_event.wait(delay)
+
+    def _poll_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except Exception:
+                self.errors += 1
+                log.exception("Unable to update the dashboard")
+            self._stop_event.wait(self.heartbeat)
+
+    """
+        @brief  This function closes the call and stops run.
+        @return None.
+    """
+
+    def stop(self):
+        with self._call_lock:
+            self._stop_event.set()
+            if self._call is not None:
+                self._call.cancel()
+
+    def get_stats(self):
+        return {
+            "connects": self.connects,
+            "pushed": self.pushed,
+            "commands": self.commands,
+            "errors": self.errors,
+        }
+
+    def collect_metrics(self, writer):
+        stats = self.get_stats()
+        writer.counter(
+            "e2l_dashboard_stream_connects_total",
+            "Statistics stream calls started to the dashboard.",
+            stats["connects"],
+        )
+        writer.counter(
+            "e2l_dashboard_statistics_pushed_total",
+            "Statistics messages pushed to the dashboard.",
+            stats["pushed"],
+        )
+        writer.counter(
+            "e2l_dashboard_commands_total",
+            "Commands received from the dashboard.",
+            stats["commands"],
+        )
+        writer.counter(
+            "e2l_dashboard_stream_errors_total",
+            "Dashboard stream failures and commands not applied.",
+            stats["errors"],
+        )
@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import atexit
+import logging
+from threading import Thread, Lock, Event
+from Crypto.PublicKey import ECC
+from metrics_module import LatencyHistogram
+
+log = logging.getLogger(__name__)
+
+# FILES
+SNAPSHOT_FILE = "directory.snapshot.json"
+WAL_FILE = "directory.wal"
+DEFAULT_KEYSTORE_FILE = "as_private_key.pem"
+SNAPSHOT_FORMAT = 1
+
+# WAL RECORDS: {"op": <op>, "id": <gw_id|dev_eui>, "state": {...}}, one per line
+GATEWAY_OP = "gateway"
+DEVICE_OP = "device"
+PARAMS_OP = "params"
+
+# DEFAULTS
+# WAL records written before the snapshot is rewritten and the WAL truncated
+DEFAULT_SNAPSHOT_RECORDS = 10000
+DEFAULT_FLUSH_INTERVAL_SEC = 0.2
+
+# Key protection of the keystore (KEYSTORE_PASSPHRASE)
+KEYSTORE_PROTECTION = "PBKDF2WithHMAC-SHA1AndAES128-CBC"
+KEYSTORE_MODE = 0o600
+
+# Session key encodings (hex strings: written before the keys were stored as bytes)
+KEY_FORMAT_BYTES = "bytes"
+KEY_FORMAT_HEX = "hex"
+
+
+"""
+    @brief  This function loads the AS private key from the keystore, creating it on the first start.
+    @param path: The PEM file (mode 0600).
+    @param passphrase: The passphrase protecting the key, None for a plain PEM.
+    @return ECC.EccKey
+"""
+
+
+def load_or_create_private_key(path, passphrase=None):
+    if os.path.exists(path):
+        with open(path, "rt") as f:
+            return ECC.import_key(f.read(), passphrase=passphrase)
+    private_key = ECC.generate(curve="P-256")
+    if passphrase is None:
+        pem = private_key.export_key(format="PEM")
+    else:
+        pem = private_key.export_key(
+            format="PEM", passphrase=passphrase, protection=KEYSTORE_PROTECTION
+        )
+    directory = os.path.dirname(path)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, KEYSTORE_MODE)
+    with os.fdopen(fd, "wt") as f:
+        f.write(pem)
+        f.flush()
+        os.fsync(f.fileno())
+    log.info(f"Created AS private key in {path}")
+    return private_key
+
+
+def encode_session_key(value):
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        return [KEY_FORMAT_BYTES, bytes(value).hex()]
+    return [KEY_FORMAT_HEX, value]
+
+
+def decode_session_key(value):
+    if value is None:
+        return None
+    _key_format, key = value
+    return bytes.fromhex(key)
+
+
+def _empty_state():
+    return {"format": SNAPSHOT_FORMAT, "gateways": {}, "devices": {}, "params": {}}
+
+
+def _apply_record(state, record):
+    op = record["op"]
+    if op == GATEWAY_OP:
+        state["gateways"][record["id"]] = record["state"]
+    elif op == DEVICE_OP:
+        state["devices"][record["id"]] = record["state"]
+    elif op == PARAMS_OP:
+        state["params"].update(record["state"])
+    else:
+        raise Exception(f"Unknown directory record: {op}")
+
+
+class DirectoryStore:
+    """
+    On-disk copy of the active directory: a snapshot plus a write-ahead log of
+    the registry mutations (upserts of whole gateway/device records, so a
+    record replayed twice is harmless). The WAL is flushed periodically (or
+    fsynced on every record) and folded into a new snapshot every
+    snapshot_records records. The gateways and the devices keep their order,
+    which is their registry position.
+    """
+
+    def __init__(self, state_dir, **kwargs) -> None:
+        if state_dir is None:
+            raise Exception("Missing state directory")
+        self.state_dir = state_dir
+        self.snapshot_records = kwargs.get("snapshot_records", DEFAULT_SNAPSHOT_RECORDS)
+        self.flush_interval = kwargs.get("flush_interval", DEFAULT_FLUSH_INTERVAL_SEC)
+        self.fsync = kwargs.get("fsync", False)
+        os.makedirs(state_dir, exist_ok=True)
+        self._snapshot_path = os.path.join(state_dir, SNAPSHOT_FILE)
+        self._wal_path = os.path.join(state_dir, WAL_FILE)
+        self._lock = Lock()
+        self._stopped = False
+        self._wal_records = 0
+
+        # Counters
+        self.written = 0
+        self.snapshots = 0
+        self.snapshot_latency = LatencyHistogram()
+
+        self._state = self._read_state()
+        self._wal = open(self._wal_path, "a", encoding="utf-8")
+        self._stop_event = Event()
+        self._compact_event = Event()
+        self._flush_thread = Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.close)
+
+    def _read_state(self):
+        state = _empty_state()
+        if os.path.exists(self._snapshot_path):
+            with open(self._snapshot_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("format") != SNAPSHOT_FORMAT:
+                raise Exception(
+                    f"Unknown directory snapshot format: {state.get('format')}"
+                )
+        if not os.path.exists(self._wal_path):
+            return state
+        # Offset of the end of the last complete record
+        complete = 0
+        with open(self._wal_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Crash while writing the last record
+                    log.warning(f"Truncated record at the end of {self._wal_path}")
+                    break
+                _apply_record(state, json.loads(line))
+                self._wal_records += 1
+                complete += len(line)
+        if complete < os.path.getsize(self._wal_path):
+            # The next records would be appended to the partial line
+            with open(self._wal_path, "r+b") as f:
+                f.truncate(complete)
+        return state
+
+    """
+        @brief  This function returns the directory stored on disk.
+        @return dict with the gateways and the devices (id -> state, in registry
+                order) and the params.
+    """
+
+    def load(self):
+        with self._lock:
+            return {
+                "gateways": dict(self._state["gateways"]),
+                "devices": dict(self._state["devices"]),
+                "params": dict(self._state["params"]),
+            }
+
+    """
+        @brief  This function logs the new state of a gateway.
+        @param gw_id: The gateway id.
+        @param state: The gateway state (JSON serializable).
+        @return None.
+    """
+
+    def put_gateway(self, gw_id, state):
+        self._append({"op": GATEWAY_OP, "id": gw_id, "state": state})
+
+    """
+        @brief  This function logs the new state of a device.
+        @param dev_eui: The Dev EUI.
+        @param state: The device state (JSON serializable).
+        @return None.
+    """
+
+    def put_device(self, dev_eui, state):
+        self._append({"op": DEVICE_OP, "id": dev_eui, "state": state})
+
+    """
+        @brief  This function logs the aggregation params and the gateway selections.
+        @param params: dict of the changed params.
+        @return None.
+    """
+
+    def put_params(self, params):
+        self._append({"op": PARAMS_OP, "state": params})
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._stopped:
+                return
+            _apply_record(self._state, record)
+            self._wal.write(line)
+            if self.fsync:
+                self._wal.flush()
+                os.fsync(self._wal.fileno())
+            self.written += 1
+            self._wal_records += 1
+            if self._wal_records >= self.snapshot_records:
+                self._compact_event.set()
+
+    """
+        @brief  This function writes a new snapshot and truncates the WAL.
+        @return None.
+    """
+
+    def compact(self):
+        start = time.perf_counter()
+        with self._lock:
+            if self._stopped:
+                return
+            self._compact_event.clear()
+            tmp_path = self._snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._state, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._snapshot_path)
+            # A crash before the truncation replays records already in the snapshot
+            self._wal.close()
+            self._wal = open(self._wal_path, "w", encoding="utf-8")
+            self._wal_records = 0
+            self.snapshots += 1
+        self.snapshot_latency.observe((time.perf_counter() - start) * 1000)
+
+    """
+        @brief  This function hands the WAL records over to the OS.
+        @return None.
+    """
+
+    def flush(self):
+        with self._lock:
+            if not self._stopped:
+                self._wal.flush()
+
+    """
+        @brief  This function flushes the WAL to disk and stops the store.
+        @return None.
+    """
+
+    def close(self):
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._wal.close()
+        self._stop_event.set()
+        self._flush_thread.join()
+
+    def get_stats(self):
+        return {
+            "written": self.written,
+            "wal_records": self._wal_records,
+            "snapshots": self.snapshots,
+            "gateways": len(self._state["gateways"]),
+            "devices": len(self._state["devices"]),
+            "snapshot_latency": self.snapshot_latency.snapshot(),
+        }
+
+    def collect_metrics(self, writer):
+        stats = self.get_stats()
+        writer.counter(
+            "e2l_directory_wal_records_total",
+            "Active directory mutations logged.",
+            stats["written"],
+        )
+        writer.counter(
+            "e2l_directory_snapshots_total",
+            "Active directory snapshots written.",
+            stats["snapshots"],
+        )
+        writer.gauge(
+            "e2l_directory_wal_pending_records",
+            "WAL records not folded into the snapshot yet.",
+            stats["wal_records"],
+        )
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            if self._compact_event.is_set():
+                self.compact()
+            else:
+                self.flush()
@@ -6,7 +6,6 @@ import logging
 import psutil
 import grpc
 from e2gw_rpc_client import (
-    edge2gateway_pb2_grpc,
     EdPubInfo,
     AggregationParams,
     E2LDeviceInfo,
@@ -21,10 +20,39 @@ from .__private__ import (
     SendJoinUpdateMessage,
 )
 import json
-import hashlib
 from threading import Thread, Lock
 from pymongo import MongoClient
-from datetime import datetime
+from db_module import (
+    BufferedMongoWriter,
+    ExperimentLayout,
+    SpoolStorageBackend,
+    list_spool_segments,
+)
+from metrics_module import ShardedCounters, LatencyHistogram
+from config_module import get_config
+from cluster_module import GATEWAY_STATE_PREFIX, AGGREGATION_STATE
+from ._registry import E2LRegistry
+from ._crypto import LRUCache
+from ._gateway_channels import GatewayChannelManager
+from ._key_agreement import KeyAgreementService
+from ._provisioning import iter_device_export, parse_device
+from ._fcnt_window import FcntDeduplicator, FCNT_NEW
+from ._dashboard_stream import DashboardStream
+from ._reference_aggregator import (
+    ReferenceAggregator,
+    REFERENCE_OUTCOMES,
+    AVG_ID,
+    SUM_ID,
+    MIN_ID,
+    MAX_ID,
+)
+from ._directory_store import (
+    DirectoryStore,
+    load_or_create_private_key,
+    encode_session_key,
+    decode_session_key,
+    DEFAULT_KEYSTORE_FILE,
+)
 
 log = logging.getLogger(__name__)
 
@@ -36,18 +64,13 @@ DEFAULT_E2L_COMMAND_PORT = 5
 
 # EDGE2LORA COMMAND
 REJOIN_COMMAND = "REJOIN"
+REJOIN_COMMAND_BASE64 = base64.b64encode(REJOIN_COMMAND.encode("utf-8")).decode("utf-8")
 
 # LOG TYPE
 LOG_GW1 = 1
 LOG_GW2 = 2
 LOG_ED = 3
 
-# AGGREGATION FUNCTION TYPE
-AVG_ID = 1
-SUM_ID = 2
-MIN_ID = 3
-MAX_ID = 4
-
 # FRAME TYPES
 EDGE_FRAME = 1
 LEGACY_FRAME = 2
@@ -60,9 +83,46 @@ LOG_DOC_TYPE = "logs"
 LOG_V2_DOC_TYPE = "logs_v2"
 SYS_DOC_TYPE = "sys"
 GW_FRAMES_STATS_DOC_TYPE = "gw_stats"
+EXPERIMENT_DOC_TYPES = (
+    STATS_DOC_TYPE,
+    LOG_DOC_TYPE,
+    LOG_V2_DOC_TYPE,
+    SYS_DOC_TYPE,
+    GW_FRAMES_STATS_DOC_TYPE,
+)
+# Secondary indexes per doc type (the single layout prefixes them with the type)
+EXPERIMENT_INDEXES = {
+    LOG_V2_DOC_TYPE: (
+        (("dev_addr", 1), ("fcnt", 1)),
+        (("gw_id", 1), ("timetag_gw", 1)),
+    ),
+    SYS_DOC_TYPE: ((("gw_id", 1), ("ts", 1)),),
+    GW_FRAMES_STATS_DOC_TYPE: ((("gw_id", 1), ("ts", 1)),),
+}
+
+# SINK COUNTERS
+DM_RX_LEGACY_COUNTER = "dm_rx_legacy_frames"
+DM_RX_E2L_COUNTER = "dm_rx_e2l_frames"
+NS_RX_COUNTER = "ns_rx"
+NS_TX_COUNTER = "ns_tx"
+NS_DROPPED_LEGACY_COUNTER = "ns_dropped_legacy_frames"
+DM_DROPPED_E2L_COUNTER = "dm_dropped_e2l_frames"
+# One slot per gateway/device, indexed by the registry position
+GW_RX_COUNTER = "gw_rx"
+GW_TX_COUNTER = "gw_tx"
+ED_LEGACY_COUNTER = "ed_legacy_frames"
+ED_EDGE_COUNTER = "ed_edge_frames"
+# Consumer of the counter deltas stored in the DB
+DB_STATS_CONSUMER = "db"
+
+# STORAGE BACKENDS
+MONGO_STORAGE = "mongo"
+SPOOL_STORAGE = "spool"
 
 # DASHBOARD CONNECT TIMEOUT
 DASHBOARD_TIMEOUT_SEC = 5
+# KEY AGREEMENT RESULT TIMEOUT (the edge joins do not wait forever on a stuck pool)
+KEY_AGREEMENT_TIMEOUT_SEC = 10
 
 
 class E2LoRaModule:
@@ -70,54 +130,85 @@ class E2LoRaModule:
     This class is handle the Edge2LoRa Protocol.
     """
 
-    def __init__(self, dashboard_rpc_endpoint, experiment_id):
-        # Generate ephimeral ecc private/public key pair
-        self.ephimeral_private_key = ECC.generate(curve="P-256")
+    def __init__(
+        self, dashboard_rpc_endpoint, experiment_id, config=None, cluster=None
+    ):
+        # Cluster membership (None: single sink)
+        self.cluster = cluster
+        if config is None:
+            config = get_config()
+        # Generate ephimeral ecc private/public key pair (shared by the cluster
+        # workers, kept in the keystore across restarts if configured)
+        keystore_file = self._get_keystore_file(config)
+        if cluster is not None:
+            self.ephimeral_private_key = cluster.shared_private_key()
+        elif keystore_file is not None:
+            self.ephimeral_private_key = load_or_create_private_key(
+                keystore_file, passphrase=config.keystore_passphrase
+            )
+        else:
+            self.ephimeral_private_key = ECC.generate(curve="P-256")
         self.ephimeral_public_key = self.ephimeral_private_key.public_key()
         self.ephimeral_public_key_bytes_compressed = (
             self.ephimeral_public_key.export_key(format="SEC1")
         )
+        # Runtime configuration (reloaded by apply_config)
+        self.config = config
+        # Edge join key caches, keyed on the device compressed public key
+        self.g_as_ed_cache = LRUCache(max_size=config.key_cache_size)
+        self.edge_session_keys_cache = LRUCache(max_size=config.key_cache_size)
+        # ECDH engine (process pool if KEY_AGREEMENT_WORKERS > 0)
+        self.key_agreement = KeyAgreementService(
+            self.ephimeral_private_key.d,
+            workers=config.key_agreement_workers,
+            batch_size=config.key_agreement_batch_size,
+        )
+        # E2GW channels, reused across the gateway re-announces
+        self.gateway_channels = GatewayChannelManager(
+            timeout=config.gw_rpc_timeout,
+            retries=config.gw_rpc_retries,
+            keepalive_ms=config.gw_rpc_keepalive_ms,
+            fan_out_workers=config.gw_fan_out_workers,
+        )
         # Init active directory
-        self.active_directory = {"e2gws": {}, "e2eds": {}}
-        # Statistics collection utils
-        self.statistics = {
-            "dm": {"rx_legacy_frames": 0, "rx_e2l_frames": 0},
-            "gateways": {},
-            "devices": {},
-            "ns": {"tx": 0, "rx": 0},
-            "aggregation_result": 0,
-        }
-        self.e2gw_ids = []
-        self.e2ed_ids = []
-        self.ed_ids = []
-        self.legacy_not_duplicates = {}
-        self.legacy_dropped = 0
-        self.legacy_not_duplicates_lock = Lock()
+        self.active_directory = E2LRegistry()
+        # Statistics collection utils (per gateway/device slots)
+        self.counters = ShardedCounters()
+        self.aggregation_result = 0
+        # Handler latency histograms (ms), exposed by the metrics endpoint
+        self.handler_latency = {}
+        self.handler_latency_lock = Lock()
+        # Ordered ids, O(1) lookups
+        self.e2gw_ids = self.active_directory.gateways
+        self.e2ed_ids = self.active_directory.devices
+        # Replay windows of the legacy fcnts (E2GW logs) and of the aggregate fcnts
+        self.legacy_fcnts = None
+        self.edge_fcnts = None
+        if config.fcnt_window > 0:
+            self.legacy_fcnts = FcntDeduplicator(config.fcnt_window)
+            self.edge_fcnts = FcntDeduplicator(config.fcnt_window)
+        # Sink-side recomputation of the edge aggregates from the legacy payloads
+        self.reference_aggregator = None
+        if config.reference_windows > 0:
+            self.reference_aggregator = ReferenceAggregator(config.reference_windows)
         # Setup experiment
-        self.last_stats = None
         self.default_sleep_seconds = 5
         self.experiment_id = None
         self.db_client = None
         self.db = None
         self.collection = None
+        self.db_layout = None
+        # Experiment documents storage (StorageBackend), None without experiment
+        self.storage = None
         self.dashboard_rpc_stub = None
         if experiment_id is not None:
             self.experiment_id = experiment_id
-            mongo_host = os.getenv("MONGO_HOST", "localhost")
-            mongo_port = os.getenv("MONGO_PORT", 27017)
-            if isinstance(mongo_port, str) and mongo_port.isnumeric():
-                mongo_port = int(mongo_port)
-            self.db_client = MongoClient(mongo_host, mongo_port)
-            db_name = os.getenv("MONGO_DB_NAME", "experiments_db")
-            self.db = self.db_client[db_name]
-            if experiment_id not in self.db.list_collection_names():
-                self.db.create_collection(experiment_id)
-                self.collection = self.db[experiment_id]
-            else:
-                # raise exception
-                raise Exception(
-                    "Experiment ID already exists, please change the experiment ID."
-                )
+            # Each cluster worker has its own collections (spool), named as the
+            # per type ones of the experiment: <experiment_id>.<node_id>
+            if cluster is not None:
+                self.experiment_id = f"{experiment_id}.{cluster.node_id}"
+            # It raises an exception if the experiment ID already exists
+            self.storage = self._init_storage()
         else:
             try:
                 channel = grpc.insecure_channel(dashboard_rpc_endpoint)
@@ -126,6 +217,9 @@ class E2LoRaModule:
             except:
                 log.info("DASHBOARD RPC ENDPOINT NOT AVAILABLE.")
                 self.dashboard_rpc_stub = None
+        # Statistics stream to the dashboard, and the last command applied
+        self.dashboard_stream = None
+        self.dashboard_command = None
         # MQTT CLIENT
         self.mqtt_client = None
         # Aggregation Utils
@@ -135,93 +229,312 @@ class E2LoRaModule:
         self.ed_2_gw_selection = None
         self.ed_3_gw_selection = None
         # Load Device JSON
+        self.device_list_report = None
         # if self.collection is not None:
         self._load_device_json()
-        gw_shut_enabled = os.getenv("GW_SHUT", "0")
-        self.gw_shut_enabled = True if gw_shut_enabled == "1" else False
-        if self.gw_shut_enabled:
-            self.gw_shut_done = False
-            device_number = os.getenv("DEVICE_NUMBER", "0")
-            packet_number = os.getenv("PACKET_NUMBER", "0")
-            packet_divisor = os.getenv("PACKET_DIVISOR", "4")
+        # On-disk active directory (None: rebuilt by the fleet after a restart)
+        self.directory_store = None
+        if config.state_dir is not None:
+            self.directory_store = DirectoryStore(
+                config.state_dir,
+                snapshot_records=config.state_snapshot_records,
+                fsync=config.state_fsync,
+            )
+            self._restore_directory()
+        self.gw_shut_done = False
+        self.apply_config(config)
+        if cluster is not None:
+            cluster.add_listener(GATEWAY_STATE_PREFIX, self._apply_gateway_state)
+            cluster.add_listener(AGGREGATION_STATE, self._apply_aggregation_state)
+
+    """
+        @brief  This function applies a (reloaded) runtime configuration.
+                Only the settings read at use time change, see RuntimeConfig.
+        @param config: The RuntimeConfig.
+        @return None.
+    """
+
+    def apply_config(self, config):
+        self.config = config
+        self.gw_shut_packet_limit = config.gw_shut_packet_limit()
+        self.gw_shut_enabled = self.gw_shut_packet_limit is not None
+        self.gateway_channels.timeout = config.gw_rpc_timeout
+        self.gateway_channels.retries = config.gw_rpc_retries
+        # Deadline of the aggregation params fan-out (all the gateways)
+        self.aggregation_push_deadline = (
+            config.aggr_params_deadline
+            if config.aggr_params_deadline is not None
+            else config.gw_rpc_timeout
+        )
+
+    """
+        @brief  This function returns the keystore of the AS private key.
+        @param config: The RuntimeConfig.
+        @return The PEM file path, None if the key is not persisted.
+    """
+
+    @staticmethod
+    def _get_keystore_file(config):
+        if config.keystore_file is not None:
+            return config.keystore_file
+        if config.state_dir is not None:
+            return os.path.join(config.state_dir, DEFAULT_KEYSTORE_FILE)
+        return None
+
+    """
+        @brief  This function rebuilds the active directory from the DirectoryStore.
+                The gateway channels are opened lazily, no RPC is issued.
+        @return None.
+    """
+
+    def _restore_directory(self):
+        start = time.perf_counter()
+        state = self.directory_store.load()
+        for gw_id, gw_state in state["gateways"].items():
+            gw_info, _index = self.active_directory.add_gateway(gw_id)
+            gw_info.gw_rpc_endpoint_port = gw_state["port"]
+            gw_info.gw_pub_key = ECC.import_key(
+                bytes.fromhex(gw_state["pub_key"]), curve_name="P-256"
+            )
+            g_as_gw_bytes = bytes.fromhex(gw_state["g_as_gw"])
+            gw_info.g_as_gw = ECC.import_key(g_as_gw_bytes, curve_name="P-256")
+            gw_info.g_as_gw_base64 = base64.b64encode(g_as_gw_bytes).decode("utf-8")
+            gw_info.e2gw_stub = self.gateway_channels.get_client(
+                gw_id, f"{gw_id}:{gw_state['port']}"
+            )
+            aggregation_params = gw_state.get("aggregation_params")
+            if aggregation_params is not None:
+                gw_info.aggregation_params = tuple(aggregation_params)
+        for dev_eui, dev_state in state["devices"].items():
+            dev_obj, _dev_index = self.active_directory.add_device(
+                dev_eui, dev_state["dev_addr"]
+            )
+            dev_obj.dev_id = dev_state["dev_id"]
+            dev_obj.e2gw = dev_state["e2gw"]
+            dev_obj.edgeSIntKey = decode_session_key(dev_state["edge_s_int_key"])
+            dev_obj.edgeSEncKey = decode_session_key(dev_state["edge_s_enc_key"])
+            dev_obj.in_directory = dev_state["in_directory"]
+        params = state["params"]
+        self.aggregation_function = params.get("aggregation_function")
+        self.window_size = params.get("window_size")
+        self.ed_1_gw_selection = params.get("ed_1_gw_selection")
+        self.ed_2_gw_selection = params.get("ed_2_gw_selection")
+        self.ed_3_gw_selection = params.get("ed_3_gw_selection")
+        log.info(
+            f"Restored {len(state['gateways'])} gateways and {len(state['devices'])} "
+            f"devices in {(time.perf_counter() - start) * 1000:.1f} ms"
+        )
+
+    def _persist_gateway(self, gw_info):
+        if self.directory_store is None:
+            return
+        g_as_gw_bytes = base64.b64decode(gw_info.g_as_gw_base64)
+        self.directory_store.put_gateway(
+            gw_info.gw_rpc_endpoint_address,
+            {
+                "port": gw_info.gw_rpc_endpoint_port,
+                "pub_key": gw_info.gw_pub_key.export_key(format="SEC1").hex(),
+                "g_as_gw": g_as_gw_bytes.hex(),
+                "aggregation_params": gw_info.aggregation_params,
+            },
+        )
+
+    def _persist_device(self, dev_obj):
+        if self.directory_store is None:
+            return
+        self.directory_store.put_device(
+            dev_obj.dev_eui,
+            {
+                "dev_addr": dev_obj.dev_addr,
+                "dev_id": dev_obj.dev_id,
+                "e2gw": dev_obj.e2gw,
+                "edge_s_int_key": encode_session_key(dev_obj.edgeSIntKey),
+                "edge_s_enc_key": encode_session_key(dev_obj.edgeSEncKey),
+                "in_directory": dev_obj.in_directory,
+            },
+        )
+
+    def _persist_params(self):
+        if self.directory_store is None:
+            return
+        self.directory_store.put_params(
+            {
+                "aggregation_function": self.aggregation_function,
+                "window_size": self.window_size,
+                "ed_1_gw_selection": self.ed_1_gw_selection,
+                "ed_2_gw_selection": self.ed_2_gw_selection,
+                "ed_3_gw_selection": self.ed_3_gw_selection,
+            }
+        )
+
+    """
+        @brief  This function tells if the device is handled by this sink (cluster owner).
+        @param dev_eui: The Dev EUI.
+        @return True if owned, always True without cluster.
+    """
+
+    def owns_device(self, dev_eui):
+        return self.cluster is None or self.cluster.owns(dev_eui)
+
+    """
+        @brief  This function returns the Dev EUI of a Dev Addr.
+        @param dev_addr: The Dev Addr.
+        @return The Dev EUI, None if unknown (also to the other cluster workers).
+    """
+
+    def get_dev_eui(self, dev_addr):
+        dev_obj = self.active_directory.get_device_by_addr(dev_addr)
+        if dev_obj is not None:
+            return dev_obj.dev_eui
+        if self.cluster is not None:
+            return self.cluster.lookup_dev_eui(dev_addr)
+        return None
+
+    """
+        @brief  This function returns the position of a gateway. In cluster mode, a
+                gateway announced to another worker is looked up in the shared state.
+        @param gw_id: The gateway id.
+        @return The position, None if unknown.
+    """
+
+    def _get_gateway_index(self, gw_id):
+        index = self.e2gw_ids.index(gw_id)
+        if index is None and self.cluster is not None:
+            self.cluster.sync()
+            index = self.e2gw_ids.index(gw_id)
+        return index
+
+    """
+        @brief this function initializes the storage backend of the experiment documents.
+        @return StorageBackend
+    """
+
+    def _init_storage(self):
+        if self.config.storage_backend == SPOOL_STORAGE:
+            spool_dir = os.path.join(self.config.spool_dir, self.experiment_id)
             if (
-                packet_number.isnumeric()
-                and device_number.isnumeric()
-                and packet_divisor.isnumeric()
+                os.path.isdir(spool_dir)
+                and len(list_spool_segments(spool_dir, include_open=True)) > 0
             ):
-                packet_number = int(packet_number)
-                device_number = int(device_number)
-                packet_divisor = int(packet_divisor)
-                if packet_number <= 0 or device_number <= 0:
-                    self.gw_shut_enabled = False
-                else:
-                    self.gw_shut_packet_limit = int(
-                        (packet_number * device_number) / packet_divisor
-                    )
-            else:
-                self.gw_shut_enabled = False
+                raise Exception(
+                    "Experiment ID already exists, please change the experiment ID."
+                )
+            # No DB: the layout only stamps the documents
+            self.db_layout = self._get_db_layout(None)
+            return SpoolStorageBackend(
+                spool_dir,
+                codec=self.config.spool_codec,
+                segment_bytes=self.config.spool_segment_mb * 1024 * 1024,
+                flush_interval=self.config.db_writer_flush_interval,
+                metadata={
+                    "experiment_id": self.experiment_id,
+                    "db_layout": self.config.db_layout,
+                    "doc_types": EXPERIMENT_DOC_TYPES,
+                    "indexes": EXPERIMENT_INDEXES,
+                },
+            )
+        if self.config.storage_backend != MONGO_STORAGE:
+            raise Exception(f"Unknown storage backend: {self.config.storage_backend}")
+        self.db_client = MongoClient(self.config.mongo_host, self.config.mongo_port)
+        self.db = self.db_client[self.config.mongo_db_name]
+        self.db_layout = self._init_db_layout(self.db)
+        # Experiment collection (the stats one with the per type layouts)
+        self.collection = self.db_layout.collection_for(STATS_DOC_TYPE)
+        return self._init_db_writer(self.collection)
+
+    def _get_db_layout(self, db):
+        return ExperimentLayout(
+            db,
+            self.experiment_id,
+            layout=self.config.db_layout,
+            doc_types=EXPERIMENT_DOC_TYPES,
+            indexes=EXPERIMENT_INDEXES,
+        )
+
+    """
+        @brief this function creates the experiment collections (DB_LAYOUT) and indexes.
+        @param db: the MongoDB database
+        @return ExperimentLayout
+    """
+
+    def _init_db_layout(self, db):
+        db_layout = self._get_db_layout(db)
+        db_layout.create()
+        return db_layout
+
+    """
+        @brief this function stamps a document (unique id, DM time) and enqueues it.
+        @param doc: the document
+        @return None
+    """
+
+    def _insert_doc(self, doc):
+        if self.db_layout is not None:
+            self.db_layout.stamp(doc)
+        self.storage.insert(doc)
 
     """
-        @brief this function return the current date and time in ISOString.
-        @return ISOString (str)
-        @note "YYYY-mm-ddTHH:MM:SS.ffffffZ"
+        @brief this function initialize the buffered writer for the experiment collection.
+        @param collection: the MongoDB collection
+        @return BufferedMongoWriter
     """
 
-    def _get_now_isostring(self):
-        # get current daste time in ISOString format
-        return f'{datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")}Z'
+    def _init_db_writer(self, collection):
+        spill_path = self.config.db_writer_spill_file
+        if spill_path is None:
+            spill_path = f"{self.experiment_id}.spill.jsonl"
+        return BufferedMongoWriter(
+            collection,
+            router=self.db_layout.route if self.db_layout is not None else None,
+            batch_size=self.config.db_writer_batch_size,
+            flush_interval=self.config.db_writer_flush_interval,
+            max_queue_size=self.config.db_writer_queue_size,
+            backpressure=self.config.db_writer_backpressure,
+            spill_path=spill_path,
+        )
 
     """
         @brief this function load the device info from a JSON file.
         @param None
         @return None
-        @note the file shall be in the same format as the The Things Stack device bulk import JSON file
+        @note the file shall be in the same format as the The Things Stack device bulk import JSON file,
+              it is streamed (one device in memory at a time) and the session keys stored as bytes
     """
 
     def _load_device_json(self):
-        filename = os.getenv("DEVICE_LIST_FILE")
+        filename = self.config.device_list_file
         if filename is None:
             return
-        device_list = []
-        with open(filename, "r") as file:
-            device_list = json.load(file)
-        for device in device_list:
-            dev_id = device.get("ids", {}).get("dev_id")
-            dev_eui = device.get("ids", {}).get("dev_eui")
-            dev_addr = device.get("session", {}).get("dev_addr")
-            edgeSEncKey = (
-                device.get("session", {})
-                .get("keys", {})
-                .get("app_s_key", {})
-                .get("key")
-            )
-            edgeSIntKey = (
-                device.get("session", {})
-                .get("keys", {})
-                .get("f_nwk_s_int_key", {})
-                .get("key")
+        start = time.perf_counter()
+        loaded = 0
+        skipped = 0
+        for index, record in enumerate(
+            iter_device_export(filename, parser=self.config.device_list_parser)
+        ):
+            try:
+                device = parse_device(record)
+            except Exception as e:
+                log.warning(f"Skipping device {index} of {filename}: {e}")
+                skipped += 1
+                continue
+            dev_obj, _dev_index = self.active_directory.add_device(
+                device.dev_eui, device.dev_addr
             )
-            if self.statistics.get("devices").get(dev_eui) is None:
-                self.statistics["devices"][dev_eui] = {
-                    "dev_addr": dev_addr,
-                    "legacy_frames": 0,
-                    "edge_frames": 0,
-                }
-            else:
-                self.statistics["devices"][dev_eui]["dev_addr"] = dev_addr
-
-            if dev_eui not in self.ed_ids:
-                self.e2ed_ids.append(dev_eui)
-
-            dev_obj = {
-                "dev_id": dev_id,
-                "dev_eui": dev_eui,
-                "dev_addr": dev_addr,
-                "e2gw": None,
-                "edgeSIntKey": edgeSIntKey,
-                "edgeSEncKey": edgeSEncKey,
-            }
-            self.active_directory["e2eds"][dev_eui] = dev_obj
+            dev_obj.dev_id = device.dev_id
+            dev_obj.e2gw = None
+            dev_obj.edgeSIntKey = device.edge_s_int_key
+            dev_obj.edgeSEncKey = device.edge_s_enc_key
+            dev_obj.in_directory = True
+            loaded += 1
+        self.device_list_report = {
+            "devices": loaded,
+            "skipped": skipped,
+            "seconds": time.perf_counter() - start,
+        }
+        log.info(
+            f"Loaded {loaded} devices from {filename} in "
+            f"{self.device_list_report['seconds'] * 1000:.1f} ms ({skipped} skipped)"
+        )
 
     """
         @brief this function send log to the dashboard
@@ -230,15 +543,14 @@ class E2LoRaModule:
     """
 
     def _send_log(self, type, message):
-        if self.collection is not None:
+        if self.storage is not None:
             log_obj = {
-                "_id": self._get_now_isostring(),
                 "type": LOG_DOC_TYPE,
                 "key_agreement_log_message_node_id": type,
                 "key_agreement_message_log": message,
                 "key_agreement_process_time": 0,
             }
-            self.collection.insert_one(log_obj)
+            self._insert_doc(log_obj)
             return
         elif self.dashboard_rpc_stub is not None:
             request = SendLogMessage(
@@ -267,11 +579,10 @@ class E2LoRaModule:
     def _push_log_to_db(
         self, module_id, dev_addr, log_message, frame_type, fcnt, timetag, gw_id=None
     ):
-        if self.collection is None:
+        if self.storage is None:
             return -1
         timetag_dm = int(round(time.time() * 1000))
         log_obj = {
-            "_id": self._get_now_isostring(),
             "type": LOG_V2_DOC_TYPE,
             "module_id": module_id,
             "dev_addr": dev_addr,
@@ -283,84 +594,176 @@ class E2LoRaModule:
         }
         if gw_id is not None:
             log_obj["gw_id"] = gw_id
-        self.collection.insert_one(log_obj)
+        self._insert_doc(log_obj)
         return 0
 
     """
-        @brief  This function collect the stats
-        @return The updated dict containing the stats
+        @brief  This function records the latency of a handler call.
+        @param handler: The handler name (metric label).
+        @param start: The time.perf_counter() value at the start of the call.
+        @return None.
     """
 
-    def _get_db_stats(self):
-        gw_1_info = {}
-        gw_2_info = {}
-        if len(self.e2gw_ids) > 0:
-            gw_1_info = self.statistics["gateways"][self.e2gw_ids[0]]
-        if len(self.e2gw_ids) > 1:
-            gw_2_info = self.statistics["gateways"][self.e2gw_ids[1]]
-        ns_info = self.statistics.get("ns", {})
-        dm_info = self.statistics.get("dm", {})
-        new_stats_data = {
-            "gw_1_received_frame_num": gw_1_info.get("rx", 0),
-            "gw_1_transmitted_frame_num": gw_1_info.get("tx", 0),
-            "gw_2_received_frame_num": gw_2_info.get("rx", 0),
-            "gw_2_transmitted_frame_num": gw_2_info.get("tx", 0),
-            "ns_received_frame_num": ns_info.get("rx", 0),
-            "ns_transmitted_frame_num": ns_info.get("tx", 0),
-            "ns_dropped_legacy_frames": self.legacy_dropped,
-            "dm_received_frame_num": dm_info.get("rx_legacy_frames", 0)
-            + dm_info.get("rx_e2l_frames", 0),
-            "dm_received_legacy_frame_num": dm_info.get("rx_legacy_frames", 0),
-            "dm_received_e2l_frame_num": dm_info.get("rx_e2l_frames", 0),
-            "aggregation_function_result": self.statistics.get("aggregation_result", 0),
-        }
-        stats_data = None
-        if self.last_stats is not None:
-            stats_data = {
-                "gw_1_received_frame_num": new_stats_data.get(
-                    "gw_1_received_frame_num", 0
-                )
-                - self.last_stats.get("gw_1_received_frame_num", 0),
-                "gw_1_transmitted_frame_num": new_stats_data.get(
-                    "gw_1_transmitted_frame_num", 0
-                )
-                - self.last_stats.get("gw_1_transmitted_frame_num", 0),
-                "gw_2_received_frame_num": new_stats_data.get(
-                    "gw_2_received_frame_num", 0
+    def observe_handler_latency(self, handler, start):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        histogram = self.handler_latency.get(handler)
+        if histogram is None:
+            with self.handler_latency_lock:
+                histogram = self.handler_latency.setdefault(handler, LatencyHistogram())
+        histogram.observe(elapsed_ms)
+
+    """
+        @brief  This function writes the sink metrics (metrics endpoint collector).
+        @param writer: The MetricsWriter.
+        @return None.
+    """
+
+    def collect_metrics(self, writer):
+        with self.handler_latency_lock:
+            handler_latency = sorted(self.handler_latency.items())
+        for handler, histogram in handler_latency:
+            writer.histogram(
+                "e2l_handler_latency_seconds",
+                "Latency of the sink handlers.",
+                histogram,
+                {"handler": handler},
+            )
+        counters = self.counters.snapshot()
+        for frame_type, name in (
+            ("legacy", DM_RX_LEGACY_COUNTER),
+            ("e2l", DM_RX_E2L_COUNTER),
+        ):
+            writer.counter(
+                "e2l_dm_received_frames_total",
+                "Frames received by the DM.",
+                counters.get(name),
+                {"frame_type": frame_type},
+            )
+        writer.counter(
+            "e2l_ns_transmitted_frames_total",
+            "Legacy frames forwarded by the NS.",
+            counters.get(NS_TX_COUNTER),
+        )
+        writer.counter(
+            "e2l_ns_dropped_legacy_frames_total",
+            "Duplicated legacy frames dropped.",
+            counters.get(NS_DROPPED_LEGACY_COUNTER),
+        )
+        writer.counter(
+            "e2l_dm_dropped_e2l_frames_total",
+            "Duplicated aggregates dropped.",
+            counters.get(DM_DROPPED_E2L_COUNTER),
+        )
+        if self.dashboard_stream is not None:
+            self.dashboard_stream.collect_metrics(writer)
+        if self.reference_aggregator is not None:
+            reference_stats = self.reference_aggregator.get_stats()
+            for outcome in REFERENCE_OUTCOMES:
+                writer.counter(
+                    "e2l_reference_aggregates_total",
+                    "Edge aggregates compared with the legacy payloads.",
+                    reference_stats["outcomes"][outcome],
+                    {"outcome": outcome},
                 )
-                - self.last_stats.get("gw_2_received_frame_num", 0),
-                "gw_2_transmitted_frame_num": new_stats_data.get(
-                    "gw_2_transmitted_frame_num", 0
+            writer.gauge(
+                "e2l_reference_pending_aggregates",
+                "Edge aggregates waiting for their legacy frames.",
+                reference_stats["pending"],
+            )
+            writer.gauge(
+                "e2l_reference_last_error",
+                "Difference between the last mismatched aggregate and its reference.",
+                reference_stats["last_error"],
+            )
+        gw_ids = list(self.e2gw_ids)
+        for metric, help, name in (
+            (
+                "e2l_gateway_rx_frames_total",
+                "Frames received by an E2GW.",
+                GW_RX_COUNTER,
+            ),
+            (
+                "e2l_gateway_tx_frames_total",
+                "Frames forwarded by an E2GW.",
+                GW_TX_COUNTER,
+            ),
+        ):
+            for index, gw_id in enumerate(gw_ids):
+                writer.counter(
+                    metric, help, counters.get(name, index), {"gw_id": gw_id}
                 )
-                - self.last_stats.get("gw_2_transmitted_frame_num", 0),
-                "ns_received_frame_num": new_stats_data.get("ns_received_frame_num", 0)
-                - self.last_stats.get("ns_received_frame_num", 0),
-                "ns_transmitted_frame_num": new_stats_data.get(
-                    "ns_transmitted_frame_num", 0
+        writer.gauge("e2l_devices", "EDs in the active directory.", len(self.e2ed_ids))
+        writer.gauge(
+            "e2l_aggregation_result",
+            "Last aggregated value of the first ED.",
+            self.aggregation_result,
+        )
+        if self.storage is not None:
+            storage_stats = self.storage.get_stats()
+            if "queue_depth" in storage_stats:
+                writer.gauge(
+                    "e2l_storage_queue_depth",
+                    "Documents waiting in the storage backend queue.",
+                    storage_stats["queue_depth"],
                 )
-                - self.last_stats.get("ns_transmitted_frame_num", 0),
-                "ns_dropped_legacy_frames": new_stats_data.get(
-                    "ns_dropped_legacy_frames", 0
+            for outcome in ("written", "dropped", "spilled", "write_errors"):
+                if outcome not in storage_stats:
+                    continue
+                writer.counter(
+                    "e2l_storage_documents_total",
+                    "Documents handled by the storage backend.",
+                    storage_stats[outcome],
+                    {"outcome": outcome},
                 )
-                - self.last_stats.get("ns_dropped_legacy_frames", 0),
-                "dm_received_frame_num": new_stats_data.get("dm_received_frame_num", 0)
-                - self.last_stats.get("dm_received_frame_num", 0),
-                "dm_received_legacy_frame_num": new_stats_data.get(
-                    "dm_received_legacy_frame_num", 0
+            flush_latency = getattr(self.storage, "flush_latency", None)
+            if flush_latency is not None:
+                writer.histogram(
+                    "e2l_storage_flush_latency_seconds",
+                    "Latency of the storage backend flushes.",
+                    flush_latency,
                 )
-                - self.last_stats.get("dm_received_legacy_frame_num", 0),
-                "dm_received_e2l_frame_num": new_stats_data.get(
-                    "dm_received_e2l_frame_num", 0
+        for client in self.gateway_channels.get_clients():
+            for method, histogram in client.latency.items():
+                if histogram.snapshot()["count"] == 0:
+                    continue
+                writer.histogram(
+                    "e2l_gateway_rpc_latency_seconds",
+                    "Latency of the RPCs to the E2GWs.",
+                    histogram,
+                    {"gw_id": client.gw_id, "method": method},
                 )
-                - self.last_stats.get("dm_received_e2l_frame_num", 0),
-                "aggregation_function_result": self.statistics.get(
-                    "aggregation_result", 0
-                ),
-            }
-        else:
-            stats_data = new_stats_data
-        self.last_stats = new_stats_data
-        return stats_data
+
+    """
+        @brief  This function collect the stats
+        @return The updated dict containing the stats
+    """
+
+    def _get_db_stats(self):
+        _totals, delta = self.counters.delta(DB_STATS_CONSUMER)
+        return self._stats_from_counters(delta)
+
+    """
+        @brief  This function maps the sink counters to the stats document fields.
+        @param counters: The CounterSnapshot (totals or delta).
+        @return dict with the stats document fields.
+    """
+
+    def _stats_from_counters(self, counters):
+        dm_rx_legacy_frames = counters.get(DM_RX_LEGACY_COUNTER)
+        dm_rx_e2l_frames = counters.get(DM_RX_E2L_COUNTER)
+        return {
+            "gw_1_received_frame_num": counters.get(GW_RX_COUNTER, 0),
+            "gw_1_transmitted_frame_num": counters.get(GW_TX_COUNTER, 0),
+            "gw_2_received_frame_num": counters.get(GW_RX_COUNTER, 1),
+            "gw_2_transmitted_frame_num": counters.get(GW_TX_COUNTER, 1),
+            "ns_received_frame_num": counters.get(NS_RX_COUNTER),
+            "ns_transmitted_frame_num": counters.get(NS_TX_COUNTER),
+            "ns_dropped_legacy_frames": counters.get(NS_DROPPED_LEGACY_COUNTER),
+            "dm_received_frame_num": dm_rx_legacy_frames + dm_rx_e2l_frames,
+            "dm_received_legacy_frame_num": dm_rx_legacy_frames,
+            "dm_received_e2l_frame_num": dm_rx_e2l_frames,
+            "aggregation_function_result": self.aggregation_result,
+        }
 
     """
         @brief  This function collect the stats and return a SendStatistics object
@@ -368,32 +771,69 @@ class E2LoRaModule:
     """
 
     def _get_stats(self):
-        for i in range(1):
-            gw_1_info = {}
-            gw_2_info = {}
-            if len(self.e2gw_ids) > 0:
-                gw_1_info = self.statistics["gateways"][self.e2gw_ids[0]]
-            if len(self.e2gw_ids) > 1:
-                gw_2_info = self.statistics["gateways"][self.e2gw_ids[1]]
-            ns_info = self.statistics.get("ns", {})
-            dm_info = self.statistics.get("dm", {})
-            request = SendStatistics(
-                client_id=1,
-                message_data="",
-                gw_1_received_frame_num=gw_1_info.get("rx", 0),
-                gw_1_transmitted_frame_num=gw_1_info.get("tx", 0),
-                gw_2_received_frame_num=gw_2_info.get("rx", 0),
-                gw_2_transmitted_frame_num=gw_2_info.get("tx", 0),
-                ns_received_frame_frame_num=ns_info.get("rx", 0),
-                ns_transmitted_frame_frame_num=ns_info.get("tx", 0),
-                module_received_frame_frame_num=dm_info.get("rx_legacy_frames", 0)
-                + dm_info.get("rx_e2l_frames", 0),
-                aggregation_function_result=self.statistics.get(
-                    "aggregation_result", 0
-                ),
-            )
-            yield request
-            # time.sleep(5)
+        yield self._get_stats_message()
+
+    """
+        @brief  This function returns the current stats as a SendStatistics object
+        @return SendStatistics
+    """
+
+    def _get_stats_message(self):
+        stats = self._stats_from_counters(self.counters.snapshot())
+        return SendStatistics(
+            client_id=1,
+            message_data="",
+            gw_1_received_frame_num=stats["gw_1_received_frame_num"],
+            gw_1_transmitted_frame_num=stats["gw_1_transmitted_frame_num"],
+            gw_2_received_frame_num=stats["gw_2_received_frame_num"],
+            gw_2_transmitted_frame_num=stats["gw_2_transmitted_frame_num"],
+            ns_received_frame_frame_num=stats["ns_received_frame_num"],
+            ns_transmitted_frame_frame_num=stats["ns_transmitted_frame_num"],
+            module_received_frame_frame_num=stats["dm_received_frame_num"],
+            aggregation_function_result=stats["aggregation_function_result"],
+        )
+
+    """
+        @brief  This function pushes the current aggregation parameters to the gateways,
+                concurrently. The gateways that already acknowledged them are skipped.
+        @return dict gw_id -> {"success", "latency_ms"}, for the gateways contacted.
+    """
+
+    def _push_aggregation_params(self):
+        aggregation_params = (self.aggregation_function, self.window_size)
+        targets = {}
+        for gw_info in self.e2gw_ids.records():
+            if (
+                gw_info.e2gw_stub is not None
+                and gw_info.aggregation_params != aggregation_params
+            ):
+                targets[gw_info.gw_rpc_endpoint_address] = gw_info
+        if len(targets) == 0:
+            return {}
+        new_aggregation_params = AggregationParams(
+            aggregation_function=self.aggregation_function, window_size=self.window_size
+        )
+        report = self.gateway_channels.fan_out(
+            "update_aggregation_params",
+            [
+                (gw_info.e2gw_stub, new_aggregation_params)
+                for gw_info in targets.values()
+            ],
+            deadline=self.aggregation_push_deadline,
+        )
+        for gw_id, result in report.items():
+            if result["success"]:
+                targets[gw_id].aggregation_params = aggregation_params
+                self._persist_gateway(targets[gw_id])
+            else:
+                log.warning(
+                    f"Unable to update aggregation params of {gw_id}: {result['error']}"
+                )
+        log.debug(f"Aggregation params {aggregation_params} pushed: {report}")
+        return {
+            gw_id: {"success": result["success"], "latency_ms": result["latency_ms"]}
+            for gw_id, result in report.items()
+        }
 
     """
         @brief This function updated the paramenters according to the settings of the dashboard.
@@ -416,25 +856,16 @@ class E2LoRaModule:
         window_size,
     ):
         # UPDATE AGGREGATION PARAMETERS
-        if (
-            self.window_size is None
-            or self.aggregation_function is None
-            or self.window_size != window_size
-            or self.aggregation_function != aggregation_function
+        if self.cluster is not None and (aggregation_function, window_size) != (
+            self.aggregation_function,
+            self.window_size,
         ):
-            self.window_size = window_size
-            self.aggregation_function = aggregation_function
-            for e2gw_id in self.e2gw_ids:
-                gw_info = self.active_directory["e2gws"].get(e2gw_id)
-                gw_stub = gw_info.get("e2gw_stub")
-                new_aggregation_params = AggregationParams(
-                    aggregation_function=aggregation_function, window_size=window_size
-                )
-                gw_stub.update_aggregation_params(new_aggregation_params)
+            self.cluster.publish(AGGREGATION_STATE, [aggregation_function, window_size])
+        self.window_size = window_size
+        self.aggregation_function = aggregation_function
+        self._push_aggregation_params()
 
-        rejoin_command_base64 = base64.b64encode(REJOIN_COMMAND.encode("utf-8")).decode(
-            "utf-8"
-        )
+        rejoin_command_base64 = REJOIN_COMMAND_BASE64
 
         # UPDATE ED 1 GW SELECTION
         if ed_1_gw_selection is not None and len(self.e2gw_ids) >= ed_1_gw_selection:
@@ -442,27 +873,33 @@ class E2LoRaModule:
             if len(self.e2ed_ids) > 0:
                 dev_eui = self.e2ed_ids[0]
                 new_e2gw_id = self.e2gw_ids[self.ed_1_gw_selection - 1]
-                e2ed_info = self.active_directory["e2eds"].get(dev_eui)
-                if e2ed_info is not None:
-                    e2ed_addr = e2ed_info.get("dev_addr")
-                    old_e2gw_id = e2ed_info.get("e2gw")
+                e2ed_info = self.e2ed_ids.get(dev_eui)
+                if (
+                    e2ed_info is not None
+                    and e2ed_info.in_directory
+                    and self.owns_device(dev_eui)
+                ):
+                    e2ed_addr = e2ed_info.dev_addr
+                    old_e2gw_id = e2ed_info.e2gw
                     if new_e2gw_id != old_e2gw_id:
-                        self.active_directory["e2eds"][dev_eui]["e2gw"] = new_e2gw_id
-                        dev_id = e2ed_info.get("dev_id")
+                        e2ed_info.e2gw = new_e2gw_id
+                        self._persist_device(e2ed_info)
+                        dev_id = e2ed_info.dev_id
                         self._send_downlink_frame(
                             base64_message=rejoin_command_base64,
                             dev_id=dev_id,
                             lorawan_port=DEFAULT_E2L_COMMAND_PORT,
                             priority="HIGHEST",
+                            gw_id=old_e2gw_id,
                         )
-                        old_gw_info = self.active_directory["e2gws"].get(old_e2gw_id)
+                        old_gw_info = self.e2gw_ids.get(old_e2gw_id)
                         if old_gw_info is not None:
-                            old_e2gw_stub = old_gw_info.get("e2gw_stub")
+                            old_e2gw_stub = old_gw_info.e2gw_stub
                             if old_e2gw_stub is not None:
                                 e2ed_data = old_e2gw_stub.remove_e2device(
                                     E2LDeviceInfo(
                                         dev_eui=dev_eui,
-                                        dev_addr=e2ed_info.get("dev_addr"),
+                                        dev_addr=e2ed_addr,
                                     )
                                 )
                                 if e2ed_data.status_code == 0:
@@ -472,7 +909,9 @@ class E2LoRaModule:
                                         dev_eui=dev_eui,
                                         dev_addr=e2ed_addr,
                                         aggregated_data=e2ed_data.aggregated_data,
-                                        delta_time=0,
+                                        # E2LData carries no fcnts: no dedup
+                                        fcnts=[],
+                                        timetag=e2ed_data.timetag,
                                         gw_log_message=log_message,
                                     )
 
@@ -482,27 +921,33 @@ class E2LoRaModule:
             if len(self.e2ed_ids) > 1:
                 dev_eui = self.e2ed_ids[1]
                 new_e2gw_id = self.e2gw_ids[self.ed_2_gw_selection - 1]
-                e2ed_info = self.active_directory["e2eds"].get(dev_eui)
-                if e2ed_info is not None:
-                    e2ed_addr = e2ed_info.get("dev_addr")
-                    old_e2gw_id = e2ed_info.get("e2gw")
+                e2ed_info = self.e2ed_ids.get(dev_eui)
+                if (
+                    e2ed_info is not None
+                    and e2ed_info.in_directory
+                    and self.owns_device(dev_eui)
+                ):
+                    e2ed_addr = e2ed_info.dev_addr
+                    old_e2gw_id = e2ed_info.e2gw
                     if new_e2gw_id != old_e2gw_id:
-                        self.active_directory["e2eds"][dev_eui]["e2gw"] = new_e2gw_id
-                        dev_id = e2ed_info.get("dev_id")
+                        e2ed_info.e2gw = new_e2gw_id
+                        self._persist_device(e2ed_info)
+                        dev_id = e2ed_info.dev_id
                         self._send_downlink_frame(
                             base64_message=rejoin_command_base64,
                             dev_id=dev_id,
                             lorawan_port=DEFAULT_E2L_COMMAND_PORT,
                             priority="HIGHEST",
+                            gw_id=old_e2gw_id,
                         )
-                        old_gw_info = self.active_directory["e2gws"].get(old_e2gw_id)
+                        old_gw_info = self.e2gw_ids.get(old_e2gw_id)
                         if old_gw_info is not None:
-                            old_e2gw_stub = old_gw_info.get("e2gw_stub")
+                            old_e2gw_stub = old_gw_info.e2gw_stub
                             if old_e2gw_stub is not None:
                                 e2ed_data = old_e2gw_stub.remove_e2device(
                                     E2LDeviceInfo(
                                         dev_eui=dev_eui,
-                                        dev_addr=e2ed_info.get("dev_addr"),
+                                        dev_addr=e2ed_addr,
                                     )
                                 )
                                 if e2ed_data.status_code == 0:
@@ -512,7 +957,9 @@ class E2LoRaModule:
                                         dev_eui=dev_eui,
                                         dev_addr=e2ed_addr,
                                         aggregated_data=e2ed_data.aggregated_data,
-                                        delta_time=0,
+                                        # E2LData carries no fcnts: no dedup
+                                        fcnts=[],
+                                        timetag=e2ed_data.timetag,
                                         gw_log_message=log_message,
                                     )
 
@@ -522,22 +969,28 @@ class E2LoRaModule:
             if len(self.e2ed_ids) > 2:
                 dev_eui = self.e2ed_ids[2]
                 new_e2gw_id = self.e2gw_ids[self.ed_3_gw_selection - 1]
-                e2ed_info = self.active_directory["e2eds"].get(dev_eui)
-                if e2ed_info is not None:
-                    e2ed_addr = e2ed_info.get("dev_addr")
-                    old_e2gw_id = e2ed_info.get("e2gw")
+                e2ed_info = self.e2ed_ids.get(dev_eui)
+                if (
+                    e2ed_info is not None
+                    and e2ed_info.in_directory
+                    and self.owns_device(dev_eui)
+                ):
+                    e2ed_addr = e2ed_info.dev_addr
+                    old_e2gw_id = e2ed_info.e2gw
                     if new_e2gw_id != old_e2gw_id:
-                        self.active_directory["e2eds"][dev_eui]["e2gw"] = new_e2gw_id
-                        dev_id = e2ed_info.get("dev_id")
+                        e2ed_info.e2gw = new_e2gw_id
+                        self._persist_device(e2ed_info)
+                        dev_id = e2ed_info.dev_id
                         self._send_downlink_frame(
                             base64_message=rejoin_command_base64,
                             dev_id=dev_id,
                             lorawan_port=DEFAULT_E2L_COMMAND_PORT,
                             priority="HIGHEST",
+                            gw_id=old_e2gw_id,
                         )
-                        old_gw_info = self.active_directory["e2gws"].get(old_e2gw_id)
+                        old_gw_info = self.e2gw_ids.get(old_e2gw_id)
                         if old_gw_info is not None:
-                            old_e2gw_stub = old_gw_info.get("e2gw_stub")
+                            old_e2gw_stub = old_gw_info.e2gw_stub
                             if old_e2gw_stub is not None:
                                 e2ed_data = old_e2gw_stub.remove_e2device(
                                     E2LDeviceInfo(
@@ -555,9 +1008,26 @@ class E2LoRaModule:
                                         dev_eui=dev_eui,
                                         dev_addr=e2ed_addr,
                                         aggregated_data=e2ed_data.aggregated_data,
-                                        delta_time=0,
+                                        # E2LData carries no fcnts: no dedup
+                                        fcnts=[],
+                                        timetag=e2ed_data.timetag,
                                         gw_log_message=log_message,
                                     )
+        self._persist_params()
+
+    """
+        @brief  This function push the current stats to the DB.
+        @return None
+    """
+
+    def _push_db_stats(self):
+        stats_obj = self._get_db_stats()
+        stats_obj["type"] = STATS_DOC_TYPE
+        log.debug("Pushing new stats obj to DB...")
+        self._insert_doc(stats_obj)
+        log.debug("Stats pushed to DB.")
+        log.debug(f"Storage stats: {self.storage.get_stats()}")
+        log.debug(f"E2GW RPC stats: {self.gateway_channels.get_stats()}")
 
     """
         @brief  This function is used to periodically push the stats to the DB.
@@ -567,50 +1037,95 @@ class E2LoRaModule:
     def _update_db(self):
         while True:
             time.sleep(self.default_sleep_seconds)
-            stats_obj = self._get_db_stats()
-            stats_obj["_id"] = self._get_now_isostring()
-            stats_obj["type"] = STATS_DOC_TYPE
-            log.debug("Pushing new stats obj to DB...")
-            print(json.dumps(stats_obj, indent=2))
-            self.collection.insert_one(stats_obj)
-            log.debug("Stats pushed to DB.")
+            self._push_db_stats()
 
     """
-        @brief  This function is used to periodically send the stats to the dashboard, and get the new settings.
+        @brief  This function send the stats to the dashboard, and apply the new settings.
         @return None
     """
 
-    def _update_dashboard(self):
-        while True:
-            log.debug("Sending statistics to dashboard")
-            response = self.dashboard_rpc_stub.ClientStreamingMethodStatistics(
-                self._get_stats()
-            )
-            log.debug(f"Received commands from dashboard:\n{response}")
-            ed_1_gw_selection = response.ed_1_gw_selection
-            ed_2_gw_selection = response.ed_2_gw_selection
-            ed_3_gw_selection = response.ed_3_gw_selection
-            aggregation_function_str = response.process_function
+    def _sync_dashboard(self):
+        log.debug("Sending statistics to dashboard")
+        response = self.dashboard_rpc_stub.ClientStreamingMethodStatistics(
+            self._get_stats()
+        )
+        self._apply_dashboard_command(response)
+
+    """
+        @brief  This function applies the settings received from the dashboard.
+                A command equal to the last one applied is skipped.
+        @param response: The ReplyStatistics object.
+        @return None
+    """
+
+    def _apply_dashboard_command(self, response):
+        log.debug(f"Received commands from dashboard:\n{response}")
+        ed_1_gw_selection = response.ed_1_gw_selection
+        ed_2_gw_selection = response.ed_2_gw_selection
+        ed_3_gw_selection = response.ed_3_gw_selection
+        aggregation_function_str = response.process_function
+        aggregation_function = AVG_ID
+        if aggregation_function_str == "mean":
             aggregation_function = AVG_ID
-            if aggregation_function_str == "mean":
-                aggregation_function = AVG_ID
-            elif aggregation_function_str == "sum":
-                aggregation_function = SUM_ID
-            elif aggregation_function_str == "min":
-                aggregation_function = MIN_ID
-            elif aggregation_function_str == "max":
-                aggregation_function = MAX_ID
-            else:
-                log.error("Unknown aggregation function. Setting to AVG.")
-            window_size = response.process_window
-            self._update_params(
-                ed_1_gw_selection,
-                ed_2_gw_selection,
-                ed_3_gw_selection,
-                aggregation_function,
-                window_size,
-            )
-            time.sleep(self.default_sleep_seconds)
+        elif aggregation_function_str == "sum":
+            aggregation_function = SUM_ID
+        elif aggregation_function_str == "min":
+            aggregation_function = MIN_ID
+        elif aggregation_function_str == "max":
+            aggregation_function = MAX_ID
+        else:
+            log.error("Unknown aggregation function. Setting to AVG.")
+        window_size = response.process_window
+        command = (
+            ed_1_gw_selection,
+            ed_2_gw_selection,
+            ed_3_gw_selection,
+            aggregation_function,
+            window_size,
+        )
+        if command == self.dashboard_command:
+            return
+        self.dashboard_command = command
+        self._update_params(*command)
+
+    """
+        @brief  This function streams the stats to the dashboard, and applies the new settings.
+        @return None
+    """
+
+    def _update_dashboard(self):
+        self.dashboard_stream = DashboardStream(
+            self.dashboard_rpc_stub,
+            self._get_stats_message,
+            self._apply_dashboard_command,
+            poll=self._sync_dashboard,
+            debounce=self.config.dashboard_debounce,
+            heartbeat=self.config.dashboard_heartbeat,
+            reconnect_max=self.config.dashboard_reconnect_max,
+        )
+        self.dashboard_stream.run()
+
+    """
+        @brief  This function push the resources stats of the DM to the DB.
+        @return None
+    """
+
+    def _push_resource_stats(self):
+        mem_info = psutil.virtual_memory()
+        memory_usage = mem_info.used
+        memory_available = mem_info.available
+        cpu_usage = psutil.cpu_percent()
+        dm_sys_stats = {
+            "gw_id": "DM",
+            "memory_usage": memory_usage,
+            "memory_available": memory_available,
+            "cpu_usage": cpu_usage,
+            "data_received": 0,
+            "data_transmitted": 0,
+            "type": SYS_DOC_TYPE,
+        }
+        log.debug("Pushing sys stats in DB")
+        self._insert_doc(dm_sys_stats)
 
     """
         @brief  This function is used to periodically send the resources stats of the DM to the DB.
@@ -619,22 +1134,7 @@ class E2LoRaModule:
 
     def _monitor_resource(self):
         while True:
-            mem_info = psutil.virtual_memory()
-            memory_usage = mem_info.used
-            memory_available = mem_info.available
-            cpu_usage = psutil.cpu_percent()
-            dm_sys_stats = {
-                "_id": self._get_now_isostring(),
-                "gw_id": "DM",
-                "memory_usage": memory_usage,
-                "memory_available": memory_available,
-                "cpu_usage": cpu_usage,
-                "data_received": 0,
-                "data_transmitted": 0,
-                "type": SYS_DOC_TYPE,
-            }
-            log.debug("Pushing sys stats in DB")
-            self.collection.insert_one(dm_sys_stats)
+            self._push_resource_stats()
             time.sleep(1)
 
     """
@@ -647,38 +1147,36 @@ class E2LoRaModule:
             return -1
         # GET STUB OF GW TO SHUT
         shut_gw_id = self.e2gw_ids[1]
-        shut_gw_info = self.active_directory["e2gws"].get(shut_gw_id, {})
-        shut_gw_stub = shut_gw_info.get("e2gw_stub")
+        shut_gw_info = self.e2gw_ids.get(shut_gw_id)
+        shut_gw_stub = getattr(shut_gw_info, "e2gw_stub", None)
         if shut_gw_stub is None:
             return -1
         self.gw_shut_done = True
         # GET STUB OF GW TO PERFORM HANDOVER
         handover_gw_id = self.e2gw_ids[0]
-        handover_gw_info = self.active_directory["e2gws"].get(handover_gw_id, {})
-        handover_gw_stub = handover_gw_info.get("e2gw_stub")
+        handover_gw_info = self.e2gw_ids.get(handover_gw_id)
+        handover_gw_stub = getattr(handover_gw_info, "e2gw_stub", None)
         if handover_gw_stub is None:
             return -1
 
         # SHUT GW
         shut_gw_stub.set_active(ActiveFlag(is_active=False))
         device_list = []
-        for dev_index in range(len(self.e2ed_ids)):
-            dev_eui = self.e2ed_ids[dev_index]
+        for dev_obj in self.e2ed_ids.records():
             if (
-                self.active_directory["e2eds"].get(dev_eui, {}).get("e2gw", "")
-                == shut_gw_id
+                dev_obj.in_directory
+                and dev_obj.e2gw == shut_gw_id
+                and self.owns_device(dev_obj.dev_eui)
             ):
-                self.active_directory["e2eds"][dev_eui]["e2gw"] = handover_gw_id
-                edge_s_enc_key = self.active_directory["e2eds"][dev_eui]["edgeSEncKey"]
-                edge_s_int_key = self.active_directory["e2eds"][dev_eui]["edgeSIntKey"]
-                edge_s_enc_key_bytes = bytes.fromhex(edge_s_enc_key)
-                edge_s_int_key_bytes = bytes.fromhex(edge_s_int_key)
+                dev_obj.e2gw = handover_gw_id
+                self._persist_device(dev_obj)
+                # Session keys are bytes (validated by the provisioning loader)
                 device_list.append(
                     Device(
-                        dev_eui=dev_eui,
-                        dev_addr=self.active_directory["e2eds"][dev_eui]["dev_addr"],
-                        edge_s_enc_key=edge_s_enc_key_bytes,
-                        edge_s_int_key=edge_s_int_key_bytes,
+                        dev_eui=dev_obj.dev_eui,
+                        dev_addr=dev_obj.dev_addr,
+                        edge_s_enc_key=dev_obj.edgeSEncKey,
+                        edge_s_int_key=dev_obj.edgeSIntKey,
                     )
                 )
         handover_gw_stub.add_devices(E2LDevicesInfoComplete(device_list=device_list))
@@ -691,27 +1189,21 @@ class E2LoRaModule:
         @param   dev_id: The device ID of the ED as in TTS.
         @param   lorawan_port: The port of the ED. (default: 3)
         @param   priority: The priority of the frame. (default: HIGHEST)
+        @param   gw_id: The E2GW serving the ED (downlink rate limit).
         @return   0 is success, < 0 if failure.
     """
 
     def _send_downlink_frame(
-        self, base64_message, dev_id, lorawan_port=3, priority="HIGHEST"
+        self, base64_message, dev_id, lorawan_port=3, priority="HIGHEST", gw_id=None
     ):
-        downlink_frame = {
-            "downlinks": [
-                {
-                    "f_port": lorawan_port,
-                    "frm_payload": base64_message,
-                    "priority": priority,
-                }
-            ]
-        }
-        downlink_frame_str = json.dumps(downlink_frame)
-
-        base_topic = os.getenv("MQTT_BASE_TOPIC")
-        topic = f"{base_topic}{dev_id}/down/replace"
-
-        res = self.mqtt_client.publish_to_topic(topic=topic, message=downlink_frame_str)
+        self.mqtt_client.send_downlink(
+            base_topic=self.config.mqtt_base_topic,
+            dev_id=dev_id,
+            base64_message=base64_message,
+            f_port=lorawan_port,
+            priority=priority,
+            gw_id=gw_id,
+        )
 
         return 0
 
@@ -728,43 +1220,85 @@ class E2LoRaModule:
 
     def handle_gw_pub_info(
         self, gw_rpc_endpoint_address, gw_rpc_endpoint_port, gw_pub_key_compressed
+    ):
+        if self.cluster is None:
+            return self._add_gateway(
+                gw_rpc_endpoint_address, gw_rpc_endpoint_port, gw_pub_key_compressed
+            )
+        # Every worker adds the gateway, in the order of the shared state
+        self.cluster.publish(
+            GATEWAY_STATE_PREFIX + gw_rpc_endpoint_address,
+            {"port": gw_rpc_endpoint_port, "pub_key": gw_pub_key_compressed.hex()},
+        )
+        self.cluster.sync()
+        return 0
+
+    def _apply_gateway_state(self, key, value):
+        self._add_gateway(
+            key[len(GATEWAY_STATE_PREFIX) :],
+            value["port"],
+            bytes.fromhex(value["pub_key"]),
+        )
+
+    def _apply_aggregation_state(self, key, value):
+        aggregation_function, window_size = value
+        if (aggregation_function, window_size) == (
+            self.aggregation_function,
+            self.window_size,
+        ):
+            return
+        self.aggregation_function = aggregation_function
+        self.window_size = window_size
+        self._persist_params()
+        self._push_aggregation_params()
+
+    """
+        @brief  This function adds (or updates) a gateway in the active directory,
+                derives g_as_gw and hands the preloaded devices over to the gateway.
+        @param gw_rpc_endpoint_address: The IP address of the Gateway.
+        @param gw_rpc_endpoint_port: The port of the Gateway.
+        @param gw_pub_key_compressed: The E2GW Public Key.
+        @return 0 is success, < 0 if failure.
+    """
+
+    def _add_gateway(
+        self, gw_rpc_endpoint_address, gw_rpc_endpoint_port, gw_pub_key_compressed
     ):
         log.debug("############################## KJHAKSHKSHKJSHAJKSHAKSHAJKH")
         # Retireve Info
         gw_pub_key = ECC.import_key(gw_pub_key_compressed, curve_name="P-256")
-        g_as_gw_point = gw_pub_key.pointQ * self.ephimeral_private_key.d
-        g_as_gw = ECC.construct(
-            curve="P-256", point_x=g_as_gw_point.x, point_y=g_as_gw_point.y
+        g_as_gw_bytes = self.key_agreement.derive_shared_point(
+            gw_pub_key_compressed
+        ).result(timeout=KEY_AGREEMENT_TIMEOUT_SEC)
+        g_as_gw = ECC.import_key(g_as_gw_bytes, curve_name="P-256")
+        # Exported once, sent in every edge join downlink
+        g_as_gw_base64 = base64.b64encode(g_as_gw_bytes).decode("utf-8")
+
+        # Get RPC Client (the channel is reused if the endpoint did not change)
+        stub = self.gateway_channels.get_client(
+            gw_rpc_endpoint_address, f"{gw_rpc_endpoint_address}:{gw_rpc_endpoint_port}"
         )
-
-        # Init RPC Client
-        channel = grpc.insecure_channel(
-            f"{gw_rpc_endpoint_address}:{gw_rpc_endpoint_port}"
-        )
-        stub = edge2gateway_pb2_grpc.Edge2GatewayStub(channel)
         new_aggregation_params = AggregationParams(
             aggregation_function=self.aggregation_function, window_size=self.window_size
         )
         stub.update_aggregation_params(new_aggregation_params)
+        aggregation_params = (self.aggregation_function, self.window_size)
 
-        self.active_directory["e2gws"][gw_rpc_endpoint_address] = {
-            "gw_rpc_endpoint_address": gw_rpc_endpoint_address,
-            "gw_rpc_endpoint_port": gw_rpc_endpoint_port,
-            "gw_pub_key": gw_pub_key,
-            "g_as_gw": g_as_gw,
-            "e2gw_stub": stub,
-        }
-        if self.statistics.get("gateways").get(gw_rpc_endpoint_address) is None:
-            self.statistics["gateways"][gw_rpc_endpoint_address] = {"rx": 0, "tx": 0}
         log_type = None
         log_message = ""
         if gw_rpc_endpoint_address not in self.e2gw_ids:
-            self.e2gw_ids.append(gw_rpc_endpoint_address)
             log_message = f"Added GW info in DM active directory"
         else:
             log_message = f"Updated GW info in DM active directory"
+        gw_info, index = self.active_directory.add_gateway(gw_rpc_endpoint_address)
+        gw_info.gw_rpc_endpoint_port = gw_rpc_endpoint_port
+        gw_info.gw_pub_key = gw_pub_key
+        gw_info.g_as_gw = g_as_gw
+        gw_info.g_as_gw_base64 = g_as_gw_base64
+        gw_info.e2gw_stub = stub
+        gw_info.aggregation_params = aggregation_params
+        self._persist_gateway(gw_info)
         # SEND LOG
-        index = self.e2gw_ids.index(gw_rpc_endpoint_address)
         log_type = None
         if index == 0:
             log_type = LOG_GW1
@@ -781,30 +1315,26 @@ class E2LoRaModule:
         # Check the preloaded devices
         total_devices = len(self.e2ed_ids)
         device_list = []
-        for dev_index in range(len(self.e2ed_ids)):
-            dev_eui = self.e2ed_ids[dev_index]
+        for dev_index, dev_obj in enumerate(self.e2ed_ids.records()):
             if (
-                self.active_directory["e2eds"].get(dev_eui) is not None
-                and self.active_directory["e2eds"][dev_eui].get("e2gw") is None
+                dev_obj.in_directory
+                and dev_obj.e2gw is None
+                and self.owns_device(dev_obj.dev_eui)
                 and (
                     (index == 0 and dev_index % 4 < 2)
                     or (index == 1 and dev_index % 4 >= 2)
-                    or len(self.e2ed_ids) < 10
+                    or total_devices < 10
                 )
             ):
-                self.active_directory["e2eds"][dev_eui][
-                    "e2gw"
-                ] = gw_rpc_endpoint_address
-                edge_s_enc_key = self.active_directory["e2eds"][dev_eui]["edgeSEncKey"]
-                edge_s_int_key = self.active_directory["e2eds"][dev_eui]["edgeSIntKey"]
-                edge_s_enc_key_bytes = bytes.fromhex(edge_s_enc_key)
-                edge_s_int_key_bytes = bytes.fromhex(edge_s_int_key)
+                dev_obj.e2gw = gw_rpc_endpoint_address
+                self._persist_device(dev_obj)
+                # Session keys are bytes (validated by the provisioning loader)
                 device_list.append(
                     Device(
-                        dev_eui=dev_eui,
-                        dev_addr=self.active_directory["e2eds"][dev_eui]["dev_addr"],
-                        edge_s_enc_key=edge_s_enc_key_bytes,
-                        edge_s_int_key=edge_s_int_key_bytes,
+                        dev_eui=dev_obj.dev_eui,
+                        dev_addr=dev_obj.dev_addr,
+                        edge_s_enc_key=dev_obj.edgeSEncKey,
+                        edge_s_int_key=dev_obj.edgeSIntKey,
                     )
                 )
         log.debug(f"Sending {len(device_list)} to {gw_rpc_endpoint_address}")
@@ -825,19 +1355,24 @@ class E2LoRaModule:
             type=LOG_ED, message=f"Dev {dev_eui} OTAA Activated. (Addr: {dev_addr})"
         )
 
-        if self.statistics.get("devices").get(dev_eui) is None:
-            self.statistics["devices"][dev_eui] = {
-                "dev_addr": dev_addr,
-                "legacy_frames": 0,
-                "edge_frames": 0,
-            }
-        else:
-            self.statistics["devices"][dev_eui]["dev_addr"] = dev_addr
-
-        if dev_eui not in self.ed_ids:
-            self.e2ed_ids.append(dev_eui)
+        # New session: the fcnts restart
+        dev_obj = self.e2ed_ids.get(dev_eui)
+        if dev_obj is not None and dev_obj.dev_addr is not None:
+            self._reset_fcnt_windows(dev_obj.dev_addr)
+        self._reset_fcnt_windows(dev_addr)
+        if self.reference_aggregator is not None:
+            self.reference_aggregator.reset(dev_eui)
+        dev_obj, _dev_index = self.active_directory.add_device(dev_eui, dev_addr)
+        self._persist_device(dev_obj)
+        if self.cluster is not None:
+            self.cluster.publish_device(dev_eui, dev_addr)
         return 0
 
+    def _reset_fcnt_windows(self, dev_addr):
+        if self.legacy_fcnts is not None:
+            self.legacy_fcnts.reset(dev_addr)
+            self.edge_fcnts.reset(dev_addr)
+
     """
         @brief  This function handle new public key info received by a ED.
                 It complete the process of key agreement for the server.
@@ -856,14 +1391,17 @@ class E2LoRaModule:
         # if len(self.e2ed_ids) < 1 or (dev_eui in self.e2ed_ids and self.e2ed_ids.index(dev_eui) == 0):
         self._send_log(type=LOG_ED, message=f"Starting Edge Join (Dev: {dev_addr})")
 
-        dev_obj = None
         e2gw = None
+        if self.cluster is not None:
+            # Gateways announced to the other workers
+            self.cluster.sync()
         # Check if ED is already registered
-        if self.active_directory["e2eds"].get(dev_eui) is None:
+        dev_record = self.e2ed_ids.get(dev_eui)
+        if dev_record is None or not dev_record.in_directory:
             # Assign E2GW to E2ED and store informations
             selected_e2gw = 1
-            if dev_eui in self.e2ed_ids:
-                ed_index = self.e2ed_ids.index(dev_eui)
+            ed_index = self.e2ed_ids.index(dev_eui)
+            if ed_index is not None:
                 if ed_index == 0:
                     selected_e2gw = self.ed_1_gw_selection
                 elif ed_index == 1:
@@ -884,40 +1422,29 @@ class E2LoRaModule:
                     pass
 
             if len(self.e2gw_ids) > 0:
-                if len(self.e2gw_ids) < selected_e2gw:
-                    e2gw = self.active_directory["e2gws"].get(self.e2gw_ids[0])
+                if selected_e2gw is None or len(self.e2gw_ids) < selected_e2gw:
+                    e2gw = self.e2gw_ids.get(self.e2gw_ids[0])
                 else:
-                    e2gw = self.active_directory["e2gws"].get(
-                        self.e2gw_ids[selected_e2gw - 1]
-                    )
+                    e2gw = self.e2gw_ids.get(self.e2gw_ids[selected_e2gw - 1])
             if e2gw is None:
                 log.error("No E2GW found")
                 return -1
-            dev_obj = {
-                "dev_id": dev_id,
-                "dev_eui": dev_eui,
-                "dev_addr": dev_addr,
-                "e2gw": e2gw.get("gw_rpc_endpoint_address"),
-            }
+            e2gw_id = e2gw.gw_rpc_endpoint_address
         else:
-            dev_obj = self.active_directory["e2eds"].get(dev_eui)
-            e2gw = self.active_directory["e2gws"].get(dev_obj.get("e2gw"))
+            e2gw_id = dev_record.e2gw
+            e2gw = self.e2gw_ids.get(e2gw_id)
             log.debug(f"E2ED: {dev_eui} already registered")
-            log.debug(f'E2GW: {dev_obj.get("e2gw")}')
+            log.debug(f"E2GW: {e2gw_id}")
             if e2gw is None:
                 log.error("No E2GW found")
                 return -1
         # SEND LOG
         # if len(self.e2ed_ids) < 1 or  (dev_eui in self.e2ed_ids and self.e2ed_ids.index(dev_eui) == 0):
         self._send_log(type=LOG_ED, message=f"Send EdgeJoinRequest (Dev: {dev_addr})")
-        # Get g_as_gw
-        g_as_gw = e2gw.get("g_as_gw")
-        # Schedule downlink to ed with g_as_gw
-        # encode g_as_gw in base64
-        g_as_gw_exported = g_as_gw.export_key(format="SEC1")
-        g_as_gw_base_64 = base64.b64encode(g_as_gw_exported).decode("utf-8")
+        # Schedule downlink to ed with g_as_gw (base64 encoded)
+        g_as_gw_base_64 = e2gw.g_as_gw_base64
         _downlink_frame = self._send_downlink_frame(
-            base64_message=g_as_gw_base_64, dev_id=dev_id
+            base64_message=g_as_gw_base_64, dev_id=dev_id, gw_id=e2gw_id
         )
         # SEND LOG
         # if len(self.e2ed_ids) < 1 or  (dev_eui in self.e2ed_ids and self.e2ed_ids.index(dev_eui) == 0):
@@ -928,14 +1455,15 @@ class E2LoRaModule:
         # Generate g_as_ed
         # Decode base64
         dev_pub_key_compressed = base64.b64decode(dev_pub_key_compressed_base_64)
-        dev_pub_key = ECC.import_key(dev_pub_key_compressed, curve_name="P-256")
-        g_as_ed = dev_pub_key.pointQ * self.ephimeral_private_key.d
-        g_as_ed_bytes = ECC.construct(
-            curve="P-256", point_x=g_as_ed.x, point_y=g_as_ed.y
-        ).export_key(format="SEC1")
+        g_as_ed_bytes = self.g_as_ed_cache.get_or_compute(
+            dev_pub_key_compressed,
+            lambda: self.key_agreement.derive_shared_point(
+                dev_pub_key_compressed
+            ).result(timeout=KEY_AGREEMENT_TIMEOUT_SEC),
+        )
 
         ### Send g_as_ed to e2gw
-        e2gw_rpc_stub = e2gw.get("e2gw_stub")
+        e2gw_rpc_stub = e2gw.e2gw_stub
         ed_pub_info = EdPubInfo(
             dev_eui=dev_eui,
             dev_addr=dev_addr,
@@ -944,11 +1472,15 @@ class E2LoRaModule:
         )
         response = e2gw_rpc_stub.handle_ed_pub_info(ed_pub_info)
         g_gw_ed_bytes = response.g_gw_ed
-        g_gw_ed = ECC.import_key(g_gw_ed_bytes, curve_name="P-256")
-        edgeSKey_int = self.ephimeral_private_key.d * g_gw_ed.pointQ
-        edgeSKey = edgeSKey_int.x.to_bytes()
+        # g_gw_ed changes if the E2GW key changes: it is part of the cache key
+        edgeSIntKey, edgeSEncKey = self.edge_session_keys_cache.get_or_compute(
+            (dev_pub_key_compressed, g_gw_ed_bytes),
+            lambda: self.key_agreement.derive_edge_session_keys(g_gw_ed_bytes).result(
+                timeout=KEY_AGREEMENT_TIMEOUT_SEC
+            ),
+        )
         # SEND LOG
-        index = self.e2gw_ids.index(e2gw.get("gw_rpc_endpoint_address"))
+        index = self.e2gw_ids.index(e2gw_id)
         log_type = None
         if index == 0:
             log_type = LOG_GW1
@@ -961,26 +1493,25 @@ class E2LoRaModule:
                 type=log_type, message=f"Received Device {dev_addr} Public Info"
             )
 
-        # Hash edgeSKey
-        edgeSIntKey = b"\x00" + edgeSKey
-        edgeSEncKey = b"\x01" + edgeSKey
-        edgeSIntKey = hashlib.sha256(edgeSIntKey).digest()[:16]
-        edgeSEncKey = hashlib.sha256(edgeSEncKey).digest()[:16]
         log.info(f"edgeSIntKey: {[x for x in edgeSIntKey]}")
         log.info(f"edgeSEncKey: {[x for x in edgeSEncKey]}")
 
         # Store device info
-        dev_obj["edgeSIntKey"] = edgeSIntKey
-        dev_obj["edgeSEncKey"] = edgeSEncKey
-        self.active_directory["e2eds"][dev_eui] = dev_obj
-        if dev_eui not in self.e2ed_ids:
-            self.e2ed_ids.append(dev_eui)
+        dev_obj, ed_index = self.active_directory.add_device(dev_eui, dev_addr)
+        dev_obj.dev_id = dev_id
+        dev_obj.e2gw = e2gw_id
+        dev_obj.edgeSIntKey = edgeSIntKey
+        dev_obj.edgeSEncKey = edgeSEncKey
+        dev_obj.in_directory = True
+        self._persist_device(dev_obj)
+        if self.cluster is not None:
+            self.cluster.publish_device(dev_eui, dev_addr)
 
         # SEND LOG
         # if self.e2ed_ids.index(dev_eui) == 0:
         self._send_log(
             type=LOG_ED,
-            message=f'Edge Join Completed (Dev: {dev_addr}, GW: {self.e2gw_ids.index(e2gw.get("gw_rpc_endpoint_address"))+1})',
+            message=f"Edge Join Completed (Dev: {dev_addr}, GW: {index+1})",
         )
         if log_type is not None:
             self._send_log(
@@ -992,8 +1523,8 @@ class E2LoRaModule:
             join_update_message = SendJoinUpdateMessage(
                 client_id=1,
                 message_data="",
-                ed_id=self.e2ed_ids.index(dev_eui) + 1,
-                gw_id=self.e2gw_ids.index(e2gw.get("gw_rpc_endpoint_address")) + 1,
+                ed_id=ed_index + 1,
+                gw_id=index + 1,
             )
             ret = self.dashboard_rpc_stub.SimpleMethodsJoinUpdateMessage(
                 join_update_message
@@ -1031,15 +1562,24 @@ class E2LoRaModule:
             f"Received Legacy Frame from Legacy Route. Data: {frame_payload}. Dev: {dev_addr}."
         )
         # COMMENT OUT FOR BETTER STATS. TTS MQTT BROKER QoS 0
-        self.statistics["dm"]["rx_legacy_frames"] = (
-            self.statistics["dm"].get("rx_legacy_frames", 0) + 1
-        )
-        # self.statistics["ns"]["rx"] = self.statistics["ns"].get("rx", 0) + 1
-        self.statistics["ns"]["tx"] = self.statistics["ns"].get("tx", 0) + 1
+        counters = self.counters
+        counters.add(DM_RX_LEGACY_COUNTER)
+        # counters.add(NS_RX_COUNTER)
+        counters.add(NS_TX_COUNTER)
+        dev_index = self.e2ed_ids.index(dev_eui)
+        if dev_index is not None:
+            counters.add(ED_LEGACY_COUNTER, slot=dev_index)
 
         timestamp = rx_timestamp
         if frame_payload.isnumeric():
             timestamp = int(frame_payload)
+            if self.reference_aggregator is not None:
+                self.reference_aggregator.add_value(
+                    dev_eui,
+                    fcnt,
+                    timestamp,
+                    self.window_size or self.config.default_aggr_window_size,
+                )
         self._push_log_to_db(
             module_id="DM",
             dev_addr=dev_addr,
@@ -1056,7 +1596,8 @@ class E2LoRaModule:
         @param dev_eui: The Dev EUI.
         @param dev_addr: The Dev Addr.
         @param aggregated_data: The Aggregated Data.
-        @param delta_time: The Delta Time.
+        @param fcnts: The fcnts of the aggregated frames (empty if unknown).
+        @param timetag: The timetag of the aggregate.
         @return 0 is success, < 0 if failure.
     """
 
@@ -1073,6 +1614,26 @@ class E2LoRaModule:
         log.debug(
             f"Received Edge Frame from E2ED. Data: {aggregated_data}. Dev Addr: {dev_addr}. E2GW: {gw_id}."
         )
+        gw_index = self._get_gateway_index(gw_id)
+        # Same aggregate through another E2GW or resent after a handover. The
+        # fcnts of an unknown E2GW are not marked, its aggregate is rejected
+        if (
+            self.edge_fcnts is not None
+            and gw_index is not None
+            and len(fcnts) > 0
+            and self.edge_fcnts.check_and_set_many(dev_addr, fcnts) == 0
+        ):
+            log.debug(f"Dropped duplicated aggregate (Dev: {dev_addr}, fcnts: {fcnts})")
+            self.counters.add(DM_DROPPED_E2L_COUNTER)
+            return 0
+        if (
+            self.reference_aggregator is not None
+            and self.aggregation_function is not None
+            and len(fcnts) > 0
+        ):
+            self.reference_aggregator.check_aggregate(
+                dev_eui, fcnts, aggregated_data, self.aggregation_function
+            )
         self._push_log_to_db(
             module_id="DM",
             dev_addr=dev_addr,
@@ -1082,14 +1643,14 @@ class E2LoRaModule:
             fcnt=fcnts,
             timetag=timetag,
         )
-        self.statistics["dm"]["rx_e2l_frames"] = (
-            self.statistics["dm"].get("rx_e2l_frames", 0) + 1
-        )
-        if gw_id not in self.e2gw_ids:
+        counters = self.counters
+        counters.add(DM_RX_E2L_COUNTER)
+        if gw_index is None:
             return -1
-        self.statistics["gateways"][gw_id]["tx"] = (
-            self.statistics["gateways"][gw_id].get("tx", 0) + 1
-        )
+        counters.add(GW_TX_COUNTER, slot=gw_index)
+        dev_index = self.e2ed_ids.index(dev_eui)
+        if dev_index is not None:
+            counters.add(ED_EDGE_COUNTER, slot=dev_index)
 
         # for i in range(len(self.e2gw_ids)):
         #     if self.statistics["gateways"].get(self.e2gw_ids[i]) is None:
@@ -1099,18 +1660,17 @@ class E2LoRaModule:
         #         self.statistics["gateways"][self.e2gw_ids[i]]["tx"] = self.statistics["gateways"][self.e2gw_ids[i]].get("tx", 0) + 1
 
         # SEND LOG
-        if dev_eui in self.e2ed_ids and self.e2ed_ids.index(dev_eui) == 0:
-            self.statistics["aggregation_result"] = aggregated_data
+        if dev_index == 0:
+            self.aggregation_result = aggregated_data
         self._send_log(
             type=LOG_ED, message=f"E2L Frame Received by DM (Dev: {dev_addr})"
         )
 
         if gw_log_message is not None:
-            index = self.e2gw_ids.index(gw_id)
             log_type = None
-            if index == 0:
+            if gw_index == 0:
                 log_type = LOG_GW1
-            elif index == 1:
+            elif gw_index == 1:
                 log_type = LOG_GW2
             else:
                 log_type = None
@@ -1125,7 +1685,7 @@ class E2LoRaModule:
     """
 
     def start_dashboard_update_loop(self):
-        if self.collection is not None:
+        if self.storage is not None:
             self.db_update_loop = Thread(target=self._update_db)
             self.db_update_loop.start()
             return
@@ -1141,7 +1701,7 @@ class E2LoRaModule:
     """
 
     def start_resource_monitor_loop(self):
-        if self.collection is not None:
+        if self.storage is not None:
             self.resource_monitor_loop = Thread(target=self._monitor_resource)
             self.resource_monitor_loop.start()
         return
@@ -1154,10 +1714,17 @@ class E2LoRaModule:
     """
 
     def handle_gw_log(self, gw_id, dev_addr, log_message, frame_type, fcnt, timetag):
-        if gw_id not in self.e2gw_ids:
+        index = self._get_gateway_index(gw_id)
+        if index is None:
             return -1
+        # Legacy frame already forwarded by another E2GW
+        if (
+            frame_type == LEGACY_FRAME
+            and self.legacy_fcnts is not None
+            and self.legacy_fcnts.check_and_set(dev_addr, fcnt) != FCNT_NEW
+        ):
+            self.counters.add(NS_DROPPED_LEGACY_COUNTER)
         # SEND LOG
-        index = self.e2gw_ids.index(gw_id)
         log_type = None
         if index == 0:
             log_type = LOG_GW1
@@ -1165,17 +1732,13 @@ class E2LoRaModule:
             log_type = LOG_GW2
         else:
             log_type = None
-        if log_type is not None and self.collection is None:
+        if log_type is not None and self.storage is None:
             self._send_log(type=log_type, message=log_message)
 
         if log_type is None:
             return
 
-        # dev_eui = None
-        # for ed in self.ed_ids:
-        #     if self.statistics[ed]["dev_addr"] == dev_addr:
-        #         dev_eui = ed
-        #         break
+        # dev_obj = self.active_directory.get_device_by_addr(dev_addr)
 
         if frame_type == EDGE_FRAME:
             # self.statistics["gateways"][gw_id]["rx"] = (
@@ -1187,6 +1750,7 @@ class E2LoRaModule:
             #     )
             self._push_log_to_db(
                 module_id=gw_id,
+                gw_id=gw_id,
                 dev_addr=dev_addr,
                 log_message=log_message,
                 frame_type=frame_type,
@@ -1199,6 +1763,7 @@ class E2LoRaModule:
             # )
             self._push_log_to_db(
                 module_id=gw_id,
+                gw_id=gw_id,
                 dev_addr=dev_addr,
                 log_message=log_message,
                 frame_type=frame_type,
@@ -1218,6 +1783,7 @@ class E2LoRaModule:
             #     )
             self._push_log_to_db(
                 module_id=gw_id,
+                gw_id=gw_id,
                 dev_addr=dev_addr,
                 log_message=log_message,
                 frame_type=frame_type,
@@ -1226,17 +1792,6 @@ class E2LoRaModule:
             )
             # STATS FOR NS
             # self.statistics["ns"]["rx"] = self.statistics["ns"].get("rx", 0) + 1
-            # # Check duplicate and update legacy stats
-            # with self.legacy_not_duplicates_lock:
-            #     last_fcnt = self.legacy_not_duplicates.get(dev_addr, -1)
-            #     if fcnt > last_fcnt:
-            #         self.statistics["dm"]["rx_legacy_frames"] = (
-            #             self.statistics["dm"].get("rx_legacy_frames", 0) + 1
-            #         )
-            #         self.legacy_not_duplicates[dev_addr] = last_fcnt
-            #         self.statistics["ns"]["tx"] = self.statistics["ns"].get("tx", 0) + 1
-            #     else:
-            #         self.legacy_dropped = self.legacy_dropped + 1
         else:
             log.warning("Unknown frame type")
 
@@ -1251,6 +1806,33 @@ class E2LoRaModule:
 
         return 0
 
+    """
+        @brief  This function handles a batch of edge frames (new_data_batch/new_data_stream RPCs).
+        @param items: list of handle_edge_data arguments (dict).
+        @return The number of frames that failed.
+    """
+
+    def handle_edge_data_batch(self, items):
+        failed = 0
+        for item in items:
+            if self.handle_edge_data(**item) != 0:
+                failed += 1
+        return failed
+
+    """
+        @brief  This function handles a batch of gateway logs (gw_log_batch/gw_log_stream RPCs).
+        @param items: list of handle_gw_log arguments (dict).
+        @return The number of logs that failed.
+    """
+
+    def handle_gw_log_batch(self, items):
+        failed = 0
+        for item in items:
+            ret = self.handle_gw_log(**item)
+            if ret is not None and ret < 0:
+                failed += 1
+        return failed
+
     """
         @brief  This function handle the system log from the GWs.
         @param gw_id: The gateway id.
@@ -1272,7 +1854,6 @@ class E2LoRaModule:
         data_transmitted,
     ):
         gw_sys_stats = {
-            "_id": self._get_now_isostring(),
             "gw_id": gw_id,
             "memory_usage": memory_usage,
             "memory_available": memory_available,
@@ -1281,32 +1862,27 @@ class E2LoRaModule:
             "data_transmitted": data_transmitted,
             "type": SYS_DOC_TYPE,
         }
-        if self.collection is not None and gw_id in self.e2gw_ids:
+        if self.storage is not None and gw_id in self.e2gw_ids:
             log.debug("Pushing sys stats in DB")
-            self.collection.insert_one(gw_sys_stats)
-        default_window_size = os.getenv("DEFAULT_AGGR_WINDOWS_SIZE")
-        if default_window_size is None or not default_window_size.isnumeric():
-            default_window_size = 10
-        else:
-            default_window_size = int(default_window_size)
-        self._update_params(
-            None,
-            None,
-            None,
-            AVG_ID,
-            default_window_size,
-        )
+            self._insert_doc(gw_sys_stats)
+        # Heartbeat path: push only what the sender did not acknowledge yet
+        aggregation_params = (AVG_ID, self.config.default_aggr_window_size)
+        gw_info = self.e2gw_ids.get(gw_id)
+        if (self.aggregation_function, self.window_size) != aggregation_params or (
+            gw_info is not None and gw_info.aggregation_params != aggregation_params
+        ):
+            self._update_params(None, None, None, *aggregation_params)
         return 0
 
     """
         @brief  This function handle the gateway frames stats.
         @param gw_id: The gateway id.
         @param legacy_frames: The legacy frames counter.
-        @param legacy_fcnts: The legacy frame fcnts.
+        @param legacy_fcnts: The legacy frame fcnts (fcnt set docs, one per dev_addr).
         @param edge_frames: The edge frames counter.
-        @param edge_fcnts: The edge frame fcnts.
+        @param edge_fcnts: The edge frame fcnts (fcnt set docs).
         @param edge_not_processed_frames: The edge not processed frames counter.
-        @param edge_not_processed_fcnts: The edge not processed frame fcnts.
+        @param edge_not_processed_fcnts: The edge not processed frame fcnts (fcnt set docs).
         @return 0 is success, -1 if failure.
     """
 
@@ -1320,10 +1896,9 @@ class E2LoRaModule:
         edge_not_processed_frames,
         edge_not_processed_fcnts,
     ):
-        if self.collection is None:
+        if self.storage is None:
             return -1
         gw_frames_stats = {
-            "_id": self._get_now_isostring(),
             "gw_id": gw_id,
             "legacy_frames": legacy_frames,
             "legacy_fcnts": legacy_fcnts,
@@ -1334,28 +1909,26 @@ class E2LoRaModule:
             "type": GW_FRAMES_STATS_DOC_TYPE,
         }
         log.debug("Pushing frames stats in DB")
-        self.collection.insert_one(gw_frames_stats)
+        self._insert_doc(gw_frames_stats)
 
         # UPDATE SINK STATS
-        self.statistics["gateways"][gw_id]["rx"] = (
-            self.statistics["gateways"][gw_id].get("rx", 0)
-            + edge_frames
-            + edge_not_processed_frames
-            + legacy_frames
-        )
-
-        self.statistics["gateways"][gw_id]["tx"] = (
-            self.statistics["gateways"][gw_id].get("tx", 0) + legacy_frames
+        index = self.e2gw_ids.index(gw_id)
+        if index is None:
+            return -1
+        counters = self.counters
+        counters.add(
+            GW_RX_COUNTER,
+            edge_frames + edge_not_processed_frames + legacy_frames,
+            slot=index,
         )
+        counters.add(GW_TX_COUNTER, legacy_frames, slot=index)
 
         # CHECK IF GW TO SHUT
-        index = self.e2gw_ids.index(gw_id)
         if (
-            index is not None
-            and index == 1
+            index == 1
             and self.gw_shut_enabled
             and not self.gw_shut_done
-            and self.statistics["gateways"][gw_id]["rx"] >= self.gw_shut_packet_limit
+            and counters.get(GW_RX_COUNTER, slot=index) >= self.gw_shut_packet_limit
         ):
             shut_thread = Thread(target=self._shut_gw)
             shut_thread.start()
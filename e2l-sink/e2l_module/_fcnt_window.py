@@ -0,0 +1,101 @@
+from threading import Lock
+
+# FCNT CHECK RESULTS
+FCNT_NEW = 0
+FCNT_DUPLICATE = 1
+# Older than the window: it cannot be told apart from a replay
+FCNT_TOO_OLD = 2
+
+DEFAULT_FCNT_WINDOW = 1024
+
+
+class FcntDeduplicator:
+    """
+    Thread-safe per-device replay window of the frame counters. Each device
+    keeps the highest fcnt seen and a bitmap of the window_size fcnts below it
+    (bit i set if highest - i was seen), so a check is O(1) and a device costs
+    window_size bits whatever the number of frames.
+    """
+
+    def __init__(self, window_size=DEFAULT_FCNT_WINDOW):
+        if window_size <= 0:
+            raise Exception(f"Invalid fcnt window size: {window_size}")
+        self.window_size = window_size
+        self._mask = (1 << window_size) - 1
+        # key -> [highest fcnt, bitmap]
+        self._windows = {}
+        self._lock = Lock()
+        self.duplicates = 0
+        self.too_old = 0
+
+    def _check_and_set(self, key, fcnt):
+        window = self._windows.get(key)
+        if window is None:
+            self._windows[key] = [fcnt, 1]
+            return FCNT_NEW
+        highest, bits = window
+        if fcnt > highest:
+            shift = fcnt - highest
+            if shift >= self.window_size:
+                window[1] = 1
+            else:
+                window[1] = ((bits << shift) | 1) & self._mask
+            window[0] = fcnt
+            return FCNT_NEW
+        offset = highest - fcnt
+        if offset >= self.window_size:
+            self.too_old += 1
+            return FCNT_TOO_OLD
+        bit = 1 << offset
+        if bits & bit:
+            self.duplicates += 1
+            return FCNT_DUPLICATE
+        window[1] = bits | bit
+        return FCNT_NEW
+
+    """
+        @brief  This function checks a fcnt against the device window and marks it as seen.
+        @param key: The device (Dev Addr).
+        @param fcnt: The frame counter.
+        @return FCNT_NEW, FCNT_DUPLICATE or FCNT_TOO_OLD.
+    """
+
+    def check_and_set(self, key, fcnt):
+        with self._lock:
+            return self._check_and_set(key, fcnt)
+
+    """
+        @brief  This function checks the fcnts of an aggregate and marks them as seen.
+        @param key: The device (Dev Addr).
+        @param fcnts: The frame counters.
+        @return The number of fcnts not seen before.
+    """
+
+    def check_and_set_many(self, key, fcnts):
+        new = 0
+        with self._lock:
+            for fcnt in fcnts:
+                if self._check_and_set(key, fcnt) == FCNT_NEW:
+                    new += 1
+        return new
+
+    """
+        @brief  This function forgets a device window (new session, the fcnts restart).
+        @param key: The device (Dev Addr).
+        @return None.
+    """
+
+    def reset(self, key):
+        with self._lock:
+            self._windows.pop(key, None)
+
+    def __len__(self):
+        return len(self._windows)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "devices": len(self._windows),
+                "duplicates": self.duplicates,
+                "too_old": self.too_old,
+            }
@@ -0,0 +1,266 @@
+import time
+import random
+import logging
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, wait
+import grpc
+from e2gw_rpc_client import edge2gateway_pb2_grpc
+from metrics_module import LatencyHistogram
+
+log = logging.getLogger(__name__)
+
+# DEFAULTS
+DEFAULT_RPC_TIMEOUT_SEC = 5
+DEFAULT_RPC_RETRIES = 2
+DEFAULT_KEEPALIVE_MS = 30000
+DEFAULT_KEEPALIVE_TIMEOUT_MS = 10000
+# Jittered exponential backoff between two attempts
+DEFAULT_BACKOFF_BASE_SEC = 0.1
+DEFAULT_BACKOFF_MAX_SEC = 2
+# Concurrent calls of a fan-out
+DEFAULT_FAN_OUT_WORKERS = 16
+# Time given to the calls of a fan-out to report their outcome after the
+# deadline (their last attempt is cancelled by gRPC at the deadline)
+FAN_OUT_GRACE_SEC = 0.5
+
+# E2GW RPCs safe to replay: they set a state or return the same answer.
+# remove_e2device is not, it hands over (and resets) the aggregated data.
+IDEMPOTENT_METHODS = frozenset(
+    (
+        "update_aggregation_params",
+        "add_devices",
+        "handle_ed_pub_info",
+        "set_active",
+    )
+)
+GATEWAY_METHODS = (
+    "update_aggregation_params",
+    "add_devices",
+    "remove_e2device",
+    "handle_ed_pub_info",
+    "set_active",
+)
+
+# Status codes worth a retry
+RETRYABLE_STATUS_CODES = frozenset(
+    (
+        grpc.StatusCode.UNAVAILABLE,
+        grpc.StatusCode.DEADLINE_EXCEEDED,
+        grpc.StatusCode.RESOURCE_EXHAUSTED,
+    )
+)
+
+
+class GatewayClient:
+    """
+    Edge2Gateway stub of an E2GW, with deadline, retries and latency stats.
+    It exposes the same methods as Edge2GatewayStub (request -> response).
+    """
+
+    def __init__(self, gw_id, endpoint, channel, manager):
+        self.gw_id = gw_id
+        self.endpoint = endpoint
+        self.channel = channel
+        self._stub = edge2gateway_pb2_grpc.Edge2GatewayStub(channel)
+        self._manager = manager
+        self.latency = {method: LatencyHistogram() for method in GATEWAY_METHODS}
+        # Updated by the fan-out workers and the gRPC handler threads
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+        self._counters_lock = Lock()
+
+    def update_aggregation_params(self, request, timeout=None, deadline=None):
+        return self._call("update_aggregation_params", request, timeout, deadline)
+
+    def add_devices(self, request, timeout=None, deadline=None):
+        return self._call("add_devices", request, timeout, deadline)
+
+    def remove_e2device(self, request, timeout=None, deadline=None):
+        return self._call("remove_e2device", request, timeout, deadline)
+
+    def handle_ed_pub_info(self, request, timeout=None, deadline=None):
+        return self._call("handle_ed_pub_info", request, timeout, deadline)
+
+    def set_active(self, request, timeout=None, deadline=None):
+        return self._call("set_active", request, timeout, deadline)
+
+    """
+        @brief  This function calls a gateway method, retrying the idempotent ones.
+        @param method: The Edge2Gateway method name.
+        @param request: The request.
+        @param timeout: Seconds per attempt (None: the manager timeout).
+        @param deadline: time.monotonic() after which no attempt is made or
+                         still running (None: no overall deadline).
+        @return The response.
+    """
+
+    def _call(self, method, request, timeout, deadline=None):
+        manager = self._manager
+        if timeout is None:
+            timeout = manager.timeout
+        attempts = 1 + (manager.retries if method in IDEMPOTENT_METHODS else 0)
+        rpc = getattr(self._stub, method)
+        histogram = self.latency[method]
+        for attempt in range(attempts):
+            attempt_timeout = timeout
+            if deadline is not None:
+                attempt_timeout = min(timeout, max(0, deadline - time.monotonic()))
+            start = time.perf_counter()
+            try:
+                response = rpc(request, timeout=attempt_timeout)
+                histogram.observe((time.perf_counter() - start) * 1000)
+                with self._counters_lock:
+                    self.calls += 1
+                return response
+            except grpc.RpcError as e:
+                histogram.observe((time.perf_counter() - start) * 1000)
+                delay = random.uniform(
+                    0, min(manager.backoff_max, manager.backoff_base * 2**attempt)
+                )
+                if (
+                    attempt + 1 >= attempts
+                    or e.code() not in RETRYABLE_STATUS_CODES
+                    or (deadline is not None and time.monotonic() + delay >= deadline)
+                ):
+                    with self._counters_lock:
+                        self.errors += 1
+                    raise
+                with self._counters_lock:
+                    self.retries += 1
+                log.warning(
+                    f"{method} to {self.gw_id} failed ({e.code()}), retry in {delay:.2f} s"
+                )
+                time.sleep(delay)
+
+    def get_stats(self):
+        with self._counters_lock:
+            calls, retries, errors = self.calls, self.retries, self.errors
+        return {
+            "endpoint": self.endpoint,
+            "calls": calls,
+            "retries": retries,
+            "errors": errors,
+            "latency": {
+                method: histogram.snapshot()
+                for method, histogram in self.latency.items()
+                if histogram.snapshot()["count"] > 0
+            },
+        }
+
+
+class GatewayChannelManager:
+    """
+    This class owns the gRPC channels to the E2GWs: one channel per endpoint,
+    kept open (with keepalive) across the gateway re-announces.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        self.timeout = kwargs.get("timeout", DEFAULT_RPC_TIMEOUT_SEC)
+        self.retries = kwargs.get("retries", DEFAULT_RPC_RETRIES)
+        self.backoff_base = kwargs.get("backoff_base", DEFAULT_BACKOFF_BASE_SEC)
+        self.backoff_max = kwargs.get("backoff_max", DEFAULT_BACKOFF_MAX_SEC)
+        keepalive_ms = kwargs.get("keepalive_ms", DEFAULT_KEEPALIVE_MS)
+        self.channel_options = [
+            ("grpc.keepalive_time_ms", keepalive_ms),
+            ("grpc.keepalive_timeout_ms", DEFAULT_KEEPALIVE_TIMEOUT_MS),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+        ]
+        self._clients = {}
+        self._lock = Lock()
+        self._fan_out_executor = ThreadPoolExecutor(
+            max_workers=kwargs.get("fan_out_workers", DEFAULT_FAN_OUT_WORKERS),
+            thread_name_prefix="e2gw-fan-out",
+        )
+
+    """
+        @brief  This function returns the client of a gateway, opening a channel
+                only if the gateway is new or its endpoint changed.
+        @param gw_id: The gateway id.
+        @param endpoint: The gateway RPC endpoint (address:port).
+        @return GatewayClient
+    """
+
+    def get_client(self, gw_id, endpoint):
+        with self._lock:
+            client = self._clients.get(gw_id)
+            if client is not None and client.endpoint == endpoint:
+                return client
+            if client is not None:
+                log.info(f"E2GW {gw_id} moved to {endpoint}, reopening channel")
+                client.channel.close()
+            channel = grpc.insecure_channel(endpoint, options=self.channel_options)
+            client = GatewayClient(gw_id, endpoint, channel, self)
+            self._clients[gw_id] = client
+            return client
+
+    """
+        @brief  This function issues the same RPC to several gateways concurrently.
+        @param method: The Edge2Gateway method name.
+        @param requests: list of (GatewayClient, request).
+        @param deadline: Seconds for all the answers, retries included: no
+                         attempt runs past it.
+        @return dict gw_id -> {"success", "latency_ms", "response", "error"}.
+    """
+
+    def fan_out(self, method, requests, deadline=None):
+        if deadline is None:
+            deadline = self.timeout
+        end = time.monotonic() + deadline
+        futures = {
+            self._fan_out_executor.submit(
+                self._timed_call, client, method, request, deadline, end
+            ): client.gw_id
+            for client, request in requests
+        }
+        _done, not_done = wait(futures, timeout=deadline + FAN_OUT_GRACE_SEC)
+        report = {}
+        for future, gw_id in futures.items():
+            if future in not_done:
+                report[gw_id] = {
+                    "success": False,
+                    "latency_ms": deadline * 1000,
+                    "response": None,
+                    "error": "deadline exceeded",
+                }
+            else:
+                report[gw_id] = future.result()
+        return report
+
+    @staticmethod
+    def _timed_call(client, method, request, timeout, deadline):
+        start = time.perf_counter()
+        try:
+            response = getattr(client, method)(
+                request, timeout=timeout, deadline=deadline
+            )
+            error = None
+        except grpc.RpcError as e:
+            response = None
+            error = str(e.code())
+        return {
+            "success": error is None,
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "response": response,
+            "error": error,
+        }
+
+    """
+        @brief  This function returns the RPC stats of each gateway.
+        @return dict gw_id -> calls, retries, errors and latency per method.
+    """
+
+    def get_stats(self):
+        return {client.gw_id: client.get_stats() for client in self.get_clients()}
+
+    def get_clients(self):
+        with self._lock:
+            return list(self._clients.values())
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.channel.close()
+            self._clients.clear()
+        self._fan_out_executor.shutdown(wait=False)
@@ -0,0 +1,193 @@
+import time
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Thread, Condition, Lock
+from ._crypto import derive_shared_point_sec1, derive_edge_session_keys
+
+log = logging.getLogger(__name__)
+
+# KEY AGREEMENT OPERATIONS
+SHARED_POINT_OP = 1
+EDGE_SESSION_KEYS_OP = 2
+
+# DEFAULTS
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_BATCH_WINDOW_SEC = 0.002
+
+# Private scalar of the DM, set in each pool process by _init_worker
+_worker_private_d = None
+
+
+def _init_worker(private_d):
+    global _worker_private_d
+    _worker_private_d = private_d
+
+
+def _run_operation(private_d, operation, argument):
+    if operation == SHARED_POINT_OP:
+        return derive_shared_point_sec1(argument, private_d)
+    return derive_edge_session_keys(argument, private_d)
+
+
+def _run_requests(private_d, batch):
+    results = []
+    for operation, argument in batch:
+        try:
+            results.append((True, _run_operation(private_d, operation, argument)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+def _run_batch(batch):
+    return _run_requests(_worker_private_d, batch)
+
+
+class KeyAgreementService:
+    """
+    This class runs the ECDH point multiplications and the edge session key
+    derivation of the DM. Pending requests are batched and fanned out to a
+    process pool; results are delivered in submission order.
+    With workers=0 the operations run inline on the calling thread. If the pool
+    breaks (a worker process died), the batches in flight fail and the next
+    ones run inline on the collector thread.
+    """
+
+    def __init__(self, private_d, **kwargs) -> None:
+        self.private_d = int(private_d)
+        self.workers = kwargs.get("workers", 0)
+        self.batch_size = max(1, kwargs.get("batch_size", DEFAULT_BATCH_SIZE))
+        self.batch_window = kwargs.get("batch_window", DEFAULT_BATCH_WINDOW_SEC)
+        self._pool = None
+        if self.workers <= 0:
+            return
+        # spawn: the parent holds gRPC/MQTT threads which do not survive a fork
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.private_d,),
+        )
+        self._pending = deque()
+        self._cond = Condition()
+        # Dispatched batches, resolved from the head to keep the order
+        self._in_flight = deque()
+        self._in_flight_lock = Lock()
+        self._stopped = False
+        self._pool_broken = False
+        self.batches = 0
+        self.inline_batches = 0
+        self._collector = Thread(target=self._collect_loop, daemon=True)
+        self._collector.start()
+
+    """
+        @brief  This function computes the ECDH shared point with the DM private key.
+        @param pub_key_sec1: The peer public key (SEC1).
+        @return Future of the shared point (SEC1).
+    """
+
+    def derive_shared_point(self, pub_key_sec1):
+        return self._submit(SHARED_POINT_OP, pub_key_sec1)
+
+    """
+        @brief  This function derives the edge session keys from g_gw_ed.
+        @param g_gw_ed_sec1: The g_gw_ed point received from the E2GW (SEC1).
+        @return Future of (edgeSIntKey, edgeSEncKey).
+    """
+
+    def derive_edge_session_keys(self, g_gw_ed_sec1):
+        return self._submit(EDGE_SESSION_KEYS_OP, g_gw_ed_sec1)
+
+    """
+        @brief  This function stops the collector and the process pool.
+        @return None.
+    """
+
+    def close(self):
+        if self._pool is None:
+            return
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._collector.join()
+        self._pool.shutdown(wait=True)
+
+    def _submit(self, operation, argument):
+        future = Future()
+        if self._pool is None:
+            try:
+                future.set_result(_run_operation(self.private_d, operation, argument))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        with self._cond:
+            if self._stopped:
+                raise Exception("Key agreement service is closed")
+            self._pending.append((operation, argument, future))
+            self._cond.notify_all()
+        return future
+
+    def _next_batch(self):
+        with self._cond:
+            while len(self._pending) == 0 and not self._stopped:
+                self._cond.wait()
+            # Wait a little for more requests to join the batch
+            deadline = time.monotonic() + self.batch_window
+            while len(self._pending) < self.batch_size and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch_len = min(self.batch_size, len(self._pending))
+            return [self._pending.popleft() for _ in range(batch_len)]
+
+    def _collect_loop(self):
+        while True:
+            batch = self._next_batch()
+            if len(batch) == 0:
+                return
+            futures = [future for _operation, _argument, future in batch]
+            entry = [futures, None]
+            with self._in_flight_lock:
+                self._in_flight.append(entry)
+            self.batches += 1
+            requests = [(operation, argument) for operation, argument, _future in batch]
+            pool_future = None
+            if not self._pool_broken:
+                try:
+                    pool_future = self._pool.submit(_run_batch, requests)
+                except RuntimeError:
+                    # BrokenProcessPool (a worker died) or the pool is shut down
+                    log.exception(
+                        "Key agreement pool broken, running the batches inline"
+                    )
+                    self._pool_broken = True
+            if pool_future is None:
+                self.inline_batches += 1
+                pool_future = Future()
+                pool_future.set_result(_run_requests(self.private_d, requests))
+            pool_future.add_done_callback(
+                lambda pool_future, entry=entry: self._on_batch_done(entry, pool_future)
+            )
+
+    def _on_batch_done(self, entry, pool_future):
+        with self._in_flight_lock:
+            entry[1] = pool_future
+            while len(self._in_flight) > 0 and self._in_flight[0][1] is not None:
+                futures, done_future = self._in_flight.popleft()
+                self._resolve(futures, done_future)
+
+    def _resolve(self, futures, done_future):
+        try:
+            results = done_future.result()
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, (success, value) in zip(futures, results):
+            if success:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
@@ -0,0 +1,191 @@
+import json
+import logging
+from typing import NamedTuple, Optional
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+log = logging.getLogger(__name__)
+
+# DEVICE LIST PARSERS
+AUTO_PARSER = "auto"
+JSON_PARSER = "json"
+IJSON_PARSER = "ijson"
+PARSERS = (AUTO_PARSER, JSON_PARSER, IJSON_PARSER)
+
+# Bytes read at once from the export
+READ_CHUNK_SIZE = 64 * 1024
+# A record larger than this is a malformed export, not a device
+MAX_RECORD_SIZE = 1024 * 1024
+
+# LoRaWAN identifiers and AES-128 session keys (hex encoded in the export)
+DEV_EUI_HEX_LENGTH = 16
+DEV_ADDR_HEX_LENGTH = 8
+SESSION_KEY_HEX_LENGTH = 32
+
+_JSON_WHITESPACE = " \t\n\r"
+# Characters that may follow an array item
+_DELIMITERS = _JSON_WHITESPACE + ",]"
+# Array parser states
+_ARRAY_START = 0
+_ITEM_OR_END = 1
+_ITEM = 2
+_SEPARATOR = 3
+
+
+class ProvisionedDevice(NamedTuple):
+    """
+    Device of a TTS bulk export, validated, with the session keys as bytes.
+    """
+
+    dev_id: Optional[str]
+    dev_eui: str
+    dev_addr: Optional[str]
+    edge_s_int_key: bytes
+    edge_s_enc_key: bytes
+
+
+"""
+    @brief  This function returns the parser actually used for a requested one.
+    @param parser: The requested parser (auto, json, ijson).
+    @return The parser name.
+"""
+
+
+def resolve_parser(parser):
+    if parser not in PARSERS:
+        raise Exception(f"Unknown device list parser: {parser}")
+    if parser == AUTO_PARSER:
+        return IJSON_PARSER if ijson is not None else JSON_PARSER
+    if parser == IJSON_PARSER and ijson is None:
+        raise Exception("ijson device list parser requested but ijson is not installed")
+    return parser
+
+
+def _skip_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos] in _JSON_WHITESPACE:
+        pos += 1
+    return pos
+
+
+"""
+    @brief  This function iterates over the items of a top-level JSON array,
+            decoding one item at a time (raw_decode over a sliding buffer).
+    @param f: The file, opened in text mode.
+    @return Generator of items.
+"""
+
+
+def iter_json_array(f):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    expected = _ARRAY_START
+    while True:
+        pos = _skip_whitespace(buffer, pos)
+        if pos < len(buffer):
+            char = buffer[pos]
+            if expected == _ARRAY_START:
+                if char != "[":
+                    raise Exception("The device list is not a JSON array")
+                expected = _ITEM_OR_END
+                pos += 1
+                continue
+            if expected == _SEPARATOR:
+                if char == "]":
+                    return
+                if char != ",":
+                    raise Exception(
+                        f"Expecting ',' or ']' at {char!r} in the device list"
+                    )
+                expected = _ITEM
+                pos += 1
+                continue
+            if char == "]" and expected == _ITEM_OR_END:
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number or a literal may go on in the next chunk
+                if eof or (end < len(buffer) and buffer[end] in _DELIMITERS):
+                    yield item
+                    pos = end
+                    expected = _SEPARATOR
+                    continue
+            if len(buffer) - pos > MAX_RECORD_SIZE:
+                raise Exception("Device record too large, malformed device list")
+        elif eof:
+            raise Exception("Unexpected end of the device list")
+        # Incomplete item: drop the consumed text and read on
+        chunk = f.read(READ_CHUNK_SIZE)
+        eof = len(chunk) == 0
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+"""
+    @brief  This function iterates over the devices of a TTS bulk export, with
+            memory bounded by the size of a device record.
+    @param path: The export (JSON array of end devices).
+    @param parser: The parser (auto: ijson if installed, json otherwise).
+    @return Generator of device records (dict).
+"""
+
+
+def iter_device_export(path, parser=AUTO_PARSER):
+    parser = resolve_parser(parser)
+    if parser == IJSON_PARSER:
+        with open(path, "rb") as f:
+            yield from ijson.items(f, "item")
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        yield from iter_json_array(f)
+
+
+def _get_hex(value, name, length):
+    if not isinstance(value, str) or len(value) != length:
+        raise Exception(f"Invalid {name}: {value!r}")
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        raise Exception(f"Invalid {name}: {value!r}")
+
+
+"""
+    @brief  This function validates a device record of a TTS bulk export.
+    @param record: The device record.
+    @return ProvisionedDevice
+    @note   It raises an Exception if the record is invalid.
+"""
+
+
+def parse_device(record):
+    ids = record.get("ids") or {}
+    session = record.get("session") or {}
+    keys = session.get("keys") or {}
+    dev_eui = ids.get("dev_eui")
+    _get_hex(dev_eui, "dev_eui", DEV_EUI_HEX_LENGTH)
+    dev_addr = session.get("dev_addr")
+    if dev_addr is not None:
+        _get_hex(dev_addr, "dev_addr", DEV_ADDR_HEX_LENGTH)
+    return ProvisionedDevice(
+        dev_id=ids.get("device_id", ids.get("dev_id")),
+        dev_eui=dev_eui,
+        dev_addr=dev_addr,
+        edge_s_int_key=_get_hex(
+            (keys.get("f_nwk_s_int_key") or {}).get("key"),
+            "f_nwk_s_int_key",
+            SESSION_KEY_HEX_LENGTH,
+        ),
+        edge_s_enc_key=_get_hex(
+            (keys.get("app_s_key") or {}).get("key"),
+            "app_s_key",
+            SESSION_KEY_HEX_LENGTH,
+        ),
+    )
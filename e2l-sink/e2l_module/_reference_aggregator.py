@@ -0,0 +1,220 @@
+import logging
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+# AGGREGATION FUNCTION TYPE
+AVG_ID = 1
+SUM_ID = 2
+MIN_ID = 3
+MAX_ID = 4
+
+# COMPARISON OUTCOMES
+REFERENCE_MATCHED = "matched"
+REFERENCE_MISMATCHED = "mismatched"
+# Legacy frames of the aggregate missing (lost, not numeric or evicted)
+REFERENCE_INCOMPLETE = "incomplete"
+REFERENCE_OUTCOMES = (REFERENCE_MATCHED, REFERENCE_MISMATCHED, REFERENCE_INCOMPLETE)
+
+# DEFAULTS
+# Legacy values kept per device, in aggregation windows
+DEFAULT_REFERENCE_WINDOWS = 4
+# Aggregates waiting for their legacy frames, per device
+MAX_PENDING_AGGREGATES = 8
+# The E2GWs may round or truncate the mean
+AVG_TOLERANCE = 1
+
+
+"""
+    @brief  This function applies an aggregation function to a list of values.
+    @param function: The aggregation function (AVG_ID, SUM_ID, MIN_ID, MAX_ID).
+    @param values: The values (not empty).
+    @return The aggregated value.
+"""
+
+
+def reduce_values(function, values):
+    if function == AVG_ID:
+        return sum(values) / len(values)
+    if function == SUM_ID:
+        return sum(values)
+    if function == MIN_ID:
+        return min(values)
+    if function == MAX_ID:
+        return max(values)
+    raise Exception(f"Unknown aggregation function: {function}")
+
+
+def _matches(function, reference, aggregated_data):
+    if function == AVG_ID:
+        return abs(reference - aggregated_data) <= AVG_TOLERANCE
+    return reference == aggregated_data
+
+
+class _PendingAggregate:
+    """
+    Aggregate received before some of its legacy frames: running count, sum,
+    min and max of the values received so far, updated in O(1) per frame.
+    """
+
+    __slots__ = (
+        "function",
+        "fcnts",
+        "aggregated_data",
+        "missing",
+        "count",
+        "total",
+        "minimum",
+        "maximum",
+    )
+
+    def __init__(self, function, fcnts, aggregated_data, values, missing):
+        self.function = function
+        self.fcnts = fcnts
+        self.aggregated_data = aggregated_data
+        self.missing = missing
+        self.count = len(values)
+        self.total = sum(values)
+        self.minimum = min(values, default=None)
+        self.maximum = max(values, default=None)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def reference(self):
+        if self.function == AVG_ID:
+            return self.total / self.count
+        if self.function == SUM_ID:
+            return self.total
+        if self.function == MIN_ID:
+            return self.minimum
+        return self.maximum
+
+
+class ReferenceAggregator:
+    """
+    Thread-safe sink-side reference of the E2GW aggregation: it keeps the last
+    numeric legacy payloads of each device (fcnt -> value) and recomputes every
+    edge aggregate over the fcnts it lists. An aggregate arriving before its
+    legacy frames waits, updated incrementally as they arrive.
+    """
+
+    def __init__(self, windows=DEFAULT_REFERENCE_WINDOWS):
+        if windows <= 0:
+            raise Exception(f"Invalid reference windows: {windows}")
+        self.windows = windows
+        # dev_eui -> {fcnt: value}, in arrival order
+        self._values = {}
+        # dev_eui -> [_PendingAggregate]
+        self._pending = {}
+        self._lock = Lock()
+        self.outcomes = dict.fromkeys(REFERENCE_OUTCOMES, 0)
+        self.last_error = 0
+
+    def _record(self, dev_eui, function, reference, aggregated_data, fcnts):
+        if _matches(function, reference, aggregated_data):
+            self.outcomes[REFERENCE_MATCHED] += 1
+            return REFERENCE_MATCHED
+        self.outcomes[REFERENCE_MISMATCHED] += 1
+        self.last_error = aggregated_data - reference
+        log.debug(
+            f"Aggregate mismatch (Dev: {dev_eui}, fcnts: {fcnts}): "
+            f"edge {aggregated_data}, reference {reference}"
+        )
+        return REFERENCE_MISMATCHED
+
+    """
+        @brief  This function adds a legacy payload, completing the aggregates waiting for it.
+        @param dev_eui: The Dev EUI.
+        @param fcnt: The frame counter.
+        @param value: The numeric payload.
+        @param window_size: The current aggregation window size.
+        @return None.
+    """
+
+    def add_value(self, dev_eui, fcnt, value, window_size):
+        capacity = self.windows * max(window_size, 1)
+        with self._lock:
+            values = self._values.get(dev_eui)
+            if values is None:
+                values = self._values[dev_eui] = {}
+            values[fcnt] = value
+            while len(values) > capacity:
+                del values[next(iter(values))]
+            pending = self._pending.get(dev_eui)
+            if not pending:
+                return
+            for aggregate in list(pending):
+                if fcnt not in aggregate.missing:
+                    continue
+                aggregate.missing.discard(fcnt)
+                aggregate.add(value)
+                if len(aggregate.missing) == 0:
+                    pending.remove(aggregate)
+                    self._record(
+                        dev_eui,
+                        aggregate.function,
+                        aggregate.reference(),
+                        aggregate.aggregated_data,
+                        aggregate.fcnts,
+                    )
+
+    """
+        @brief  This function compares an edge aggregate with the legacy payloads of its fcnts.
+        @param dev_eui: The Dev EUI.
+        @param fcnts: The fcnts of the aggregated frames.
+        @param aggregated_data: The aggregate computed by the E2GW.
+        @param function: The aggregation function.
+        @return The outcome, None if the aggregate waits for legacy frames.
+    """
+
+    def check_aggregate(self, dev_eui, fcnts, aggregated_data, function):
+        with self._lock:
+            values = self._values.get(dev_eui, {})
+            present = [values[fcnt] for fcnt in fcnts if fcnt in values]
+            if len(present) == len(fcnts):
+                return self._record(
+                    dev_eui,
+                    function,
+                    reduce_values(function, present),
+                    aggregated_data,
+                    fcnts,
+                )
+            missing = set(fcnts).difference(values)
+            pending = self._pending.get(dev_eui)
+            if pending is None:
+                pending = self._pending[dev_eui] = []
+            pending.append(
+                _PendingAggregate(function, fcnts, aggregated_data, present, missing)
+            )
+            if len(pending) > MAX_PENDING_AGGREGATES:
+                pending.pop(0)
+                self.outcomes[REFERENCE_INCOMPLETE] += 1
+            return None
+
+    """
+        @brief  This function forgets a device (new session, the fcnts restart).
+        @param dev_eui: The Dev EUI.
+        @return None.
+    """
+
+    def reset(self, dev_eui):
+        with self._lock:
+            self._values.pop(dev_eui, None)
+            pending = self._pending.pop(dev_eui, None)
+            if pending:
+                self.outcomes[REFERENCE_INCOMPLETE] += len(pending)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "devices": len(self._values),
+                "pending": sum(len(pending) for pending in self._pending.values()),
+                "outcomes": dict(self.outcomes),
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,188 @@
+from threading import Lock
+
+
+class GatewayRecord:
+    """
+    Active directory entry of an E2GW.
+    @note the frame counters are kept in the E2LoRaModule ShardedCounters,
+          in the slot of the gateway position.
+    """
+
+    __slots__ = (
+        "gw_rpc_endpoint_address",
+        "gw_rpc_endpoint_port",
+        "gw_pub_key",
+        "g_as_gw",
+        "g_as_gw_base64",
+        "e2gw_stub",
+        "aggregation_params",
+    )
+
+    def __init__(self, gw_rpc_endpoint_address):
+        self.gw_rpc_endpoint_address = gw_rpc_endpoint_address
+        self.gw_rpc_endpoint_port = None
+        self.gw_pub_key = None
+        self.g_as_gw = None
+        self.g_as_gw_base64 = None
+        self.e2gw_stub = None
+        # Last (aggregation_function, window_size) acknowledged by the E2GW
+        self.aggregation_params = None
+
+
+class DeviceRecord:
+    """
+    Active directory entry of an ED.
+    @note in_directory is False for the devices only known by the OTAA join,
+          i.e. without edge session keys.
+    """
+
+    __slots__ = (
+        "dev_id",
+        "dev_eui",
+        "dev_addr",
+        "e2gw",
+        "edgeSIntKey",
+        "edgeSEncKey",
+        "in_directory",
+    )
+
+    def __init__(self, dev_eui):
+        self.dev_id = None
+        self.dev_eui = dev_eui
+        self.dev_addr = None
+        self.e2gw = None
+        self.edgeSIntKey = None
+        self.edgeSEncKey = None
+        self.in_directory = False
+
+
+class OrderedIndex:
+    """
+    Insertion-ordered ids with O(1) id -> position and id -> record lookups.
+    It can be used as the list of ids it replaces (len, [position], in, index).
+    """
+
+    def __init__(self):
+        self._ids = []
+        self._positions = {}
+        self._records = {}
+
+    """
+        @brief  This function adds an id, if not present yet.
+        @param key: The id.
+        @param record: The record bound to the id.
+        @return The record bound to the id and its position.
+    """
+
+    def add(self, key, record):
+        position = self._positions.get(key)
+        if position is not None:
+            return self._records[key], position
+        position = len(self._ids)
+        self._records[key] = record
+        self._positions[key] = position
+        self._ids.append(key)
+        return record, position
+
+    """
+        @brief  This function returns the position of an id.
+        @param key: The id.
+        @return The position, None if the id is unknown.
+    """
+
+    def index(self, key):
+        return self._positions.get(key)
+
+    """
+        @brief  This function returns the record bound to an id.
+        @param key: The id.
+        @param default: The value returned if the id is unknown.
+        @return The record.
+    """
+
+    def get(self, key, default=None):
+        return self._records.get(key, default)
+
+    def records(self):
+        return [self._records[key] for key in self._ids]
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __getitem__(self, position):
+        return self._ids[position]
+
+
+class E2LRegistry:
+    """
+    This class holds the E2GWs and EDs known by the DM.
+    """
+
+    def __init__(self):
+        self.gateways = OrderedIndex()
+        self.devices = OrderedIndex()
+        self._dev_addr_to_dev_eui = {}
+        self._lock = Lock()
+
+    """
+        @brief  This function returns the gateway record, creating it if needed.
+        @param gw_id: The gateway id (RPC endpoint address).
+        @return The record and the gateway position.
+    """
+
+    def add_gateway(self, gw_id):
+        record = self.gateways.get(gw_id)
+        if record is not None:
+            return record, self.gateways.index(gw_id)
+        with self._lock:
+            return self.gateways.add(gw_id, GatewayRecord(gw_id))
+
+    """
+        @brief  This function returns the device record, creating it if needed.
+        @param dev_eui: The Dev EUI.
+        @param dev_addr: The Dev Addr, if known.
+        @return The record and the device position.
+    """
+
+    def add_device(self, dev_eui, dev_addr=None):
+        record = self.devices.get(dev_eui)
+        if record is None:
+            with self._lock:
+                record, _position = self.devices.add(dev_eui, DeviceRecord(dev_eui))
+        if dev_addr is not None and dev_addr != record.dev_addr:
+            self.set_dev_addr(record, dev_addr)
+        return record, self.devices.index(dev_eui)
+
+    """
+        @brief  This function updates the address of a device.
+        @param record: The device record.
+        @param dev_addr: The new Dev Addr.
+        @return None.
+    """
+
+    def set_dev_addr(self, record, dev_addr):
+        with self._lock:
+            if record.dev_addr is not None:
+                if self._dev_addr_to_dev_eui.get(record.dev_addr) == record.dev_eui:
+                    del self._dev_addr_to_dev_eui[record.dev_addr]
+            record.dev_addr = dev_addr
+            if dev_addr is not None:
+                self._dev_addr_to_dev_eui[dev_addr] = record.dev_eui
+
+    """
+        @brief  This function returns the device bound to a Dev Addr.
+        @param dev_addr: The Dev Addr.
+        @return The device record, None if unknown.
+    """
+
+    def get_device_by_addr(self, dev_addr):
+        dev_eui = self._dev_addr_to_dev_eui.get(dev_addr)
+        if dev_eui is None:
+            return None
+        return self.devices.get(dev_eui)
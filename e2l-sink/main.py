@@ -1,17 +1,30 @@
 import os, sys
+import time
+import signal
+import asyncio
 import logging
 from dateutil.parser import isoparse
 from concurrent import futures
 
 import grpc
 from rpc_module import edge2applicationserver_pb2_grpc
-from rpc_module import Edge2LoRaApplicationServer
+from rpc_module import Edge2LoRaApplicationServer, AsyncEdge2LoRaApplicationServer
 
-from mqtt_module import MQTTModule
-import json
+from mqtt_module import MQTTModule, AsyncMQTTModule
+from dispatcher_module import FrameDispatcher, AsyncFrameDispatcher
+from decoder_module import PayloadDecoder, JoinMessage
+from metrics_module import MetricsExporter, collect_process_metrics
+from cluster_module import Cluster, parse_cluster_nodes, open_state_store
 
+from config_module import (
+    get_config,
+    reload_config,
+    add_reload_listener,
+    install_sighup_handler,
+)
 from e2l_module import (
     E2LoRaModule,
+    AsyncE2LoRaModule,
     DEFAULT_APP_PORT,
     DEFAULT_E2L_APP_PORT,
     DEFAULT_E2L_JOIN_PORT,
@@ -29,6 +42,33 @@ else:
 
 log = logging.getLogger(__name__)
 
+# FRAME TYPES (DISPATCHER STATS)
+OTAA_JOIN_FRAME_TYPE = "otaa_join"
+LEGACY_FRAME_TYPE = "legacy"
+EDGE_JOIN_FRAME_TYPE = "edge_join"
+EDGE_FRAME_TYPE = "edge"
+UNKNOWN_FRAME_TYPE = "unknown"
+# Frame of a device owned by another cluster worker
+NOT_OWNED_FRAME_TYPE = "not_owned"
+
+# E2L MODULE HANDLER PER FRAME TYPE
+FRAME_HANDLERS = {
+    OTAA_JOIN_FRAME_TYPE: "handle_otaa_join_request",
+    LEGACY_FRAME_TYPE: "handle_legacy_data",
+    EDGE_JOIN_FRAME_TYPE: "handle_edge_join_request",
+    EDGE_FRAME_TYPE: "handle_edge_data_from_legacy",
+}
+
+# PAYLOAD DECODER (uplinks on other ports are dropped before parsing)
+PAYLOAD_DECODER = PayloadDecoder(
+    backend=get_config().payload_decoder,
+    ports=(DEFAULT_APP_PORT, DEFAULT_E2L_JOIN_PORT, DEFAULT_E2L_APP_PORT),
+)
+
+# RUNTIME MODES
+THREADED_RUNTIME = "threaded"
+ASYNCIO_RUNTIME = "asyncio"
+
 """
     @brief: This function is used to check if the environment variables are set.
     @return: True if all environment variables are set, False otherwise.
@@ -65,7 +105,8 @@ def check_env_vars() -> bool:
 
 """
     @brief: This function is called when a new message is received from the
-            MQTT broker.
+            MQTT broker. It only hands the message over to the dispatcher,
+            if any, otherwise the message is processed inline.
     @param client: The client object.
     @param userdata: The user data.
     @param message: The message.
@@ -74,51 +115,161 @@ def check_env_vars() -> bool:
 
 
 def subscribe_callback(client, userdata, message):
-    topic = message.topic
-    payload_str = message.payload.decode("utf-8")
-    payload = json.loads(payload_str)
-    end_devices_infos = payload.get("end_device_ids")
-    dev_id = end_devices_infos.get("device_id")
-    dev_eui = end_devices_infos.get("dev_eui")
-    dev_addr = end_devices_infos.get("dev_addr")
-    if "/join" in topic:
-        ret = client.e2l_module.handle_otaa_join_request(
-            dev_id=dev_id, dev_eui=dev_eui, dev_addr=dev_addr
-        )
-        return ret
-    up_msg = payload.get("uplink_message")
-    up_port = up_msg.get("f_port")
-    uplink_message = payload.get("uplink_message")
-    fcnt = uplink_message.get("f_cnt")
-    rx_metadata = uplink_message.get("rx_metadata")[0]
-    rx_timestamp = rx_metadata.get("timestamp")
-    frame_payload = uplink_message.get("frm_payload")
-    ret = 0
+    start = time.perf_counter()
+    if client.dispatcher is not None:
+        # Shard by device id (v3/<app>/devices/<dev_id>/<up|join>)
+        dev_id = message.topic.rsplit("/", 2)[-2]
+        client.dispatcher.submit(dev_id, message)
+        ret = 0
+    else:
+        _frame_type, ret = process_message(client.e2l_module, message)
+    client.e2l_module.observe_handler_latency("subscribe_callback", start)
+    return ret
+
+
+"""
+    @brief: This function decodes a message received from the MQTT broker.
+    @param message: The message.
+    @return: The frame type and the arguments of the E2L module handler
+             (None if the frame shall not be handled).
+    @rtype: tuple
+"""
+
+
+def decode_message(message):
+    decoded = PAYLOAD_DECODER.decode(message.topic, message.payload)
+    if decoded is None:
+        return UNKNOWN_FRAME_TYPE, None
+    if isinstance(decoded, JoinMessage):
+        return OTAA_JOIN_FRAME_TYPE, {
+            "dev_id": decoded.dev_id,
+            "dev_eui": decoded.dev_eui,
+            "dev_addr": decoded.dev_addr,
+        }
+    up_port = decoded.f_port
     if up_port == DEFAULT_APP_PORT:
         log.debug("Received Legacy Frame")
-        return client.e2l_module.handle_legacy_data(
-            dev_id, dev_eui, dev_addr, fcnt, rx_timestamp, frame_payload
-        )
+        return LEGACY_FRAME_TYPE, {
+            "dev_id": decoded.dev_id,
+            "dev_eui": decoded.dev_eui,
+            "dev_addr": decoded.dev_addr,
+            "fcnt": decoded.f_cnt,
+            "rx_timestamp": decoded.rx_timestamp,
+            "frame_payload_base64": decoded.frm_payload,
+        }
     elif up_port == DEFAULT_E2L_JOIN_PORT:
         log.debug("Received Edge Join Frame")
-        ret = client.e2l_module.handle_edge_join_request(
-            dev_id=dev_id,
-            dev_eui=dev_eui,
-            dev_addr=dev_addr,
-            dev_pub_key_compressed_base_64=frame_payload,
-        )
+        return EDGE_JOIN_FRAME_TYPE, {
+            "dev_id": decoded.dev_id,
+            "dev_eui": decoded.dev_eui,
+            "dev_addr": decoded.dev_addr,
+            "dev_pub_key_compressed_base_64": decoded.frm_payload,
+        }
     elif up_port == DEFAULT_E2L_APP_PORT:
         log.debug("Received Edge Frame")
-        ret = client.e2l_module.handle_edge_data_from_legacy(
-            dev_id, dev_eui, dev_addr, frame_payload
-        )
+        return EDGE_FRAME_TYPE, {
+            "dev_id": decoded.dev_id,
+            "dev_eui": decoded.dev_eui,
+            "dev_addr": decoded.dev_addr,
+            "frame_payload": decoded.frm_payload,
+        }
     else:
         log.warning(f"Unknown frame port: {up_port}")
+    return UNKNOWN_FRAME_TYPE, None
+
+
+"""
+    @brief: This function decodes a message received from the MQTT broker and
+            passes it to the E2L module.
+    @param e2l_module: The E2L module.
+    @param message: The message.
+    @return: The frame type and the return code of the handler.
+    @rtype: tuple
+"""
+
 
+def process_message(e2l_module, message):
+    frame_type, handler_args = decode_message(message)
+    if handler_args is None:
+        return frame_type, 0
+    if not e2l_module.owns_device(handler_args["dev_eui"]):
+        return NOT_OWNED_FRAME_TYPE, 0
+    start = time.perf_counter()
+    ret = getattr(e2l_module, FRAME_HANDLERS[frame_type])(**handler_args)
+    e2l_module.observe_handler_latency(frame_type, start)
     if ret < 0:
         log.error(f"Error handling frame: {ret}")
+    return frame_type, ret
+
+
+"""
+    @brief: Coroutine version of process_message, used by the asyncio runtime.
+    @param e2l_module: The AsyncE2LoRaModule.
+    @param message: The message.
+    @return: The frame type and the return code of the handler.
+    @rtype: tuple
+"""
+
+
+async def async_process_message(e2l_module, message):
+    frame_type, handler_args = decode_message(message)
+    if handler_args is None:
+        return frame_type, 0
+    if not e2l_module.owns_device(handler_args["dev_eui"]):
+        return NOT_OWNED_FRAME_TYPE, 0
+    start = time.perf_counter()
+    ret = await getattr(e2l_module, FRAME_HANDLERS[frame_type])(**handler_args)
+    e2l_module.observe_handler_latency(frame_type, start)
+    if ret < 0:
+        log.error(f"Error handling frame: {ret}")
+    return frame_type, ret
 
-    return ret
+
+"""
+    @brief: This function starts the metrics endpoint, if METRICS_PORT is set.
+    @param e2l_module: The E2LoRaModule.
+    @param dispatcher: The frame dispatcher, if any.
+    @return: The MetricsExporter, None if disabled.
+"""
+
+
+def start_metrics_exporter(e2l_module, dispatcher):
+    config = get_config()
+    if config.metrics_port is None:
+        return None
+    exporter = MetricsExporter(host=config.metrics_host, port=config.metrics_port)
+    exporter.add_collector(collect_process_metrics)
+    exporter.add_collector(e2l_module.collect_metrics)
+    if dispatcher is not None:
+        exporter.add_collector(dispatcher.collect_metrics)
+    exporter.start()
+    return exporter
+
+
+"""
+    @brief: This function joins the cluster of sink workers, if CLUSTER_NODES is set.
+            Every worker subscribes to the whole uplink topic (no shared
+            subscription) and only handles the devices it owns.
+    @param config: The RuntimeConfig.
+    @return: The Cluster, None for a single sink.
+"""
+
+
+def build_cluster(config):
+    if config.cluster_nodes is None:
+        return None
+    if config.mqtt_share_group is not None:
+        raise Exception("MQTT_SHARE_GROUP cannot be used with CLUSTER_NODES")
+    nodes = parse_cluster_nodes(config.cluster_nodes)
+    cluster = Cluster(
+        config.cluster_node_id,
+        nodes,
+        open_state_store(config.cluster_store),
+        vnodes=config.cluster_vnodes,
+        sync_interval=config.cluster_sync_interval,
+    )
+    log.info(f"Cluster worker {config.cluster_node_id} of {len(nodes)}")
+    return cluster
 
 
 def edge_callback(data):
@@ -126,12 +277,106 @@ def edge_callback(data):
     return data
 
 
+"""
+    @brief: This function runs the sink on a single asyncio event loop: the
+            RPC server uses grpc.aio, the MQTT client is driven by the loop
+            and the E2L handlers are awaited as coroutines.
+    @param e2l_module: The E2L module.
+    @return: None.
+"""
+
+
+async def run_async(e2l_module):
+    config = get_config()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_config)
+    e2l_async_module = AsyncE2LoRaModule(e2l_module=e2l_module)
+    e2l_async_module.start_background_tasks()
+
+    #####################
+    #   INIT RPC SERVER #
+    #####################
+    rpc_server_instance = grpc.aio.server()
+    e2l_server = AsyncEdge2LoRaApplicationServer(e2l_module=e2l_async_module)
+    edge2applicationserver_pb2_grpc.add_Edge2ApplicationServerServicer_to_server(
+        e2l_server, rpc_server_instance
+    )
+    rpc_server_instance.add_insecure_port(f"[::]:{config.rpc_server_port}")
+    await rpc_server_instance.start()
+    log.info("Started RPC server (asyncio)")
+
+    #########################
+    #   INIT DISPATCHER     #
+    #########################
+    async def handle_message(message):
+        frame_type, _ret = await async_process_message(e2l_async_module, message)
+        return frame_type
+
+    dispatcher = AsyncFrameDispatcher(
+        handler=handle_message,
+        workers=max(1, config.dispatcher_workers),
+        queue_size=config.dispatcher_queue_size,
+    )
+    dispatcher.start()
+    metrics_exporter = start_metrics_exporter(e2l_module, dispatcher)
+    if metrics_exporter is not None and e2l_module.cluster is not None:
+        metrics_exporter.add_collector(e2l_module.cluster.collect_metrics)
+    if metrics_exporter is not None and e2l_module.directory_store is not None:
+        metrics_exporter.add_collector(e2l_module.directory_store.collect_metrics)
+
+    #########################
+    #   INIT MQTT CLIENT    #
+    #########################
+    log.debug("Connecting to MQTT broker...")
+    mqqt_client = AsyncMQTTModule(
+        username=config.mqtt_username,
+        password=config.mqtt_password,
+        host=config.mqtt_host,
+        port=config.mqtt_port,
+        e2l_module=e2l_module,
+        dispatcher=dispatcher,
+        client_id=config.mqtt_client_id,
+        clean_session=config.mqtt_clean_session,
+        protocol=config.mqtt_protocol,
+        share_group=config.mqtt_share_group,
+        clients=config.mqtt_clients,
+        downlink_coalesce_window=config.downlink_coalesce_window,
+        downlink_gw_rate=config.downlink_gw_rate,
+        downlink_gw_burst=config.downlink_gw_burst,
+    )
+    if metrics_exporter is not None:
+        metrics_exporter.add_collector(mqqt_client.downlinks.collect_metrics)
+        metrics_exporter.add_collector(mqqt_client.collect_metrics)
+    await mqqt_client.connect()
+    log.debug("Connected to MQTT broker")
+
+    # SUBSCRIBE TO TOPIC
+    uplink_topic = config.mqtt_uplink_topic
+    join_topic = config.mqtt_otaa_topic
+    mqqt_client.subscribe_to_topic(
+        topic=uplink_topic, callback=subscribe_callback, qos=config.mqtt_uplink_qos
+    )
+    mqqt_client.subscribe_to_topic(
+        topic=join_topic, callback=subscribe_callback, qos=config.mqtt_otaa_qos
+    )
+
+    # PASS MQTT CLIENT TO E2L MODULE
+    e2l_module.set_mqtt_client(mqqt_client)
+
+    log.info("Waiting for messages from MQTT broker...")
+    try:
+        await rpc_server_instance.wait_for_termination()
+    finally:
+        if e2l_module.cluster is not None:
+            await e2l_module.cluster.stop_async()
+
+
 if __name__ == "__main__":
     log.info("Starting...")
     #####################
     #   CHECK ENV VARS  #
     #####################
     check_env_vars()
+    config = get_config()
 
     #####################
     #   GET LINE ARGS   #
@@ -146,11 +391,30 @@ if __name__ == "__main__":
     dashboard_rpc_endpoint = None
     if experiment_id is None:
         dashboard_rpc_endpoint = (
-            f'{os.getenv("DASHBOARD_RPC_HOST")}:{os.getenv("DASHBOARD_RPC_PORT")}'
+            f"{config.dashboard_rpc_host}:{config.dashboard_rpc_port}"
         )
+    cluster = build_cluster(config)
     e2l_module = E2LoRaModule(
-        dashboard_rpc_endpoint=dashboard_rpc_endpoint, experiment_id=experiment_id
+        dashboard_rpc_endpoint=dashboard_rpc_endpoint,
+        experiment_id=experiment_id,
+        config=config,
+        cluster=cluster,
     )
+    if cluster is not None:
+        cluster.start()
+    # SIGHUP reloads the configuration (CONFIG_ENV_FILE, if set, is re-read)
+    add_reload_listener(e2l_module.apply_config)
+
+    runtime = config.e2l_runtime
+    if runtime == ASYNCIO_RUNTIME:
+        log.info("Using asyncio runtime")
+        asyncio.run(run_async(e2l_module))
+        sys.exit(0)
+    elif runtime != THREADED_RUNTIME:
+        log.error(f"Unknown runtime: {runtime}")
+        exit(1)
+
+    install_sighup_handler()
     e2l_module.start_dashboard_update_loop()
     e2l_module.start_resource_monitor_loop()
 
@@ -162,31 +426,65 @@ if __name__ == "__main__":
     edge2applicationserver_pb2_grpc.add_Edge2ApplicationServerServicer_to_server(
         e2l_server, rpc_server_instance
     )
-    rpc_server_instance.add_insecure_port(f'[::]:{os.getenv("RPC_SERVER_PORT")}')
+    rpc_server_instance.add_insecure_port(f"[::]:{config.rpc_server_port}")
     rpc_server_instance.start()
     log.info("Started RPC server")
 
+    #########################
+    #   INIT DISPATCHER     #
+    #########################
+    dispatcher = None
+    dispatcher_workers = config.dispatcher_workers
+    if dispatcher_workers > 0:
+        dispatcher = FrameDispatcher(
+            handler=lambda message: process_message(e2l_module, message)[0],
+            workers=dispatcher_workers,
+            queue_size=config.dispatcher_queue_size,
+        )
+        dispatcher.start()
+        log.info(f"Started dispatcher with {dispatcher_workers} workers")
+    metrics_exporter = start_metrics_exporter(e2l_module, dispatcher)
+    if metrics_exporter is not None and e2l_module.cluster is not None:
+        metrics_exporter.add_collector(e2l_module.cluster.collect_metrics)
+    if metrics_exporter is not None and e2l_module.directory_store is not None:
+        metrics_exporter.add_collector(e2l_module.directory_store.collect_metrics)
+
     #########################
     #   INIT MQTT CLIENT    #
     #########################
     log.debug("Connecting to MQTT broker...")
     mqqt_client = MQTTModule(
-        username=os.getenv("MQTT_USERNAME"),
-        password=os.getenv("MQTT_PASSWORD"),
-        host=os.getenv("MQTT_HOST"),
-        port=int(os.getenv("MQTT_PORT")),
+        username=config.mqtt_username,
+        password=config.mqtt_password,
+        host=config.mqtt_host,
+        port=config.mqtt_port,
         e2l_module=e2l_module,
+        dispatcher=dispatcher,
+        client_id=config.mqtt_client_id,
+        clean_session=config.mqtt_clean_session,
+        protocol=config.mqtt_protocol,
+        share_group=config.mqtt_share_group,
+        clients=config.mqtt_clients,
+        downlink_coalesce_window=config.downlink_coalesce_window,
+        downlink_gw_rate=config.downlink_gw_rate,
+        downlink_gw_burst=config.downlink_gw_burst,
     )
+    if metrics_exporter is not None:
+        metrics_exporter.add_collector(mqqt_client.downlinks.collect_metrics)
     log.debug("Connected to MQTT broker")
 
     # SUBSCRIBE TO TOPIC
-    uplink_topic = os.getenv("MQTT_UPLINK_TOPIC")
-    join_topic = os.getenv("MQTT_OTAA_TOPIC")
+    uplink_topic = config.mqtt_uplink_topic
+    join_topic = config.mqtt_otaa_topic
     log.debug(f"Subscribing to MQTT topic {uplink_topic}...")
-    mqqt_client.subscribe_to_topic(topic=uplink_topic, callback=subscribe_callback)
+    mqqt_client.subscribe_to_topic(
+        topic=uplink_topic, callback=subscribe_callback, qos=config.mqtt_uplink_qos
+    )
     log.debug(f"Subscribed to MQTT topic {uplink_topic}")
     log.debug(f"Subscribing to MQTT topic {join_topic}...")
-    mqqt_client.subscribe_to_topic(topic=join_topic, callback=subscribe_callback)
+    mqqt_client.subscribe_to_topic(
+        topic=join_topic, callback=subscribe_callback, qos=config.mqtt_otaa_qos
+    )
     log.debug(f"Subscribed to MQTT topic {join_topic}")
 
     # PASS MQTT CLIENT TO E2L MODULE
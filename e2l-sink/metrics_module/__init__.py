@@ -0,0 +1,3 @@
+from ._metrics_module import LatencyHistogram, DEFAULT_LATENCY_BUCKETS_MS
+from ._counters import ShardedCounters, CounterSnapshot
+from ._exporter import MetricsExporter, MetricsWriter, collect_process_metrics
@@ -0,0 +1,156 @@
+import threading
+from array import array
+from threading import Lock
+
+# Initial number of slots of a counter array (grown on demand)
+DEFAULT_INITIAL_SLOTS = 8
+
+
+class CounterSnapshot:
+    """
+    Totals of a ShardedCounters at a point in time: name -> list of slot values.
+    A scalar counter is a counter with a single slot (0).
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else {}
+
+    """
+        @brief  This function returns the value of a counter slot.
+        @param name: The counter name.
+        @param slot: The slot (registry position), 0 for the scalar counters.
+        @return The value, 0 if the counter or slot was never incremented.
+    """
+
+    def get(self, name, slot=0):
+        slots = self.values.get(name)
+        if slots is None or slot is None or slot >= len(slots):
+            return 0
+        return slots[slot]
+
+    """
+        @brief  This function returns the sum of all the slots of a counter.
+        @param name: The counter name.
+        @return The total.
+    """
+
+    def total(self, name):
+        return sum(self.values.get(name, ()))
+
+    def __sub__(self, other):
+        values = {}
+        for name, slots in self.values.items():
+            old_slots = other.values.get(name, ())
+            values[name] = [
+                value - (old_slots[slot] if slot < len(old_slots) else 0)
+                for slot, value in enumerate(slots)
+            ]
+        return CounterSnapshot(values)
+
+    def to_dict(self):
+        return {name: list(slots) for name, slots in self.values.items()}
+
+
+class ShardedCounters:
+    """
+    Monotonic counters sharded per thread: each thread only increments its own
+    array-backed slots, so increments never contend on a lock and are never lost.
+    The readers sum the shards (snapshot) and diff them against the previous
+    snapshot of the same consumer (delta).
+    """
+
+    def __init__(self, **kwargs) -> None:
+        self.initial_slots = kwargs.get("initial_slots", DEFAULT_INITIAL_SLOTS)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = Lock()
+        self._last = {}
+        self._delta_lock = Lock()
+
+    def _get_shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    """
+        @brief  This function increments a counter slot of the calling thread shard.
+        @param name: The counter name.
+        @param value: The increment.
+        @param slot: The slot (registry position), 0 for the scalar counters.
+        @return None.
+    """
+
+    def add(self, name, value=1, slot=0):
+        shard = self._get_shard()
+        slots = shard.get(name)
+        if slots is None or slot >= len(slots):
+            # Replaced, not extended: a reader always sees a complete array
+            size = max(self.initial_slots, slot + 1, 2 * len(slots or ()))
+            new_slots = array("q", bytes(8 * size))
+            if slots is not None:
+                new_slots[: len(slots)] = slots
+            shard[name] = new_slots
+            slots = new_slots
+        slots[slot] += value
+
+    """
+        @brief  This function returns the current value of a counter slot.
+        @param name: The counter name.
+        @param slot: The slot (registry position), 0 for the scalar counters.
+        @return The value summed over the threads.
+    """
+
+    def get(self, name, slot=0):
+        with self._shards_lock:
+            shards = list(self._shards)
+        value = 0
+        for shard in shards:
+            slots = shard.get(name)
+            if slots is not None and slot < len(slots):
+                value += slots[slot]
+        return value
+
+    """
+        @brief  This function sums the shards of every counter.
+        @return CounterSnapshot
+    """
+
+    def snapshot(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        values = {}
+        for shard in shards:
+            for name, slots in list(shard.items()):
+                slots = slots.tolist()
+                total = values.get(name)
+                if total is None:
+                    values[name] = slots
+                    continue
+                if len(slots) > len(total):
+                    total.extend([0] * (len(slots) - len(total)))
+                for slot, value in enumerate(slots):
+                    total[slot] += value
+        return CounterSnapshot(values)
+
+    """
+        @brief  This function takes a snapshot and diffs it against the previous
+                snapshot taken for the same consumer, atomically between the
+                consumers: the deltas of a consumer always add up to the totals.
+        @param consumer: The consumer name (each one keeps its own baseline).
+        @return (CounterSnapshot totals, CounterSnapshot delta).
+    """
+
+    def delta(self, consumer):
+        with self._delta_lock:
+            current = self.snapshot()
+            last = self._last.get(consumer)
+            self._last[consumer] = current
+        if last is None:
+            return current, current
+        return current, current - last
@@ -0,0 +1,195 @@
+import logging
+import psutil
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+log = logging.getLogger(__name__)
+
+# DEFAULTS
+DEFAULT_METRICS_HOST = "0.0.0.0"
+METRICS_PATH = "/metrics"
+# Prometheus text exposition format (also accepted by the OpenMetrics scrapers)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# METRIC TYPES
+COUNTER_TYPE = "counter"
+GAUGE_TYPE = "gauge"
+HISTOGRAM_TYPE = "histogram"
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{_escape_label_value(value)}"' for name, value in labels.items()
+        )
+        + "}"
+    )
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class MetricsWriter:
+    """
+    Renders the samples of a scrape in the Prometheus text format.
+    The samples of a metric shall be written one after the other.
+    """
+
+    def __init__(self):
+        self._lines = []
+        self._declared = set()
+
+    def _declare(self, name, help, metric_type):
+        if name in self._declared:
+            return
+        self._declared.add(name)
+        self._lines.append(f"# HELP {name} {help}")
+        self._lines.append(f"# TYPE {name} {metric_type}")
+
+    def _sample(self, name, value, labels=None):
+        self._lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def counter(self, name, help, value, labels=None):
+        self._declare(name, help, COUNTER_TYPE)
+        self._sample(name, value, labels)
+
+    def gauge(self, name, help, value, labels=None):
+        self._declare(name, help, GAUGE_TYPE)
+        self._sample(name, value, labels)
+
+    """
+        @brief  This function writes a LatencyHistogram, converted to seconds.
+        @param name: The metric name (should end with _seconds).
+        @param help: The metric description.
+        @param histogram: The LatencyHistogram (ms).
+        @param labels: dict of labels.
+        @return None.
+    """
+
+    def histogram(self, name, help, histogram, labels=None):
+        self._declare(name, help, HISTOGRAM_TYPE)
+        snapshot = histogram.snapshot()
+        labels = dict(labels or {})
+        cumulative = 0
+        for bound, count in snapshot["buckets"].items():
+            cumulative += count
+            le = "+Inf" if bound == "+Inf" else _format_value(bound / 1000)
+            self._sample(f"{name}_bucket", cumulative, {**labels, "le": le})
+        self._sample(f"{name}_sum", snapshot["sum_ms"] / 1000, labels)
+        self._sample(f"{name}_count", snapshot["count"], labels)
+
+    def render(self):
+        return "\n".join(self._lines) + "\n"
+
+
+_process = psutil.Process()
+
+"""
+    @brief  This function writes the CPU and memory usage of the sink process.
+    @param writer: The MetricsWriter.
+    @return None.
+"""
+
+
+def collect_process_metrics(writer):
+    cpu_times = _process.cpu_times()
+    memory_info = _process.memory_info()
+    writer.counter(
+        "process_cpu_seconds_total",
+        "Total user and system CPU time spent in seconds.",
+        cpu_times.user + cpu_times.system,
+    )
+    writer.gauge(
+        "process_resident_memory_bytes",
+        "Resident memory size in bytes.",
+        memory_info.rss,
+    )
+    writer.gauge(
+        "process_virtual_memory_bytes",
+        "Virtual memory size in bytes.",
+        memory_info.vms,
+    )
+    writer.gauge("process_num_threads", "Number of OS threads.", _process.num_threads())
+
+
+class MetricsExporter:
+    """
+    Pull-based metrics endpoint: a small HTTP server, on its own thread, that
+    renders the registered collectors on each scrape of /metrics.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        self.host = kwargs.get("host", DEFAULT_METRICS_HOST)
+        self.port = kwargs.get("port", None)
+        if self.port is None:
+            raise Exception("Missing metrics port")
+        self._collectors = []
+        self._lock = Lock()
+        self._server = None
+        self._thread = None
+
+    """
+        @brief  This function registers a collector, called on each scrape.
+        @param collector: function(MetricsWriter).
+        @return None.
+    """
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        writer = MetricsWriter()
+        for collector in collectors:
+            try:
+                collector(writer)
+            except Exception:
+                log.exception("Error collecting metrics")
+        return writer.render()
+
+    def start(self):
+        exporter = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != METRICS_PATH:
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(format % args)
+
+        self._server = ThreadingHTTPServer(
+            (self.host, self.port), MetricsRequestHandler
+        )
+        self._server.daemon_threads = True
+        # Actual port, if 0 was requested
+        self.port = self._server.server_address[1]
+        self._thread = Thread(
+            target=self._server.serve_forever, name="metrics-exporter", daemon=True
+        )
+        self._thread.start()
+        log.info(f"Metrics exposed on {self.host}:{self.port}{METRICS_PATH}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
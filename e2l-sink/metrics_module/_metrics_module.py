@@ -0,0 +1,93 @@
+import bisect
+from threading import Lock
+
+# DEFAULT LATENCY BUCKETS (ms)
+DEFAULT_LATENCY_BUCKETS_MS = (
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    2500,
+    5000,
+    10000,
+)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram (milliseconds), safe to share between threads.
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS_MS):
+        self.buckets = tuple(sorted(buckets))
+        # Last slot counts the observations above the highest bucket
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = Lock()
+
+    """
+        @brief  This function records a new observation.
+        @param value_ms: The observed latency in milliseconds.
+        @return None.
+    """
+
+    def observe(self, value_ms):
+        index = bisect.bisect_left(self.buckets, value_ms)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value_ms
+            if value_ms > self._max:
+                self._max = value_ms
+
+    """
+        @brief  This function estimates a quantile from the bucket counts.
+        @param q: The quantile, between 0 and 1.
+        @return The upper bound of the bucket holding the quantile (ms).
+    """
+
+    def quantile(self, q):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            max_value = self._max
+        if total == 0:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= rank and count > 0:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], max_value)
+                return max_value
+        return max_value
+
+    """
+        @brief  This function returns a copy of the histogram state.
+        @return dict with count, sum, max, p50, p99 and the per-bucket counts.
+    """
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_sum = self._sum
+            max_value = self._max
+        return {
+            "count": total,
+            "sum_ms": total_sum,
+            "max_ms": max_value,
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "buckets": dict(zip(list(self.buckets) + ["+Inf"], counts)),
+        }
@@ -1 +1,3 @@
-from ._mqtt_module import MQTTModule
\ No newline at end of file
+from ._mqtt_module import MQTTModule
+from ._async_mqtt_module import AsyncMQTTModule
+from ._downlink_scheduler import DownlinkScheduler
@@ -0,0 +1,238 @@
+import paho.mqtt.client as mqtt
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from ._downlink_scheduler import DownlinkScheduler
+from ._mqtt_module import (
+    DEFAULT_MQTT_PROTOCOL,
+    get_mqtt_protocol,
+    make_client_id,
+    shared_topic,
+    create_client,
+    connect_client
+)
+
+log = logging.getLogger(__name__)
+
+# Seconds between two reconnection attempts
+RECONNECT_DELAY_SEC = 1
+RECONNECT_MAX_DELAY_SEC = 30
+# Frames read while the dispatcher is full, kept until it has room again (one
+# loop_read reads several packets, the capacity is only checked before it)
+OVERFLOW_SIZE = 1000
+
+
+class AsyncMQTTModule():
+    """
+    MQTT client driven by the asyncio event loop instead of a paho network
+    thread: the socket is registered on the loop and paho is only asked to
+    read/write when the socket is ready.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        self.username = kwargs.get('username', None)
+        self.password = kwargs.get('password', None)
+        self.host = kwargs.get('host', None)
+        self.port = kwargs.get('port', None)
+        client_id = kwargs.get('client_id', None)
+        self.clean_session = kwargs.get('clean_session', True)
+        self.protocol = get_mqtt_protocol(kwargs.get('protocol', DEFAULT_MQTT_PROTOCOL))
+        self.share_group = kwargs.get('share_group', None)
+        if kwargs.get('clients', 1) > 1:
+            log.warning('The asyncio runtime opens a single MQTT client')
+        e2l_module = kwargs.get('e2l_module', None)
+        dispatcher = kwargs.get('dispatcher', None)
+        if self.username is None or self.password is None or self.host is None or self.port is None or e2l_module is None or dispatcher is None:
+            raise Exception('Missing parameters')
+        self.client = create_client(
+            make_client_id(client_id, 0),
+            self.protocol,
+            self.clean_session,
+            self.username,
+            self.password
+        )
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self.client.on_disconnect = self._on_disconnect
+        # Downlinks (g_as_gw, REJOIN)
+        self.downlinks = DownlinkScheduler(
+            self._publish_downlink,
+            coalesce_window=kwargs.get('downlink_coalesce_window', 0),
+            gw_rate=kwargs.get('downlink_gw_rate', 0),
+            gw_burst=kwargs.get('downlink_gw_burst', 10)
+        )
+        self.client.on_publish = self.downlinks.on_publish
+        self.loop = None
+        self._loop_thread_id = None
+        self._misc_task = None
+        self._reconnect_task = None
+        self._socket = None
+        self._reading_paused = False
+        self._overflow = deque()
+        # Frames lost because the overflow was full
+        self.dropped_frames = 0
+        # e2l Module
+        self.e2l_module = e2l_module
+        # Frame dispatcher (AsyncFrameDispatcher)
+        self.dispatcher = dispatcher
+        # (topic, qos), renewed on reconnection
+        self.subscriptions = []
+
+    """
+        @brief  This function connects to the broker. It shall be awaited from the event loop.
+        @return None.
+    """
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        connect_client(self.client, self.protocol, self.clean_session, self.host, self.port)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._socket = sock
+        self.loop.add_reader(sock, self._on_readable)
+        self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        self._socket = None
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, self.client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        if rc != mqtt.MQTT_ERR_SUCCESS and self._reconnect_task is None:
+            log.warning(f'Disconnected from MQTT broker ({rc}), reconnecting...')
+            self._reconnect_task = self.loop.create_task(self._reconnect())
+
+    def _on_readable(self):
+        # Stop reading from the socket while the dispatcher is full (backpressure)
+        if self.dispatcher.saturated():
+            self._pause_reading()
+            return
+        self.client.loop_read()
+
+    def _pause_reading(self):
+        if self._reading_paused:
+            return
+        if self._socket is not None:
+            self.loop.remove_reader(self._socket)
+        self._reading_paused = True
+        self.loop.create_task(self._resume_reading())
+
+    async def _resume_reading(self):
+        while True:
+            await self.dispatcher.wait_for_capacity()
+            # Frames parked in the overflow first, in arrival order
+            while len(self._overflow) > 0 and not self.dispatcher.saturated():
+                message = self._overflow.popleft()
+                try:
+                    self.callback(self, None, message)
+                except asyncio.QueueFull:
+                    self._overflow.appendleft(message)
+                    break
+            if len(self._overflow) == 0:
+                break
+        self._reading_paused = False
+        if self._socket is not None:
+            self.loop.add_reader(self._socket, self._on_readable)
+
+    def _park(self, message):
+        if len(self._overflow) >= OVERFLOW_SIZE:
+            self.dropped_frames += 1
+            log.error(f'Dispatcher and overflow full, dropped frame from {message.topic}')
+        else:
+            self._overflow.append(message)
+        self._pause_reading()
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+    async def _reconnect(self):
+        delay = RECONNECT_DELAY_SEC
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                self.client.reconnect()
+                for topic, qos in self.subscriptions:
+                    self.client.subscribe(shared_topic(topic, self.share_group), qos)
+                break
+            except OSError as e:
+                log.warning(f'Unable to reconnect to MQTT broker: {e}')
+                delay = min(delay * 2, RECONNECT_MAX_DELAY_SEC)
+        self._reconnect_task = None
+
+    def _callback(self, client, userdata, message):
+        # Keep the order behind the parked frames
+        if len(self._overflow) > 0:
+            self._park(message)
+            return
+        try:
+            self.callback(self, userdata, message)
+        except asyncio.QueueFull:
+            self._park(message)
+
+    def enable_logger(self, enable = True):
+        if enable:
+            self.client.enable_logger(logging.getLogger(__name__))
+        else:
+            self.client.disable_logger()
+
+    def subscribe_to_topic(self, topic: str, callback, qos = 0):
+        self.client.subscribe(shared_topic(topic, self.share_group), qos)
+        self.subscriptions.append((topic, qos))
+        self.callback = callback
+        self.client.on_message = self._callback
+
+    def publish_to_topic(self, topic, message):
+        # paho is not thread safe when driven by the loop: publish from the loop thread
+        if threading.get_ident() != self._loop_thread_id:
+            self.loop.call_soon_threadsafe(self.client.publish, topic, message)
+            return None
+        return self.client.publish(
+            topic=topic,
+            payload=message
+            )
+
+    def _publish_downlink(self, topic, message):
+        if threading.get_ident() != self._loop_thread_id:
+            self.loop.call_soon_threadsafe(self._publish_and_track, topic, message, time.perf_counter())
+            return None
+        return self.client.publish(topic=topic, payload=message)
+
+    def _publish_and_track(self, topic, message, start):
+        self.downlinks.track(self.client.publish(topic=topic, payload=message), start)
+
+    """
+        @brief  This function schedules a downlink to a ED (see DownlinkScheduler.schedule).
+        @return None.
+    """
+
+    def collect_metrics(self, writer):
+        writer.gauge(
+            'e2l_mqtt_overflow_frames',
+            'Frames read while the dispatcher was full, waiting for it.',
+            len(self._overflow),
+        )
+        writer.counter(
+            'e2l_mqtt_dropped_frames_total',
+            'Frames dropped because the dispatcher and the overflow were full.',
+            self.dropped_frames,
+        )
+
+    def send_downlink(self, base_topic, dev_id, base64_message, f_port=3, priority='HIGHEST', gw_id=None):
+        self.downlinks.schedule(base_topic, dev_id, base64_message, f_port, priority, gw_id)
@@ -0,0 +1,305 @@
+import json
+import time
+import logging
+from threading import Thread, Condition
+from metrics_module import LatencyHistogram
+
+log = logging.getLogger(__name__)
+
+# DEFAULTS
+# Downlinks to the same device within the window are coalesced (0: sent at once)
+DEFAULT_COALESCE_WINDOW_SEC = 0
+# Downlinks per second per gateway (0: unlimited)
+DEFAULT_GW_RATE = 0
+DEFAULT_GW_BURST = 10
+# Gateway of the downlinks scheduled without one
+DEFAULT_GW_ID = 'default'
+# Bound of the serialized payload cache (REJOIN and one g_as_gw per gateway)
+MAX_CACHED_PAYLOADS = 1024
+# Bound of the publishes waiting for their ack
+MAX_INFLIGHT = 10000
+TOPIC_SUFFIX = '/down/replace'
+
+
+class _TokenBucket():
+
+    __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self):
+        return (1 - self.tokens) / self.rate
+
+
+class _PendingDownlink():
+
+    __slots__ = ('topic', 'payload', 'gw_id', 'due', 'deferred')
+
+    def __init__(self, topic, payload, gw_id, due):
+        self.topic = topic
+        self.payload = payload
+        self.gw_id = gw_id
+        self.due = due
+        self.deferred = False
+
+
+class DownlinkScheduler():
+    """
+    Schedules the downlinks published by the sink (g_as_gw, REJOIN).
+    The topics are computed once per device and the payloads serialized once
+    per (message, port, priority). A downlink replaces the one still pending
+    for the same device (the TTS queue is replaced anyway), the publishes are
+    rate limited per gateway and their ack latency is measured.
+    """
+
+    def __init__(self, publish, **kwargs) -> None:
+        # function(topic, payload) -> MQTTMessageInfo, None if the publisher calls track
+        self._publish = publish
+        self.coalesce_window = kwargs.get('coalesce_window', DEFAULT_COALESCE_WINDOW_SEC)
+        self.gw_rate = kwargs.get('gw_rate', DEFAULT_GW_RATE)
+        self.gw_burst = max(1, kwargs.get('gw_burst', DEFAULT_GW_BURST))
+        self._base_topic = None
+        self._topics = {}
+        self._payloads = {}
+        self._buckets = {}
+        # dev_id -> _PendingDownlink, in scheduling order
+        self._pending = {}
+        self._inflight = {}
+        self._early_acks = set()
+        self._cond = Condition()
+        self._stopped = False
+        self._sender = None
+
+        # Counters
+        self.scheduled = 0
+        self.coalesced = 0
+        self.published = 0
+        self.publish_errors = 0
+        self.acked = 0
+        self.deferred = 0
+        self.ack_latency = LatencyHistogram()
+
+    def _immediate(self):
+        return self.coalesce_window <= 0 and self.gw_rate <= 0
+
+    def _get_topic(self, base_topic, dev_id):
+        if base_topic != self._base_topic:
+            # MQTT_BASE_TOPIC reloaded
+            self._topics = {}
+            self._base_topic = base_topic
+        topic = self._topics.get(dev_id)
+        if topic is None:
+            topic = f'{base_topic}{dev_id}{TOPIC_SUFFIX}'
+            self._topics[dev_id] = topic
+        return topic
+
+    def _get_payload(self, base64_message, f_port, priority):
+        key = (base64_message, f_port, priority)
+        payload = self._payloads.get(key)
+        if payload is None:
+            payload = json.dumps({
+                'downlinks': [
+                    {
+                        'f_port': f_port,
+                        'frm_payload': base64_message,
+                        'priority': priority,
+                    }
+                ]
+            }).encode('utf-8')
+            if len(self._payloads) >= MAX_CACHED_PAYLOADS:
+                self._payloads = {}
+            self._payloads[key] = payload
+        return payload
+
+    """
+        @brief  This function schedules a downlink to a ED.
+        @param base_topic: The MQTT base topic of the devices.
+        @param dev_id: The device ID of the ED as in TTS.
+        @param base64_message: The frame payload encoded in base64.
+        @param f_port: The LoRaWAN port.
+        @param priority: The TTS downlink priority.
+        @param gw_id: The gateway serving the ED (rate limit), None for the default one.
+        @return None.
+    """
+
+    def schedule(self, base_topic, dev_id, base64_message, f_port=3, priority='HIGHEST', gw_id=None):
+        if gw_id is None:
+            gw_id = DEFAULT_GW_ID
+        with self._cond:
+            topic = self._get_topic(base_topic, dev_id)
+            payload = self._get_payload(base64_message, f_port, priority)
+            self.scheduled += 1
+            if not self._immediate() and not self._stopped:
+                pending = self._pending.get(dev_id)
+                if pending is not None:
+                    # Latest downlink wins, sent when the first one was due
+                    pending.topic = topic
+                    pending.payload = payload
+                    pending.gw_id = gw_id
+                    self.coalesced += 1
+                    return
+                self._pending[dev_id] = _PendingDownlink(
+                    topic, payload, gw_id, time.monotonic() + self.coalesce_window
+                )
+                self._start_sender()
+                self._cond.notify()
+                return
+        self._send(topic, payload)
+
+    def _start_sender(self):
+        if self._sender is None and not self._stopped:
+            self._sender = Thread(target=self._send_loop, name='downlink-scheduler', daemon=True)
+            self._sender.start()
+
+    def _take_due(self, now):
+        due = []
+        next_due = None
+        for dev_id, pending in list(self._pending.items()):
+            if pending.due > now:
+                next_due = pending.due if next_due is None else min(next_due, pending.due)
+                continue
+            if self.gw_rate > 0:
+                bucket = self._buckets.get(pending.gw_id)
+                if bucket is None:
+                    bucket = _TokenBucket(self.gw_rate, self.gw_burst)
+                    self._buckets[pending.gw_id] = bucket
+                if not bucket.take(now):
+                    if not pending.deferred:
+                        pending.deferred = True
+                        self.deferred += 1
+                    retry = now + bucket.wait_time()
+                    next_due = retry if next_due is None else min(next_due, retry)
+                    continue
+            del self._pending[dev_id]
+            due.append(pending)
+        return due, next_due
+
+    def _send_loop(self):
+        while True:
+            with self._cond:
+                if self._stopped and len(self._pending) == 0:
+                    return
+                due, next_due = self._take_due(time.monotonic())
+                if len(due) == 0:
+                    if next_due is None:
+                        timeout = None
+                    else:
+                        timeout = max(0, next_due - time.monotonic())
+                    self._cond.wait(timeout)
+                    continue
+            for pending in due:
+                self._send(pending.topic, pending.payload)
+
+    def _send(self, topic, payload):
+        start = time.perf_counter()
+        try:
+            info = self._publish(topic, payload)
+        except Exception as e:
+            with self._cond:
+                self.publish_errors += 1
+            log.error(f'Unable to publish downlink on {topic}: {e}')
+            return
+        if info is not None:
+            self.track(info, start)
+
+    """
+        @brief  This function tracks the ack of a publish.
+        @param info: The MQTTMessageInfo of the publish.
+        @param start: perf_counter() before the publish.
+        @return None.
+    """
+
+    def track(self, info, start):
+        with self._cond:
+            if info.rc != 0:
+                self.publish_errors += 1
+                log.error(f'Unable to publish downlink ({info.rc})')
+                return
+            self.published += 1
+            if info.mid not in self._early_acks:
+                if len(self._inflight) >= MAX_INFLIGHT:
+                    self._inflight = {}
+                self._inflight[info.mid] = start
+                return
+            # Acked within publish (socket written at once)
+            self._early_acks.discard(info.mid)
+            self.acked += 1
+        self.ack_latency.observe((time.perf_counter() - start) * 1000)
+
+    """
+        @brief  paho on_publish callback: the downlink was sent (QoS 0) or acked by the broker.
+        @return None.
+    """
+
+    def on_publish(self, client, userdata, mid):
+        with self._cond:
+            start = self._inflight.pop(mid, None)
+            if start is None:
+                if len(self._early_acks) >= MAX_INFLIGHT:
+                    self._early_acks = set()
+                self._early_acks.add(mid)
+                return
+            self.acked += 1
+        self.ack_latency.observe((time.perf_counter() - start) * 1000)
+
+    """
+        @brief  This function sends the pending downlinks and stops the sender thread.
+        @return None.
+    """
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            sender = self._sender
+        if sender is not None:
+            sender.join()
+
+    def get_stats(self):
+        with self._cond:
+            pending = len(self._pending)
+            inflight = len(self._inflight)
+        return {
+            'scheduled': self.scheduled,
+            'coalesced': self.coalesced,
+            'published': self.published,
+            'publish_errors': self.publish_errors,
+            'acked': self.acked,
+            'deferred': self.deferred,
+            'pending': pending,
+            'inflight': inflight,
+            'ack_latency': self.ack_latency.snapshot(),
+        }
+
+    def collect_metrics(self, writer):
+        stats = self.get_stats()
+        for outcome in ('scheduled', 'coalesced', 'published', 'publish_errors', 'acked'):
+            writer.counter(
+                'e2l_downlinks_total',
+                'Downlinks by outcome.',
+                stats[outcome],
+                {'outcome': outcome},
+            )
+        writer.counter(
+            'e2l_downlinks_deferred_total',
+            'Downlinks deferred by the per gateway rate limit.',
+            stats['deferred'],
+        )
+        writer.gauge('e2l_downlinks_pending', 'Downlinks waiting to be published.', stats['pending'])
+        writer.histogram(
+            'e2l_downlink_ack_latency_seconds',
+            'Latency between the publish of a downlink and its ack.',
+            self.ack_latency,
+        )
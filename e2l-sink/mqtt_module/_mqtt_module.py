@@ -1,49 +1,193 @@
 import paho.mqtt.client as mqtt
-import logging 
+import logging
+import os
+import socket
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
+from ._downlink_scheduler import DownlinkScheduler
 
+log = logging.getLogger(__name__)
+
+# MQTT PROTOCOLS
+MQTT_PROTOCOLS = {
+    '3.1.1': mqtt.MQTTv311,
+    '5': mqtt.MQTTv5,
+}
+DEFAULT_MQTT_PROTOCOL = '3.1.1'
+# Prefix of the generated client ids
+DEFAULT_CLIENT_ID_PREFIX = 'e2l-sink'
+# Session kept by the broker after a disconnection (MQTT v5, clean_session False)
+SESSION_EXPIRY_SEC = 3600
+KEEPALIVE_SEC = 60
+
+
+"""
+    @brief  This function returns the paho protocol version of a protocol name.
+    @param protocol: '3.1.1' or '5'.
+    @return The paho protocol version.
+"""
+
+
+def get_mqtt_protocol(protocol):
+    version = MQTT_PROTOCOLS.get(str(protocol))
+    if version is None:
+        raise Exception(f'Unknown MQTT protocol: {protocol}')
+    return version
+
+
+"""
+    @brief  This function returns the client id of a connection, unique per
+            connection: several sink replicas can share a broker.
+    @param client_id: The configured client id prefix, None to generate one
+                      from the host name and the process id.
+    @param index: The connection index in the process.
+    @return The client id.
+"""
+
+
+def make_client_id(client_id, index):
+    if client_id is None:
+        client_id = f'{DEFAULT_CLIENT_ID_PREFIX}-{socket.gethostname()}-{os.getpid()}'
+    return f'{client_id}-{index}'
+
+
+"""
+    @brief  This function returns the topic to subscribe to.
+    @param topic: The topic.
+    @param share_group: The shared subscription group, None to subscribe to the topic.
+    @return $share/<share_group>/<topic> or the topic.
+"""
+
+
+def shared_topic(topic, share_group):
+    if share_group is None:
+        return topic
+    return f'$share/{share_group}/{topic}'
+
+
+"""
+    @brief  This function creates a paho client, not connected yet.
+    @return mqtt.Client
+"""
+
+
+def create_client(client_id, protocol, clean_session, username, password):
+    if protocol == mqtt.MQTTv5:
+        client = mqtt.Client(client_id=client_id, protocol=protocol)
+    else:
+        client = mqtt.Client(
+            client_id=client_id,
+            clean_session=clean_session,
+            protocol=protocol
+        )
+    client.username_pw_set(username, password)
+    return client
+
+
+"""
+    @brief  This function connects a paho client (persistent session if not clean_session).
+    @return None.
+"""
+
+
+def connect_client(client, protocol, clean_session, host, port):
+    if protocol != mqtt.MQTTv5:
+        client.connect(host, port, KEEPALIVE_SEC)
+        return
+    properties = None
+    if not clean_session:
+        properties = Properties(PacketTypes.CONNECT)
+        properties.SessionExpiryInterval = SESSION_EXPIRY_SEC
+    client.connect(host, port, KEEPALIVE_SEC, clean_start=clean_session, properties=properties)
 
 
 class MQTTModule():
+    """
+    MQTT client of the sink. It opens one or more connections (each one on its
+    own paho network thread) subscribed to the same topics: with a shared
+    subscription group the broker spreads the uplinks among the connections
+    and among the sink replicas. The downlinks are published by the first one.
+    """
 
     def __init__(self, **kwargs) -> None:
         username = kwargs.get('username', None)
         password = kwargs.get('password', None)
         host = kwargs.get('host', None)
         port = kwargs.get('port', None)
-        client_id = kwargs.get('client_id', __name__)
+        client_id = kwargs.get('client_id', None)
         clean_session = kwargs.get('clean_session', True)
+        protocol = get_mqtt_protocol(kwargs.get('protocol', DEFAULT_MQTT_PROTOCOL))
+        self.share_group = kwargs.get('share_group', None)
+        clients = kwargs.get('clients', 1)
         e2l_module = kwargs.get('e2l_module', None)
+        dispatcher = kwargs.get('dispatcher', None)
         if username is None or password is None or host is None or port is None or e2l_module is None:
             raise Exception('Missing parameters')
-        self.client = mqtt.Client(
-            client_id =client_id,
-            clean_session=clean_session,
-            protocol = mqtt.MQTTv311
+        if clients > 1 and self.share_group is None:
+            # Every connection would receive every uplink
+            raise Exception('Several MQTT clients require a shared subscription group')
+        self.clients = []
+        for index in range(max(1, clients)):
+            client = create_client(make_client_id(client_id, index), protocol, clean_session, username, password)
+            client.on_connect = self._on_connect
+            client.on_message = self._callback
+            self.clients.append(client)
+        # Downlinks (g_as_gw, REJOIN)
+        self.client = self.clients[0]
+        self.downlinks = DownlinkScheduler(
+            self.publish_to_topic,
+            coalesce_window=kwargs.get('downlink_coalesce_window', 0),
+            gw_rate=kwargs.get('downlink_gw_rate', 0),
+            gw_burst=kwargs.get('downlink_gw_burst', 10)
         )
-        self.client.username_pw_set(username, password)
-        self.client.connect(host, port, 60)
+        self.client.on_publish = self.downlinks.on_publish
+        # (topic, qos) subscribed by every client, renewed on reconnection
+        self.subscriptions = []
+        for client in self.clients:
+            connect_client(client, protocol, clean_session, host, port)
         # e2l Module
         self.e2l_module = e2l_module
+        # Frame dispatcher (None: frames are processed on the network loop)
+        self.dispatcher = dispatcher
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            log.error(f'Connection to MQTT broker refused ({rc})')
+            return
+        for topic, qos in self.subscriptions:
+            client.subscribe(shared_topic(topic, self.share_group), qos)
 
     def _callback(self, client, userdata, message):
         self.callback(self, userdata, message)
 
     def enable_logger(self, enable = True):
-        if enable:
-            self.client.enable_logger(logging.getLogger(__name__))
-        else:
-            self.client.disable_logger()
+        for client in self.clients:
+            if enable:
+                client.enable_logger(logging.getLogger(__name__))
+            else:
+                client.disable_logger()
 
-    def subscribe_to_topic(self, topic: str, callback):
-        self.client.subscribe(topic)
+    def subscribe_to_topic(self, topic: str, callback, qos = 0):
         self.callback = callback
-        self.client.on_message = self._callback
+        self.subscriptions.append((topic, qos))
+        for client in self.clients:
+            client.subscribe(shared_topic(topic, self.share_group), qos)
 
     def wait_for_message(self):
+        for client in self.clients[1:]:
+            client.loop_start()
         self.client.loop_forever()
 
     def publish_to_topic(self, topic, message):
         return self.client.publish(
-            topic=topic, 
+            topic=topic,
             payload=message
-            )
\ No newline at end of file
+            )
+
+    """
+        @brief  This function schedules a downlink to a ED (see DownlinkScheduler.schedule).
+        @return None.
+    """
+
+    def send_downlink(self, base_topic, dev_id, base64_message, f_port=3, priority='HIGHEST', gw_id=None):
+        self.downlinks.schedule(base_topic, dev_id, base64_message, f_port, priority, gw_id)
@@ -1,2 +1,7 @@
-from ._rpc_module import Edge2LoRaApplicationServer
+from ._rpc_module import Edge2LoRaApplicationServer, AsyncEdge2LoRaApplicationServer
 from .__private__ import edge2applicationserver_pb2_grpc
+from ._fcnt_sets import (
+    encode_fcnts,
+    encode_fcnt_pairs,
+    fcnt_set_doc,
+)
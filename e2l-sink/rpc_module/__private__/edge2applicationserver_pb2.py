@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x1c\x65\x64ge2applicationserver.proto\x12\x16\x65\x64ge2applicationserver\"7\n\x0fResponseMessage\x12\x13\n\x0bstatus_code\x18\x01 \x01(\x11\x12\x0f\n\x07message\x18\x02 \x01(\t\"H\n\x0b\x45\x32GWPubInfo\x12\x12\n\ngw_ip_addr\x18\x01 \x01(\t\x12\x0f\n\x07gw_port\x18\x02 \x01(\t\x12\x14\n\x0c\x65\x32gw_pub_key\x18\x03 \x01(\x0c\"u\n\x08\x45\x64geData\x12\r\n\x05gw_id\x18\x01 \x01(\t\x12\x0f\n\x07\x64\x65v_eui\x18\x02 \x01(\t\x12\x10\n\x08\x64\x65v_addr\x18\x03 \x01(\t\x12\x17\n\x0f\x61ggregated_data\x18\x04 \x01(\x12\x12\r\n\x05\x66\x63nts\x18\x05 \x03(\x04\x12\x0f\n\x07timetag\x18\x06 \x01(\x04\"h\n\x05GwLog\x12\r\n\x05gw_id\x18\x01 \x01(\t\x12\x10\n\x08\x64\x65v_addr\x18\x02 \x01(\t\x12\x0b\n\x03log\x18\x03 \x01(\t\x12\x12\n\nframe_type\x18\x04 \x01(\x04\x12\x0c\n\x04\x66\x63nt\x18\x05 \x01(\x04\x12\x0f\n\x07timetag\x18\x06 \x01(\x04\"\x8b\x01\n\x06SysLog\x12\r\n\x05gw_id\x18\x01 \x01(\t\x12\x14\n\x0cmemory_usage\x18\x02 \x01(\x04\x12\x18\n\x10memory_available\x18\x03 \x01(\x04\x12\x11\n\tcpu_usage\x18\x04 \x01(\x02\x12\x15\n\rdata_received\x18\x05 \x01(\x04\x12\x18\n\x10\x64\x61ta_transmitted\x18\x06 \x01(\x04\"\xa4\x02\n\x0cGwFrameStats\x12\r\n\x05gw_id\x18\x01 \x01(\t\x12\x15\n\rlegacy_frames\x18\x02 \x01(\x04\x12\x38\n\x0clegacy_fcnts\x18\x03 \x03(\x0b\x32\".edge2applicationserver.FcntStruct\x12\x13\n\x0b\x65\x64ge_frames\x18\x04 \x01(\x04\x12\x36\n\nedge_fcnts\x18\x05 \x03(\x0b\x32\".edge2applicationserver.FcntStruct\x12!\n\x19\x65\x64ge_not_processed_frames\x18\x06 \x01(\x04\x12\x44\n\x18\x65\x64ge_not_processed_fcnts\x18\x07 \x03(\x0b\x32\".edge2applicationserver.FcntStruct\",\n\nFcntStruct\x12\x10\n\x08\x64\x65v_addr\x18\x03 \x01(\t\x12\x0c\n\x04\x66\x63nt\x18\x02 \x01(\x04\x32\xdc\x03\n\x16\x45\x64ge2ApplicationServer\x12U\n\x08new_data\x12 .edge2applicationserver.EdgeData\x1a\'.edge2applicationserver.ResponseMessage\x12\x63\n\x13store_e2gw_pub_info\x12#.edge2applicationserver.E2GWPubInfo\x1a\'.edge2applicationserver.ResponseMessage\x12P\n\x06gw_log\x12\x1d.edge2applicationserver.GwLog\x1a\'.edge2applicationserver.ResponseMessage\x12R\n\x07sys_log\x12\x1e.edge2applicationserver.SysLog\x1a\'.edge2applicationserver.ResponseMessage\x12`\n\x0fgw_frames_stats\x12$.edge2applicationserver.GwFrameStats\x1a\'.edge2applicationserver.ResponseMessageB:\n\x1dio.grpc.examples.edge2lorarpcB\x11\x45\x64ge2LoRaRPCProtoP\x01\xa2\x02\x03\x45\x32Lb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x1c\x65\x64ge2applicationserver.proto\x12\x16\x65\x64ge2applicationserver\"7\n\x0fResponseMessage\x12\x13\n\x0bstatus_code\x18\x01 \x01(\x11\x12\x0f\n\x07message\x18\x02 \x01(\t\"H\n\x0b\x45\x32GWPubInfo\x12\x12\n\ngw_ip_addr\x18\x01 \x01(\t\x12\x0f\n\x07gw_port\x18\x02 \x01(\t\x12\x14\n\x0c\x65\x32gw_pub_key\x18\x03 \x01(\x0c\"u\n\x08\x45\x64geData\x12\r\n\x05gw_id\x18\x01 \x01(\t\x12\x0f\n\x07\x64\x65v_eui\x18\x02 \x01(\t\x12\x10\n\x08\x64\x65v_addr\x18\x03 \x01(\t\x12\x17\n\x0f\x61ggregated_data\x18\x04 \x01(\x12\x12\r\n\x05\x66\x63nts\x18\x05 \x03(\x04\x12\x0f\n\x07timetag\x18\x06 \x01(\x04\"@\n\rEdgeDataBatch\x12/\n\x05items\x18\x01 \x03(\x0b\x32 .edge2applicationserver.EdgeData\"h\n\x05GwLog\x12\r\n\x05gw_id\x18\x01 \x01(\t\x12\x10\n\x08\x64\x65v_addr\x18\x02 \x01(\t\x12\x0b\n\x03log\x18\x03 \x01(\t\x12\x12\n\nframe_type\x18\x04 \x01(\x04\x12\x0c\n\x04\x66\x63nt\x18\x05 \x01(\x04\x12\x0f\n\x07timetag\x18\x06 \x01(\x04\":\n\nGwLogBatch\x12,\n\x05items\x18\x01 \x03(\x0b\x32\x1d.edge2applicationserver.GwLog\"\x8b\x01\n\x06SysLog\x12\r\n\x05gw_id\x18\x01 \x01(\t\x12\x14\n\x0cmemory_usage\x18\x02 \x01(\x04\x12\x18\n\x10memory_available\x18\x03 \x01(\x04\x12\x11\n\tcpu_usage\x18\x04 \x01(\x02\x12\x15\n\rdata_received\x18\x05 \x01(\x04\x12\x18\n\x10\x64\x61ta_transmitted\x18\x06 \x01(\x04\"\xdf\x03\n\x0cGwFrameStats\x12\r\n\x05gw_id\x18\x01 \x01(\t\x12\x15\n\rlegacy_frames\x18\x02 \x01(\x04\x12\x38\n\x0clegacy_fcnts\x18\x03 \x03(\x0b\x32\".edge2applicationserver.FcntStruct\x12\x13\n\x0b\x65\x64ge_frames\x18\x04 \x01(\x04\x12\x36\n\nedge_fcnts\x18\x05 \x03(\x0b\x32\".edge2applicationserver.FcntStruct\x12!\n\x19\x65\x64ge_not_processed_frames\x18\x06 \x01(\x04\x12\x44\n\x18\x65\x64ge_not_processed_fcnts\x18\x07 \x03(\x0b\x32\".edge2applicationserver.FcntStruct\x12\x39\n\x10legacy_fcnt_sets\x18\x08 \x03(\x0b\x32\x1f.edge2applicationserver.FcntSet\x12\x37\n\x0e\x65\x64ge_fcnt_sets\x18\t \x03(\x0b\x32\x1f.edge2applicationserver.FcntSet\x12\x45\n\x1c\x65\x64ge_not_processed_fcnt_sets\x18\n \x03(\x0b\x32\x1f.edge2applicationserver.FcntSet\",\n\nFcntStruct\x12\x10\n\x08\x64\x65v_addr\x18\x03 \x01(\t\x12\x0c\n\x04\x66\x63nt\x18\x02 \x01(\x04\"I\n\x07\x46\x63ntSet\x12\x10\n\x08\x64\x65v_addr\x18\x01 \x01(\t\x12\x0e\n\x06ranges\x18\x02 \x03(\x04\x12\x0c\n\x04\x62\x61se\x18\x03 \x01(\x04\x12\x0e\n\x06\x62itmap\x18\x04 \x01(\x0c\x32\xe0\x06\n\x16\x45\x64ge2ApplicationServer\x12U\n\x08new_data\x12 .edge2applicationserver.EdgeData\x1a\'.edge2applicationserver.ResponseMessage\x12\x63\n\x13store_e2gw_pub_info\x12#.edge2applicationserver.E2GWPubInfo\x1a\'.edge2applicationserver.ResponseMessage\x12P\n\x06gw_log\x12\x1d.edge2applicationserver.GwLog\x1a\'.edge2applicationserver.ResponseMessage\x12R\n\x07sys_log\x12\x1e.edge2applicationserver.SysLog\x1a\'.edge2applicationserver.ResponseMessage\x12`\n\x0fgw_frames_stats\x12$.edge2applicationserver.GwFrameStats\x1a\'.edge2applicationserver.ResponseMessage\x12`\n\x0enew_data_batch\x12%.edge2applicationserver.EdgeDataBatch\x1a\'.edge2applicationserver.ResponseMessage\x12\x63\n\x0fnew_data_stream\x12%.edge2applicationserver.EdgeDataBatch\x1a\'.edge2applicationserver.ResponseMessage(\x01\x12[\n\x0cgw_log_batch\x12\".edge2applicationserver.GwLogBatch\x1a\'.edge2applicationserver.ResponseMessage\x12^\n\rgw_log_stream\x12\".edge2applicationserver.GwLogBatch\x1a\'.edge2applicationserver.ResponseMessage(\x01\x42:\n\x1dio.grpc.examples.edge2lorarpcB\x11\x45\x64ge2LoRaRPCProtoP\x01\xa2\x02\x03\x45\x32Lb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -28,14 +28,20 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   _globals['_E2GWPUBINFO']._serialized_end=185
   _globals['_EDGEDATA']._serialized_start=187
   _globals['_EDGEDATA']._serialized_end=304
-  _globals['_GWLOG']._serialized_start=306
-  _globals['_GWLOG']._serialized_end=410
-  _globals['_SYSLOG']._serialized_start=413
-  _globals['_SYSLOG']._serialized_end=552
-  _globals['_GWFRAMESTATS']._serialized_start=555
-  _globals['_GWFRAMESTATS']._serialized_end=847
-  _globals['_FCNTSTRUCT']._serialized_start=849
-  _globals['_FCNTSTRUCT']._serialized_end=893
-  _globals['_EDGE2APPLICATIONSERVER']._serialized_start=896
-  _globals['_EDGE2APPLICATIONSERVER']._serialized_end=1372
+  _globals['_EDGEDATABATCH']._serialized_start=306
+  _globals['_EDGEDATABATCH']._serialized_end=370
+  _globals['_GWLOG']._serialized_start=372
+  _globals['_GWLOG']._serialized_end=476
+  _globals['_GWLOGBATCH']._serialized_start=478
+  _globals['_GWLOGBATCH']._serialized_end=536
+  _globals['_SYSLOG']._serialized_start=539
+  _globals['_SYSLOG']._serialized_end=678
+  _globals['_GWFRAMESTATS']._serialized_start=681
+  _globals['_GWFRAMESTATS']._serialized_end=1160
+  _globals['_FCNTSTRUCT']._serialized_start=1162
+  _globals['_FCNTSTRUCT']._serialized_end=1206
+  _globals['_FCNTSET']._serialized_start=1208
+  _globals['_FCNTSET']._serialized_end=1281
+  _globals['_EDGE2APPLICATIONSERVER']._serialized_start=1284
+  _globals['_EDGE2APPLICATIONSERVER']._serialized_end=2148
 # @@protoc_insertion_point(module_scope)
@@ -39,6 +39,12 @@ class EdgeData(_message.Message):
     timetag: int
     def __init__(self, gw_id: _Optional[str] = ..., dev_eui: _Optional[str] = ..., dev_addr: _Optional[str] = ..., aggregated_data: _Optional[int] = ..., fcnts: _Optional[_Iterable[int]] = ..., timetag: _Optional[int] = ...) -> None: ...
 
+class EdgeDataBatch(_message.Message):
+    __slots__ = ["items"]
+    ITEMS_FIELD_NUMBER: _ClassVar[int]
+    items: _containers.RepeatedCompositeFieldContainer[EdgeData]
+    def __init__(self, items: _Optional[_Iterable[_Union[EdgeData, _Mapping]]] = ...) -> None: ...
+
 class GwLog(_message.Message):
     __slots__ = ["gw_id", "dev_addr", "log", "frame_type", "fcnt", "timetag"]
     GW_ID_FIELD_NUMBER: _ClassVar[int]
@@ -55,6 +61,12 @@ class GwLog(_message.Message):
     timetag: int
     def __init__(self, gw_id: _Optional[str] = ..., dev_addr: _Optional[str] = ..., log: _Optional[str] = ..., frame_type: _Optional[int] = ..., fcnt: _Optional[int] = ..., timetag: _Optional[int] = ...) -> None: ...
 
+class GwLogBatch(_message.Message):
+    __slots__ = ["items"]
+    ITEMS_FIELD_NUMBER: _ClassVar[int]
+    items: _containers.RepeatedCompositeFieldContainer[GwLog]
+    def __init__(self, items: _Optional[_Iterable[_Union[GwLog, _Mapping]]] = ...) -> None: ...
+
 class SysLog(_message.Message):
     __slots__ = ["gw_id", "memory_usage", "memory_available", "cpu_usage", "data_received", "data_transmitted"]
     GW_ID_FIELD_NUMBER: _ClassVar[int]
@@ -72,7 +84,7 @@ class SysLog(_message.Message):
     def __init__(self, gw_id: _Optional[str] = ..., memory_usage: _Optional[int] = ..., memory_available: _Optional[int] = ..., cpu_usage: _Optional[float] = ..., data_received: _Optional[int] = ..., data_transmitted: _Optional[int] = ...) -> None: ...
 
 class GwFrameStats(_message.Message):
-    __slots__ = ["gw_id", "legacy_frames", "legacy_fcnts", "edge_frames", "edge_fcnts", "edge_not_processed_frames", "edge_not_processed_fcnts"]
+    __slots__ = ["gw_id", "legacy_frames", "legacy_fcnts", "edge_frames", "edge_fcnts", "edge_not_processed_frames", "edge_not_processed_fcnts", "legacy_fcnt_sets", "edge_fcnt_sets", "edge_not_processed_fcnt_sets"]
     GW_ID_FIELD_NUMBER: _ClassVar[int]
     LEGACY_FRAMES_FIELD_NUMBER: _ClassVar[int]
     LEGACY_FCNTS_FIELD_NUMBER: _ClassVar[int]
@@ -80,6 +92,9 @@ class GwFrameStats(_message.Message):
     EDGE_FCNTS_FIELD_NUMBER: _ClassVar[int]
     EDGE_NOT_PROCESSED_FRAMES_FIELD_NUMBER: _ClassVar[int]
     EDGE_NOT_PROCESSED_FCNTS_FIELD_NUMBER: _ClassVar[int]
+    LEGACY_FCNT_SETS_FIELD_NUMBER: _ClassVar[int]
+    EDGE_FCNT_SETS_FIELD_NUMBER: _ClassVar[int]
+    EDGE_NOT_PROCESSED_FCNT_SETS_FIELD_NUMBER: _ClassVar[int]
     gw_id: str
     legacy_frames: int
     legacy_fcnts: _containers.RepeatedCompositeFieldContainer[FcntStruct]
@@ -87,7 +102,10 @@ class GwFrameStats(_message.Message):
     edge_fcnts: _containers.RepeatedCompositeFieldContainer[FcntStruct]
     edge_not_processed_frames: int
     edge_not_processed_fcnts: _containers.RepeatedCompositeFieldContainer[FcntStruct]
-    def __init__(self, gw_id: _Optional[str] = ..., legacy_frames: _Optional[int] = ..., legacy_fcnts: _Optional[_Iterable[_Union[FcntStruct, _Mapping]]] = ..., edge_frames: _Optional[int] = ..., edge_fcnts: _Optional[_Iterable[_Union[FcntStruct, _Mapping]]] = ..., edge_not_processed_frames: _Optional[int] = ..., edge_not_processed_fcnts: _Optional[_Iterable[_Union[FcntStruct, _Mapping]]] = ...) -> None: ...
+    legacy_fcnt_sets: _containers.RepeatedCompositeFieldContainer[FcntSet]
+    edge_fcnt_sets: _containers.RepeatedCompositeFieldContainer[FcntSet]
+    edge_not_processed_fcnt_sets: _containers.RepeatedCompositeFieldContainer[FcntSet]
+    def __init__(self, gw_id: _Optional[str] = ..., legacy_frames: _Optional[int] = ..., legacy_fcnts: _Optional[_Iterable[_Union[FcntStruct, _Mapping]]] = ..., edge_frames: _Optional[int] = ..., edge_fcnts: _Optional[_Iterable[_Union[FcntStruct, _Mapping]]] = ..., edge_not_processed_frames: _Optional[int] = ..., edge_not_processed_fcnts: _Optional[_Iterable[_Union[FcntStruct, _Mapping]]] = ..., legacy_fcnt_sets: _Optional[_Iterable[_Union[FcntSet, _Mapping]]] = ..., edge_fcnt_sets: _Optional[_Iterable[_Union[FcntSet, _Mapping]]] = ..., edge_not_processed_fcnt_sets: _Optional[_Iterable[_Union[FcntSet, _Mapping]]] = ...) -> None: ...
 
 class FcntStruct(_message.Message):
     __slots__ = ["dev_addr", "fcnt"]
@@ -96,3 +114,15 @@ class FcntStruct(_message.Message):
     dev_addr: str
     fcnt: int
     def __init__(self, dev_addr: _Optional[str] = ..., fcnt: _Optional[int] = ...) -> None: ...
+
+class FcntSet(_message.Message):
+    __slots__ = ["dev_addr", "ranges", "base", "bitmap"]
+    DEV_ADDR_FIELD_NUMBER: _ClassVar[int]
+    RANGES_FIELD_NUMBER: _ClassVar[int]
+    BASE_FIELD_NUMBER: _ClassVar[int]
+    BITMAP_FIELD_NUMBER: _ClassVar[int]
+    dev_addr: str
+    ranges: _containers.RepeatedScalarFieldContainer[int]
+    base: int
+    bitmap: bytes
+    def __init__(self, dev_addr: _Optional[str] = ..., ranges: _Optional[_Iterable[int]] = ..., base: _Optional[int] = ..., bitmap: _Optional[bytes] = ...) -> None: ...
@@ -15,30 +15,50 @@ class Edge2ApplicationServerStub(object):
             channel: A grpc.Channel.
         """
         self.new_data = channel.unary_unary(
-            "/edge2applicationserver.Edge2ApplicationServer/new_data",
-            request_serializer=edge2applicationserver__pb2.EdgeData.SerializeToString,
-            response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
-        )
+                '/edge2applicationserver.Edge2ApplicationServer/new_data',
+                request_serializer=edge2applicationserver__pb2.EdgeData.SerializeToString,
+                response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
+                )
         self.store_e2gw_pub_info = channel.unary_unary(
-            "/edge2applicationserver.Edge2ApplicationServer/store_e2gw_pub_info",
-            request_serializer=edge2applicationserver__pb2.E2GWPubInfo.SerializeToString,
-            response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
-        )
+                '/edge2applicationserver.Edge2ApplicationServer/store_e2gw_pub_info',
+                request_serializer=edge2applicationserver__pb2.E2GWPubInfo.SerializeToString,
+                response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
+                )
         self.gw_log = channel.unary_unary(
-            "/edge2applicationserver.Edge2ApplicationServer/gw_log",
-            request_serializer=edge2applicationserver__pb2.GwLog.SerializeToString,
-            response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
-        )
+                '/edge2applicationserver.Edge2ApplicationServer/gw_log',
+                request_serializer=edge2applicationserver__pb2.GwLog.SerializeToString,
+                response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
+                )
         self.sys_log = channel.unary_unary(
-            "/edge2applicationserver.Edge2ApplicationServer/sys_log",
-            request_serializer=edge2applicationserver__pb2.SysLog.SerializeToString,
-            response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
-        )
+                '/edge2applicationserver.Edge2ApplicationServer/sys_log',
+                request_serializer=edge2applicationserver__pb2.SysLog.SerializeToString,
+                response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
+                )
         self.gw_frames_stats = channel.unary_unary(
-            "/edge2applicationserver.Edge2ApplicationServer/gw_frames_stats",
-            request_serializer=edge2applicationserver__pb2.GwFrameStats.SerializeToString,
-            response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
-        )
+                '/edge2applicationserver.Edge2ApplicationServer/gw_frames_stats',
+                request_serializer=edge2applicationserver__pb2.GwFrameStats.SerializeToString,
+                response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
+                )
+        self.new_data_batch = channel.unary_unary(
+                '/edge2applicationserver.Edge2ApplicationServer/new_data_batch',
+                request_serializer=edge2applicationserver__pb2.EdgeDataBatch.SerializeToString,
+                response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
+                )
+        self.new_data_stream = channel.stream_unary(
+                '/edge2applicationserver.Edge2ApplicationServer/new_data_stream',
+                request_serializer=edge2applicationserver__pb2.EdgeDataBatch.SerializeToString,
+                response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
+                )
+        self.gw_log_batch = channel.unary_unary(
+                '/edge2applicationserver.Edge2ApplicationServer/gw_log_batch',
+                request_serializer=edge2applicationserver__pb2.GwLogBatch.SerializeToString,
+                response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
+                )
+        self.gw_log_stream = channel.stream_unary(
+                '/edge2applicationserver.Edge2ApplicationServer/gw_log_stream',
+                request_serializer=edge2applicationserver__pb2.GwLogBatch.SerializeToString,
+                response_deserializer=edge2applicationserver__pb2.ResponseMessage.FromString,
+                )
 
 
 class Edge2ApplicationServerServicer(object):
@@ -47,213 +67,266 @@ class Edge2ApplicationServerServicer(object):
     def new_data(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-        context.set_details("Method not implemented!")
-        raise NotImplementedError("Method not implemented!")
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
 
     def store_e2gw_pub_info(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-        context.set_details("Method not implemented!")
-        raise NotImplementedError("Method not implemented!")
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
 
     def gw_log(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-        context.set_details("Method not implemented!")
-        raise NotImplementedError("Method not implemented!")
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
 
     def sys_log(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-        context.set_details("Method not implemented!")
-        raise NotImplementedError("Method not implemented!")
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
 
     def gw_frames_stats(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-        context.set_details("Method not implemented!")
-        raise NotImplementedError("Method not implemented!")
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def new_data_batch(self, request, context):
+        """Batched versions of new_data and gw_log: the sink handles a batch as a
+        whole. The unary RPCs are kept for the gateways that do not batch.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def new_data_stream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def gw_log_batch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def gw_log_stream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
 
 
 def add_Edge2ApplicationServerServicer_to_server(servicer, server):
     rpc_method_handlers = {
-        "new_data": grpc.unary_unary_rpc_method_handler(
-            servicer.new_data,
-            request_deserializer=edge2applicationserver__pb2.EdgeData.FromString,
-            response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
-        ),
-        "store_e2gw_pub_info": grpc.unary_unary_rpc_method_handler(
-            servicer.store_e2gw_pub_info,
-            request_deserializer=edge2applicationserver__pb2.E2GWPubInfo.FromString,
-            response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
-        ),
-        "gw_log": grpc.unary_unary_rpc_method_handler(
-            servicer.gw_log,
-            request_deserializer=edge2applicationserver__pb2.GwLog.FromString,
-            response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
-        ),
-        "sys_log": grpc.unary_unary_rpc_method_handler(
-            servicer.sys_log,
-            request_deserializer=edge2applicationserver__pb2.SysLog.FromString,
-            response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
-        ),
-        "gw_frames_stats": grpc.unary_unary_rpc_method_handler(
-            servicer.gw_frames_stats,
-            request_deserializer=edge2applicationserver__pb2.GwFrameStats.FromString,
-            response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
-        ),
+            'new_data': grpc.unary_unary_rpc_method_handler(
+                    servicer.new_data,
+                    request_deserializer=edge2applicationserver__pb2.EdgeData.FromString,
+                    response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
+            ),
+            'store_e2gw_pub_info': grpc.unary_unary_rpc_method_handler(
+                    servicer.store_e2gw_pub_info,
+                    request_deserializer=edge2applicationserver__pb2.E2GWPubInfo.FromString,
+                    response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
+            ),
+            'gw_log': grpc.unary_unary_rpc_method_handler(
+                    servicer.gw_log,
+                    request_deserializer=edge2applicationserver__pb2.GwLog.FromString,
+                    response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
+            ),
+            'sys_log': grpc.unary_unary_rpc_method_handler(
+                    servicer.sys_log,
+                    request_deserializer=edge2applicationserver__pb2.SysLog.FromString,
+                    response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
+            ),
+            'gw_frames_stats': grpc.unary_unary_rpc_method_handler(
+                    servicer.gw_frames_stats,
+                    request_deserializer=edge2applicationserver__pb2.GwFrameStats.FromString,
+                    response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
+            ),
+            'new_data_batch': grpc.unary_unary_rpc_method_handler(
+                    servicer.new_data_batch,
+                    request_deserializer=edge2applicationserver__pb2.EdgeDataBatch.FromString,
+                    response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
+            ),
+            'new_data_stream': grpc.stream_unary_rpc_method_handler(
+                    servicer.new_data_stream,
+                    request_deserializer=edge2applicationserver__pb2.EdgeDataBatch.FromString,
+                    response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
+            ),
+            'gw_log_batch': grpc.unary_unary_rpc_method_handler(
+                    servicer.gw_log_batch,
+                    request_deserializer=edge2applicationserver__pb2.GwLogBatch.FromString,
+                    response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
+            ),
+            'gw_log_stream': grpc.stream_unary_rpc_method_handler(
+                    servicer.gw_log_stream,
+                    request_deserializer=edge2applicationserver__pb2.GwLogBatch.FromString,
+                    response_serializer=edge2applicationserver__pb2.ResponseMessage.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
-        "edge2applicationserver.Edge2ApplicationServer", rpc_method_handlers
-    )
+            'edge2applicationserver.Edge2ApplicationServer', rpc_method_handlers)
     server.add_generic_rpc_handlers((generic_handler,))
 
 
-# This class is part of an EXPERIMENTAL API.
+ # This class is part of an EXPERIMENTAL API.
 class Edge2ApplicationServer(object):
     """Missing associated documentation comment in .proto file."""
 
     @staticmethod
-    def new_data(
-        request,
-        target,
-        options=(),
-        channel_credentials=None,
-        call_credentials=None,
-        insecure=False,
-        compression=None,
-        wait_for_ready=None,
-        timeout=None,
-        metadata=None,
-    ):
-        return grpc.experimental.unary_unary(
-            request,
+    def new_data(request,
             target,
-            "/edge2applicationserver.Edge2ApplicationServer/new_data",
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/edge2applicationserver.Edge2ApplicationServer/new_data',
             edge2applicationserver__pb2.EdgeData.SerializeToString,
             edge2applicationserver__pb2.ResponseMessage.FromString,
-            options,
-            channel_credentials,
-            insecure,
-            call_credentials,
-            compression,
-            wait_for_ready,
-            timeout,
-            metadata,
-        )
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
     @staticmethod
-    def store_e2gw_pub_info(
-        request,
-        target,
-        options=(),
-        channel_credentials=None,
-        call_credentials=None,
-        insecure=False,
-        compression=None,
-        wait_for_ready=None,
-        timeout=None,
-        metadata=None,
-    ):
-        return grpc.experimental.unary_unary(
-            request,
+    def store_e2gw_pub_info(request,
             target,
-            "/edge2applicationserver.Edge2ApplicationServer/store_e2gw_pub_info",
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/edge2applicationserver.Edge2ApplicationServer/store_e2gw_pub_info',
             edge2applicationserver__pb2.E2GWPubInfo.SerializeToString,
             edge2applicationserver__pb2.ResponseMessage.FromString,
-            options,
-            channel_credentials,
-            insecure,
-            call_credentials,
-            compression,
-            wait_for_ready,
-            timeout,
-            metadata,
-        )
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
     @staticmethod
-    def gw_log(
-        request,
-        target,
-        options=(),
-        channel_credentials=None,
-        call_credentials=None,
-        insecure=False,
-        compression=None,
-        wait_for_ready=None,
-        timeout=None,
-        metadata=None,
-    ):
-        return grpc.experimental.unary_unary(
-            request,
+    def gw_log(request,
             target,
-            "/edge2applicationserver.Edge2ApplicationServer/gw_log",
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/edge2applicationserver.Edge2ApplicationServer/gw_log',
             edge2applicationserver__pb2.GwLog.SerializeToString,
             edge2applicationserver__pb2.ResponseMessage.FromString,
-            options,
-            channel_credentials,
-            insecure,
-            call_credentials,
-            compression,
-            wait_for_ready,
-            timeout,
-            metadata,
-        )
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
     @staticmethod
-    def sys_log(
-        request,
-        target,
-        options=(),
-        channel_credentials=None,
-        call_credentials=None,
-        insecure=False,
-        compression=None,
-        wait_for_ready=None,
-        timeout=None,
-        metadata=None,
-    ):
-        return grpc.experimental.unary_unary(
-            request,
+    def sys_log(request,
             target,
-            "/edge2applicationserver.Edge2ApplicationServer/sys_log",
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/edge2applicationserver.Edge2ApplicationServer/sys_log',
             edge2applicationserver__pb2.SysLog.SerializeToString,
             edge2applicationserver__pb2.ResponseMessage.FromString,
-            options,
-            channel_credentials,
-            insecure,
-            call_credentials,
-            compression,
-            wait_for_ready,
-            timeout,
-            metadata,
-        )
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
     @staticmethod
-    def gw_frames_stats(
-        request,
-        target,
-        options=(),
-        channel_credentials=None,
-        call_credentials=None,
-        insecure=False,
-        compression=None,
-        wait_for_ready=None,
-        timeout=None,
-        metadata=None,
-    ):
-        return grpc.experimental.unary_unary(
-            request,
+    def gw_frames_stats(request,
             target,
-            "/edge2applicationserver.Edge2ApplicationServer/gw_frames_stats",
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/edge2applicationserver.Edge2ApplicationServer/gw_frames_stats',
             edge2applicationserver__pb2.GwFrameStats.SerializeToString,
             edge2applicationserver__pb2.ResponseMessage.FromString,
-            options,
-            channel_credentials,
-            insecure,
-            call_credentials,
-            compression,
-            wait_for_ready,
-            timeout,
-            metadata,
-        )
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def new_data_batch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/edge2applicationserver.Edge2ApplicationServer/new_data_batch',
+            edge2applicationserver__pb2.EdgeDataBatch.SerializeToString,
+            edge2applicationserver__pb2.ResponseMessage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def new_data_stream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/edge2applicationserver.Edge2ApplicationServer/new_data_stream',
+            edge2applicationserver__pb2.EdgeDataBatch.SerializeToString,
+            edge2applicationserver__pb2.ResponseMessage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def gw_log_batch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/edge2applicationserver.Edge2ApplicationServer/gw_log_batch',
+            edge2applicationserver__pb2.GwLogBatch.SerializeToString,
+            edge2applicationserver__pb2.ResponseMessage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def gw_log_stream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(request_iterator, target, '/edge2applicationserver.Edge2ApplicationServer/gw_log_stream',
+            edge2applicationserver__pb2.GwLogBatch.SerializeToString,
+            edge2applicationserver__pb2.ResponseMessage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
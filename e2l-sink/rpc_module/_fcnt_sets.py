@@ -0,0 +1,105 @@
+import base64
+
+# FCNT SET ENCODINGS
+# Runs of consecutive fcnts, flattened: [start, length, start, length, ...]
+RANGES_KEY = "ranges"
+# Bitmap of the fcnts from base (bit i, LSB first, set if base + i is in the set)
+BASE_KEY = "base"
+BITMAP_KEY = "bitmap"
+
+# Approximate wire size of a run (two varints)
+RUN_BYTES = 4
+
+
+"""
+    @brief  This function returns the runs of consecutive values of a fcnt list.
+    @param fcnts: The fcnts (any order, duplicates allowed).
+    @return list of (start, length).
+"""
+
+
+def fcnt_runs(fcnts):
+    runs = []
+    start = None
+    last = None
+    for fcnt in sorted(set(fcnts)):
+        if last is not None and fcnt == last + 1:
+            last = fcnt
+            continue
+        if start is not None:
+            runs.append((start, last - start + 1))
+        start = fcnt
+        last = fcnt
+    if start is not None:
+        runs.append((start, last - start + 1))
+    return runs
+
+
+"""
+    @brief  This function encodes a fcnt list in the smaller of the two
+            encodings (runs or bitmap).
+    @param fcnts: The fcnts.
+    @return (ranges, base, bitmap): ranges is the flat run list (empty if the
+            bitmap is used), bitmap the bytes (empty if the runs are used).
+"""
+
+
+def encode_fcnts(fcnts):
+    runs = fcnt_runs(fcnts)
+    if len(runs) == 0:
+        return [], 0, b""
+    base = runs[0][0]
+    span = runs[-1][0] + runs[-1][1] - base
+    if (span + 7) // 8 >= len(runs) * RUN_BYTES:
+        ranges = []
+        for start, length in runs:
+            ranges.append(start)
+            ranges.append(length)
+        return ranges, 0, b""
+    # One big int operation per run, not per fcnt
+    bits = 0
+    for start, length in runs:
+        bits |= ((1 << length) - 1) << (start - base)
+    return [], base, bits.to_bytes((span + 7) // 8, "little")
+
+
+"""
+    @brief  This function returns the stored form of a fcnt set.
+    @param dev_addr: The Dev Addr.
+    @param ranges: The flat run list.
+    @param base: The first fcnt of the bitmap.
+    @param bitmap: The bitmap (bytes).
+    @return dict.
+"""
+
+
+def fcnt_set_doc(dev_addr, ranges=(), base=0, bitmap=b""):
+    doc = {"dev_addr": dev_addr}
+    if len(ranges) > 0:
+        doc[RANGES_KEY] = list(ranges)
+    if len(bitmap) > 0:
+        doc[BASE_KEY] = base
+        doc[BITMAP_KEY] = base64.b64encode(bitmap).decode("ascii")
+    return doc
+
+
+"""
+    @brief  This function groups (dev_addr, fcnt) pairs per device and encodes them.
+    @param pairs: Iterable of (dev_addr, fcnt).
+    @return list of fcnt set docs, one per dev_addr.
+"""
+
+
+def encode_fcnt_pairs(pairs):
+    grouped = {}
+    for dev_addr, fcnt in pairs:
+        fcnts = grouped.get(dev_addr)
+        if fcnts is None:
+            fcnts = grouped[dev_addr] = []
+        fcnts.append(fcnt)
+    docs = []
+    for dev_addr, fcnts in grouped.items():
+        ranges, base, bitmap = encode_fcnts(fcnts)
+        docs.append(fcnt_set_doc(dev_addr, ranges, base, bitmap))
+    return docs
+
@@ -2,11 +2,19 @@ import os
 import logging
 import time
 import math
+import grpc
 from rpc_module.__private__ import edge2applicationserver_pb2_grpc
-from rpc_module.__private__.edge2applicationserver_pb2 import ResponseMessage
+from rpc_module.__private__.edge2applicationserver_pb2 import (
+    ResponseMessage,
+    EdgeDataBatch,
+    GwLogBatch,
+)
+from rpc_module._fcnt_sets import fcnt_set_doc, encode_fcnt_pairs
 
 log = logging.getLogger(__name__)
 
+OK_RESPONSE = ResponseMessage(status_code=0, message="OK")
+
 
 class Edge2LoRaApplicationServer(
     edge2applicationserver_pb2_grpc.Edge2ApplicationServerServicer
@@ -19,100 +27,407 @@ class Edge2LoRaApplicationServer(
         self.data_received_callback = callback
 
     def store_e2gw_pub_info(self, request, context):
-        gw_rpc_endpoint_address = request.gw_ip_addr
-        gw_rpc_endpoint_port = request.gw_port
-
-        gw_pub_key_compressed = request.e2gw_pub_key
-        ret = self.e2l_module.handle_gw_pub_info(
-            gw_rpc_endpoint_address, gw_rpc_endpoint_port, gw_pub_key_compressed
-        )
+        ret = self.e2l_module.handle_gw_pub_info(**_gw_pub_info_args(request))
         if ret != 0:
             return ResponseMessage(status_code=500, message=b"Error")
         return ResponseMessage(status_code=200, message=b"Success")
 
-    def new_data(self, request, context):
-        # now = math.floor(time.time() * 1000)
-        gw_id = request.gw_id
-        dev_eui = request.dev_eui
-        dev_addr = request.dev_addr
-        aggregated_data = request.aggregated_data
-        fcnts = list(request.fcnts)
-        timetag = request.timetag
-        # delta_time = now - timetag
-
-        self.e2l_module.handle_edge_data(
-            gw_id=gw_id,
-            dev_eui=dev_eui,
-            dev_addr=dev_addr,
-            aggregated_data=aggregated_data,
-            timetag=timetag,
-            fcnts=fcnts,
+    """
+        @brief  This function forwards a RPC to the worker owning the device (cluster mode).
+        @param method: The RPC name.
+        @param dev_eui: The Dev EUI, None if unknown.
+        @param request: The RPC request.
+        @param context: The RPC context.
+        @return The owner response, None if the RPC shall be handled locally.
+    """
+
+    def _forward(self, method, dev_eui, request, context):
+        owner = self.e2l_module.cluster.forward_target(dev_eui, context)
+        if owner is None:
+            return None
+        return self._forward_to(owner, method, request)
+
+    def _forward_to(self, owner, method, request):
+        try:
+            return self.e2l_module.cluster.forward(owner, method, request)
+        except grpc.RpcError as e:
+            log.warning(f"Unable to forward {method} to {owner}, handled locally: {e}")
+            return None
+
+    """
+        @brief  This function forwards the items of a batch owned by other
+                workers (cluster mode), one sub-batch per owner.
+        @param method: The batch RPC name.
+        @param batch_type: The batch message class.
+        @param items: The batch items.
+        @param dev_eui_of: function(item) returning the Dev EUI of an item.
+        @param context: The RPC context.
+        @return (items to handle locally, number of forwarded items that failed).
+    """
+
+    def _forward_batch(self, method, batch_type, items, dev_eui_of, context):
+        local, remote = _split_batch(
+            self.e2l_module.cluster, items, dev_eui_of, context
         )
+        failed = 0
+        for owner, owner_items in remote.items():
+            response = self._forward_to(owner, method, batch_type(items=owner_items))
+            if response is None:
+                local.extend(owner_items)
+            elif response.status_code != 0:
+                failed += len(owner_items)
+        return local, failed
 
-        return ResponseMessage(status_code=0, message="OK")
+    def _new_data_batch(self, items, context):
+        failed = 0
+        if self.e2l_module.cluster is not None:
+            items, failed = self._forward_batch(
+                "new_data_batch", EdgeDataBatch, items, _edge_data_dev_eui, context
+            )
+        if len(items) > 0:
+            failed += self.e2l_module.handle_edge_data_batch(
+                [_edge_data_args(item) for item in items]
+            )
+        return failed
+
+    def _gw_log_batch(self, items, context):
+        failed = 0
+        if self.e2l_module.cluster is not None:
+            items, failed = self._forward_batch(
+                "gw_log_batch",
+                GwLogBatch,
+                items,
+                lambda item: self.e2l_module.get_dev_eui(item.dev_addr),
+                context,
+            )
+        if len(items) > 0:
+            failed += self.e2l_module.handle_gw_log_batch(
+                [_gw_log_args(item) for item in items]
+            )
+        return failed
+
+    def new_data(self, request, context):
+        start = time.perf_counter()
+        response = None
+        if self.e2l_module.cluster is not None:
+            response = self._forward("new_data", request.dev_eui, request, context)
+        if response is None:
+            self.e2l_module.handle_edge_data(**_edge_data_args(request))
+            response = OK_RESPONSE
+        self.e2l_module.observe_handler_latency("new_data", start)
+        return response
 
     def gw_log(self, request, context):
-        gw_id = request.gw_id
-        dev_addr = request.dev_addr
-        log = request.log
-        frame_type = request.frame_type
-        fcnt = request.fcnt
-        timetag = request.timetag
-
-        self.e2l_module.handle_gw_log(
-            gw_id=gw_id,
-            dev_addr=dev_addr,
-            log_message=log,
-            frame_type=frame_type,
-            fcnt=fcnt,
-            timetag=timetag,
-        )
-        return ResponseMessage(status_code=0, message="OK")
+        start = time.perf_counter()
+        response = None
+        if self.e2l_module.cluster is not None:
+            dev_eui = self.e2l_module.get_dev_eui(request.dev_addr)
+            response = self._forward("gw_log", dev_eui, request, context)
+        if response is None:
+            self.e2l_module.handle_gw_log(**_gw_log_args(request))
+            response = OK_RESPONSE
+        self.e2l_module.observe_handler_latency("gw_log", start)
+        return response
+
+    def new_data_batch(self, request, context):
+        start = time.perf_counter()
+        failed = self._new_data_batch(list(request.items), context)
+        self.e2l_module.observe_handler_latency("new_data_batch", start)
+        return _batch_response(failed, len(request.items))
+
+    def new_data_stream(self, request_iterator, context):
+        failed = 0
+        total = 0
+        for request in request_iterator:
+            start = time.perf_counter()
+            failed += self._new_data_batch(list(request.items), context)
+            total += len(request.items)
+            self.e2l_module.observe_handler_latency("new_data_stream", start)
+        return _batch_response(failed, total)
+
+    def gw_log_batch(self, request, context):
+        start = time.perf_counter()
+        failed = self._gw_log_batch(list(request.items), context)
+        self.e2l_module.observe_handler_latency("gw_log_batch", start)
+        return _batch_response(failed, len(request.items))
+
+    def gw_log_stream(self, request_iterator, context):
+        failed = 0
+        total = 0
+        for request in request_iterator:
+            start = time.perf_counter()
+            failed += self._gw_log_batch(list(request.items), context)
+            total += len(request.items)
+            self.e2l_module.observe_handler_latency("gw_log_stream", start)
+        return _batch_response(failed, total)
 
     def sys_log(self, request, context):
-        gw_id = request.gw_id
-        memory_usage = request.memory_usage
-        memory_available = request.memory_available
-        cpu_usage = request.cpu_usage
-        data_received = request.data_received
-        data_transmitted = request.data_transmitted
-        self.e2l_module.handle_sys_log(
-            gw_id=gw_id,
-            memory_usage=memory_usage,
-            memory_available=memory_available,
-            cpu_usage=cpu_usage,
-            data_received=data_received,
-            data_transmitted=data_transmitted,
-        )
+        start = time.perf_counter()
+        self.e2l_module.handle_sys_log(**_sys_log_args(request))
+        self.e2l_module.observe_handler_latency("sys_log", start)
         return ResponseMessage(status_code=0, message="OK")
 
     def gw_frames_stats(self, request, context):
-        gw_id = request.gw_id
-        legacy_frames = request.legacy_frames
-        legacy_fcnts_it = list(request.legacy_fcnts)
-        legacy_fcnts = []
-        for elem in legacy_fcnts_it:
-            legacy_fcnts.append({"dev_addr": elem.dev_addr, "fcnt": elem.fcnt})
-        edge_frames = request.edge_frames
-        edge_fcnts_it = list(request.edge_fcnts)
-        edge_fcnts = []
-        for elem in legacy_fcnts_it:
-            edge_fcnts.append({"dev_addr": elem.dev_addr, "fcnt": elem.fcnt})
-        edge_not_processed_frames = request.edge_not_processed_frames
-        edge_not_processed_fcnts_it = list(request.edge_not_processed_fcnts)
-        edge_not_processed_fcnts = []
-        for elem in legacy_fcnts_it:
-            edge_not_processed_fcnts.append(
-                {"dev_addr": elem.dev_addr, "fcnt": elem.fcnt}
-            )
+        start = time.perf_counter()
+        self.e2l_module.handle_gw_frames_stats(**_gw_frames_stats_args(request))
+        self.e2l_module.observe_handler_latency("gw_frames_stats", start)
+        return ResponseMessage(status_code=0, message="OK")
+
+
+class AsyncEdge2LoRaApplicationServer(
+    edge2applicationserver_pb2_grpc.Edge2ApplicationServerServicer
+):
+    """
+    grpc.aio version of the servicer, it awaits the AsyncE2LoRaModule handlers.
+    """
+
+    def __init__(self, e2l_module) -> None:
+        super().__init__()
+        self.e2l_module = e2l_module
+
+    async def store_e2gw_pub_info(self, request, context):
+        ret = await self.e2l_module.handle_gw_pub_info(**_gw_pub_info_args(request))
+        if ret != 0:
+            return ResponseMessage(status_code=500, message=b"Error")
+        return ResponseMessage(status_code=200, message=b"Success")
+
+    async def _forward(self, method, dev_eui, request, context):
+        owner = self.e2l_module.cluster.forward_target(dev_eui, context)
+        if owner is None:
+            return None
+        return await self._forward_to(owner, method, request)
+
+    async def _forward_to(self, owner, method, request):
+        try:
+            return await self.e2l_module.cluster.forward_async(owner, method, request)
+        except grpc.RpcError as e:
+            log.warning(f"Unable to forward {method} to {owner}, handled locally: {e}")
+            return None
 
-        self.e2l_module.handle_gw_frames_stats(
-            gw_id=gw_id,
-            legacy_frames=legacy_frames,
-            legacy_fcnts=legacy_fcnts,
-            edge_frames=edge_frames,
-            edge_fcnts=edge_fcnts,
-            edge_not_processed_frames=edge_not_processed_frames,
-            edge_not_processed_fcnts=edge_not_processed_fcnts,
+    async def _forward_batch(self, method, batch_type, items, dev_eui_of, context):
+        local, remote = _split_batch(
+            self.e2l_module.cluster, items, dev_eui_of, context
         )
+        failed = 0
+        for owner, owner_items in remote.items():
+            response = await self._forward_to(
+                owner, method, batch_type(items=owner_items)
+            )
+            if response is None:
+                local.extend(owner_items)
+            elif response.status_code != 0:
+                failed += len(owner_items)
+        return local, failed
+
+    async def _new_data_batch(self, items, context):
+        failed = 0
+        if self.e2l_module.cluster is not None:
+            items, failed = await self._forward_batch(
+                "new_data_batch", EdgeDataBatch, items, _edge_data_dev_eui, context
+            )
+        if len(items) > 0:
+            failed += await self.e2l_module.handle_edge_data_batch(
+                [_edge_data_args(item) for item in items]
+            )
+        return failed
+
+    async def _gw_log_batch(self, items, context):
+        failed = 0
+        if self.e2l_module.cluster is not None:
+            items, failed = await self._forward_batch(
+                "gw_log_batch",
+                GwLogBatch,
+                items,
+                lambda item: self.e2l_module.get_dev_eui(item.dev_addr),
+                context,
+            )
+        if len(items) > 0:
+            failed += await self.e2l_module.handle_gw_log_batch(
+                [_gw_log_args(item) for item in items]
+            )
+        return failed
+
+    async def new_data(self, request, context):
+        start = time.perf_counter()
+        response = None
+        if self.e2l_module.cluster is not None:
+            response = await self._forward(
+                "new_data", request.dev_eui, request, context
+            )
+        if response is None:
+            await self.e2l_module.handle_edge_data(**_edge_data_args(request))
+            response = OK_RESPONSE
+        self.e2l_module.observe_handler_latency("new_data", start)
+        return response
+
+    async def gw_log(self, request, context):
+        start = time.perf_counter()
+        response = None
+        if self.e2l_module.cluster is not None:
+            dev_eui = self.e2l_module.get_dev_eui(request.dev_addr)
+            response = await self._forward("gw_log", dev_eui, request, context)
+        if response is None:
+            await self.e2l_module.handle_gw_log(**_gw_log_args(request))
+            response = OK_RESPONSE
+        self.e2l_module.observe_handler_latency("gw_log", start)
+        return response
+
+    async def new_data_batch(self, request, context):
+        start = time.perf_counter()
+        failed = await self._new_data_batch(list(request.items), context)
+        self.e2l_module.observe_handler_latency("new_data_batch", start)
+        return _batch_response(failed, len(request.items))
+
+    async def new_data_stream(self, request_iterator, context):
+        failed = 0
+        total = 0
+        async for request in request_iterator:
+            start = time.perf_counter()
+            failed += await self._new_data_batch(list(request.items), context)
+            total += len(request.items)
+            self.e2l_module.observe_handler_latency("new_data_stream", start)
+        return _batch_response(failed, total)
+
+    async def gw_log_batch(self, request, context):
+        start = time.perf_counter()
+        failed = await self._gw_log_batch(list(request.items), context)
+        self.e2l_module.observe_handler_latency("gw_log_batch", start)
+        return _batch_response(failed, len(request.items))
+
+    async def gw_log_stream(self, request_iterator, context):
+        failed = 0
+        total = 0
+        async for request in request_iterator:
+            start = time.perf_counter()
+            failed += await self._gw_log_batch(list(request.items), context)
+            total += len(request.items)
+            self.e2l_module.observe_handler_latency("gw_log_stream", start)
+        return _batch_response(failed, total)
+
+    async def sys_log(self, request, context):
+        start = time.perf_counter()
+        await self.e2l_module.handle_sys_log(**_sys_log_args(request))
+        self.e2l_module.observe_handler_latency("sys_log", start)
+        return ResponseMessage(status_code=0, message="OK")
+
+    async def gw_frames_stats(self, request, context):
+        start = time.perf_counter()
+        await self.e2l_module.handle_gw_frames_stats(**_gw_frames_stats_args(request))
+        self.e2l_module.observe_handler_latency("gw_frames_stats", start)
         return ResponseMessage(status_code=0, message="OK")
+
+
+"""
+    @brief  This function returns the response to a batch RPC.
+    @param failed: The number of items that failed.
+    @param total: The number of items received.
+    @return ResponseMessage.
+"""
+
+
+def _batch_response(failed, total):
+    if failed > 0:
+        return ResponseMessage(
+            status_code=-1, message=f"{failed} of {total} items failed"
+        )
+    return OK_RESPONSE
+
+
+"""
+    @brief  This function splits the items of a batch between this worker and
+            the workers owning the devices (cluster mode).
+    @param cluster: The Cluster.
+    @param items: The batch items.
+    @param dev_eui_of: function(item) returning the Dev EUI of an item.
+    @param context: The RPC context.
+    @return (local items, dict owner -> items).
+"""
+
+
+def _split_batch(cluster, items, dev_eui_of, context):
+    local = []
+    remote = {}
+    for item in items:
+        owner = cluster.forward_target(dev_eui_of(item), context)
+        if owner is None:
+            local.append(item)
+        else:
+            remote.setdefault(owner, []).append(item)
+    return local, remote
+
+
+def _edge_data_dev_eui(item):
+    return item.dev_eui
+
+
+"""
+    @brief  The following functions map a RPC request to the arguments of the
+            corresponding E2LoRaModule handler.
+    @param request: The RPC request.
+    @return dict of handler arguments.
+"""
+
+
+def _gw_pub_info_args(request):
+    return {
+        "gw_rpc_endpoint_address": request.gw_ip_addr,
+        "gw_rpc_endpoint_port": request.gw_port,
+        "gw_pub_key_compressed": request.e2gw_pub_key,
+    }
+
+
+def _edge_data_args(request):
+    return {
+        "gw_id": request.gw_id,
+        "dev_eui": request.dev_eui,
+        "dev_addr": request.dev_addr,
+        "aggregated_data": request.aggregated_data,
+        "timetag": request.timetag,
+        "fcnts": list(request.fcnts),
+    }
+
+
+def _gw_log_args(request):
+    return {
+        "gw_id": request.gw_id,
+        "dev_addr": request.dev_addr,
+        "log_message": request.log,
+        "frame_type": request.frame_type,
+        "fcnt": request.fcnt,
+        "timetag": request.timetag,
+    }
+
+
+def _sys_log_args(request):
+    return {
+        "gw_id": request.gw_id,
+        "memory_usage": request.memory_usage,
+        "memory_available": request.memory_available,
+        "cpu_usage": request.cpu_usage,
+        "data_received": request.data_received,
+        "data_transmitted": request.data_transmitted,
+    }
+
+
+def _fcnt_sets_arg(fcnt_sets, fcnt_structs):
+    if len(fcnt_sets) > 0:
+        return [
+            fcnt_set_doc(elem.dev_addr, elem.ranges, elem.base, elem.bitmap)
+            for elem in fcnt_sets
+        ]
+    # Gateways sending one FcntStruct per frame
+    return encode_fcnt_pairs((elem.dev_addr, elem.fcnt) for elem in fcnt_structs)
+
+
+def _gw_frames_stats_args(request):
+    return {
+        "gw_id": request.gw_id,
+        "legacy_frames": request.legacy_frames,
+        "legacy_fcnts": _fcnt_sets_arg(request.legacy_fcnt_sets, request.legacy_fcnts),
+        "edge_frames": request.edge_frames,
+        "edge_fcnts": _fcnt_sets_arg(request.edge_fcnt_sets, request.edge_fcnts),
+        "edge_not_processed_frames": request.edge_not_processed_frames,
+        "edge_not_processed_fcnts": _fcnt_sets_arg(
+            request.edge_not_processed_fcnt_sets, request.edge_not_processed_fcnts
+        ),
+    }
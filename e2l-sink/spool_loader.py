@@ -0,0 +1,65 @@
+"""
+Offline loader of the experiment spools (STORAGE_BACKEND=spool): it bulk-imports
+the sealed segments of a spool into MongoDB, with the collection layout and the
+indexes recorded in the spool manifest.
+
+    python spool_loader.py <spool_dir> [--mongo-host localhost] [--include-open] ...
+
+Importing a spool twice is harmless, the documents already stored are skipped.
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+
+from pymongo import MongoClient
+
+from db_module import load_spool, read_spool_manifest
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("spool_dir", help="spool of an experiment (SPOOL_DIR/<id>)")
+    parser.add_argument("--mongo-host", default=os.getenv("MONGO_HOST", "localhost"))
+    parser.add_argument(
+        "--mongo-port", type=int, default=int(os.getenv("MONGO_PORT", "27017"))
+    )
+    parser.add_argument(
+        "--mongo-db-name", default=os.getenv("MONGO_DB_NAME", "experiments_db")
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument(
+        "--include-open",
+        action="store_true",
+        help="also import the segments not sealed (sink crashed)",
+    )
+    args = parser.parse_args()
+
+    manifest = read_spool_manifest(args.spool_dir)
+    log.info(
+        f"Importing experiment {manifest['experiment_id']} "
+        f"({manifest['db_layout']} layout, {manifest['codec']} spool)"
+    )
+    db = MongoClient(args.mongo_host, args.mongo_port)[args.mongo_db_name]
+    start = time.perf_counter()
+    report = load_spool(
+        args.spool_dir,
+        db,
+        batch_size=args.batch_size,
+        include_open=args.include_open,
+    )
+    elapsed = time.perf_counter() - start
+    report["seconds"] = elapsed
+    report["documents_per_sec"] = report["documents"] / elapsed if elapsed > 0 else 0
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()